@@ -0,0 +1,531 @@
+import math
+import time
+import warnings
+from typing import Optional
+
+import torch
+from qwen_vl_utils import process_vision_info
+from transformers import (
+    AutoProcessor,
+    LogitsProcessorList,
+    Qwen2_5_VLForConditionalGeneration,
+    RepetitionPenaltyLogitsProcessor,
+    StoppingCriteriaList,
+)
+
+from batch_preprocessing import BatchImageProcessor
+from constrained_decoding import SchemaLogitsProcessor, SchemaVocabulary
+from embedding_cache import CachedVisionTower, VisualEmbeddingCache
+from instrumentation import FirstTokenTimer, add_time, span
+from post_processing import OCRPostProcessor
+from prefix_cache import PrefixKVCache
+from stopping import FieldsEmittedCriteria
+
+
+class InferenceBackend:
+    """
+    Model side of `TechnicalDrawingExtractor`: turns a batch of prompts into raw
+    text outputs. The extractor only talks to the model through `prepare`,
+    `generate_batch` and `decode`, so the model can be swapped for a stub.
+    """
+
+    model_name: str
+    min_pixels: int
+    max_pixels: int
+    # Optional accelerations; the extractor keys its prompts for them when present
+    embedding_cache: Optional[VisualEmbeddingCache] = None
+    prefix_cache: Optional[PrefixKVCache] = None
+    # Decoding modes that change the outputs; part of the result cache key
+    constrained_decoding: bool = False
+    stop_on_fields: bool = False
+
+    def prepare(self, prompts: list[list[dict]], metrics: Optional[dict] = None):
+        """
+        Collate chat-formatted prompts into one batch of model inputs.
+        :param metrics: Instrumentation record to add timings, input token and
+            image pixel counts to, or None when instrumentation is off.
+        """
+        raise NotImplementedError
+
+    def generate_batch(
+        self,
+        inputs,
+        max_new_tokens: int,
+        image_keys: Optional[list[str]] = None,
+        metrics: Optional[dict] = None,
+        fields: Optional[list[Optional[list[str]]]] = None,
+    ):
+        """
+        Generate the outputs of a prepared batch.
+        :param inputs: Batch returned by `prepare`.
+        :param max_new_tokens: Maximum number of tokens generated per prompt.
+        :param image_keys: Visual embedding cache keys of the images of the batch.
+        :param metrics: Instrumentation record to add timings to, or None.
+        :param fields: Fields each prompt asks for, None for a prompt asking for
+            all of them. Constrained decoding and early stopping follow them.
+        """
+        raise NotImplementedError
+
+    def decode(self, inputs, outputs) -> tuple[list[str], list[int]]:
+        """
+        Decode generated outputs.
+        :return: Output text and number of generated tokens of each prompt.
+        """
+        raise NotImplementedError
+
+
+class HFBackend(InferenceBackend):
+    """
+    Qwen2.5-VL through `transformers`, with the optional visual embedding cache,
+    prefix KV cache reuse, schema-constrained decoding and early stopping.
+    """
+
+    def __init__(
+        self,
+        model_name: str = "Qwen/Qwen2.5-VL-3B-Instruct",
+        dtype: torch.dtype = torch.bfloat16,
+        attn_implementation: str = "flash_attention_2",
+        device_map: str = "auto",
+        min_pixels: int = 512 * 28 * 28,
+        max_pixels: int = 1536 * 28 * 28,
+        use_fast: bool = True,
+        embedding_cache: bool = False,
+        embedding_cache_dir: Optional[str] = None,
+        embedding_cache_size: int = 256,
+        reuse_prefix_cache: bool = False,
+        constrained_decoding: bool = False,
+        stop_on_fields: bool = False,
+        batch_image_processor: bool = False,
+    ) -> None:
+        """
+        :param batch_image_processor: Preprocess the images of a batch as stacked
+            tensors with `BatchImageProcessor` instead of the processor's own
+            image processor.
+        """
+        self.model_name = model_name
+        self.min_pixels = min_pixels
+        self.max_pixels = max_pixels
+
+        self.model = Qwen2_5_VLForConditionalGeneration.from_pretrained(
+            model_name,
+            torch_dtype=dtype,
+            attn_implementation=attn_implementation,
+            device_map=device_map,
+        )
+
+        self.processor = AutoProcessor.from_pretrained(
+            model_name,
+            min_pixels=min_pixels,
+            max_pixels=max_pixels,
+            use_fast=use_fast,
+        )
+        # Batched generation needs the prompts aligned on the right edge
+        self.processor.tokenizer.padding_side = "left"
+        if batch_image_processor:
+            self.processor.image_processor = BatchImageProcessor.from_image_processor(
+                self.processor.image_processor
+            )
+
+        self.embedding_cache = None
+        self.vision_tower = None
+        if embedding_cache or embedding_cache_dir:
+            self.embedding_cache = VisualEmbeddingCache(
+                embedding_cache_dir, max_items=embedding_cache_size
+            )
+            # Older transformers keep the vision tower on the generation model itself
+            visual = getattr(self.model, "visual", None) or self.model.model.visual
+            self.vision_tower = CachedVisionTower(visual, self.embedding_cache)
+
+        self.prefix_cache = PrefixKVCache(self.model) if reuse_prefix_cache else None
+
+        self.constrained_decoding = constrained_decoding
+        self.schema_vocabulary = (
+            SchemaVocabulary(self.processor.tokenizer) if constrained_decoding else None
+        )
+
+        self.stop_on_fields = stop_on_fields
+
+    def prepare(self, prompts: list[list[dict]], metrics: Optional[dict] = None):
+        """
+        Apply the chat template to each prompt and collate them into one padded batch.
+        :param prompts: List of chat-formatted prompts, one per drawing.
+        :param metrics: Instrumentation record, or None.
+        :return: Processor outputs moved to the model device.
+        """
+        with span(metrics, "load_images"):
+            image_inputs, _ = process_vision_info(prompts)
+
+        with span(metrics, "processor"):
+            texts = [
+                self.processor.apply_chat_template(
+                    prompt, tokenize=False, add_generation_prompt=True
+                )
+                for prompt in prompts
+            ]
+            inputs = self.processor(
+                text=texts,
+                images=image_inputs,
+                videos=None,
+                padding=True,
+                return_tensors="pt",
+            ).to(self.model.device)
+
+        if metrics is not None:
+            metrics["input_tokens"].extend(inputs.attention_mask.sum(dim=-1).tolist())
+            metrics["image_pixels"].extend(
+                image.width * image.height for image in image_inputs or []
+            )
+        return inputs
+
+    def _eos_token_ids(self) -> list[int]:
+        eos_token_ids = self.model.generation_config.eos_token_id
+        if not isinstance(eos_token_ids, (list, tuple)):
+            eos_token_ids = [eos_token_ids]
+        return list(eos_token_ids)
+
+    def _pad_token_id(self) -> int:
+        pad_token_id = self.model.generation_config.pad_token_id
+        return pad_token_id if pad_token_id is not None else self._eos_token_ids()[0]
+
+    def _logits_processor(
+        self, fields: Optional[list[Optional[list[str]]]] = None
+    ) -> LogitsProcessorList:
+        """
+        Extra logits processors of a `generate` call; stateful ones are created fresh.
+        :param fields: Fields of each row, see `generate_batch`.
+        """
+        logits_processor = LogitsProcessorList()
+        if self.schema_vocabulary is not None:
+            logits_processor.append(
+                SchemaLogitsProcessor(
+                    self.schema_vocabulary, self._eos_token_ids(), row_fields=fields
+                )
+            )
+        return logits_processor
+
+    def _stopping_criteria(
+        self, fields: Optional[list[Optional[list[str]]]] = None
+    ) -> StoppingCriteriaList:
+        """
+        Extra stopping criteria of a `generate` call, created fresh like the logits processors.
+        :param fields: Fields of each row, see `generate_batch`.
+        """
+        stopping_criteria = StoppingCriteriaList()
+        if self.stop_on_fields:
+            stopping_criteria.append(
+                FieldsEmittedCriteria(self.processor.tokenizer, row_fields=fields)
+            )
+        return stopping_criteria
+
+    def _generate(
+        self,
+        inputs,
+        max_new_tokens: int,
+        metrics: Optional[dict] = None,
+        fields: Optional[list[Optional[list[str]]]] = None,
+    ):
+        if self.prefix_cache is not None:
+            if self.model.generation_config.do_sample:
+                warnings.warn(
+                    "Generation with the prefix cache is greedy: do_sample, temperature, "
+                    "top_k and top_p of the generation config are ignored",
+                    stacklevel=3,
+                )
+            return self._generate_with_prefix(
+                inputs, max_new_tokens=max_new_tokens, metrics=metrics, fields=fields
+            )
+
+        stopping_criteria = self._stopping_criteria(fields)
+        if metrics is None:
+            return self.model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                logits_processor=self._logits_processor(fields),
+                stopping_criteria=stopping_criteria,
+            )
+
+        timer = FirstTokenTimer()
+        stopping_criteria.append(timer)
+        start_time = time.perf_counter()
+        generated_ids = self.model.generate(
+            **inputs,
+            max_new_tokens=max_new_tokens,
+            logits_processor=self._logits_processor(fields),
+            stopping_criteria=stopping_criteria,
+        )
+        end_time = time.perf_counter()
+        first_token_time = timer.first_token_time or end_time
+        add_time(metrics, "prefill", first_token_time - start_time)
+        add_time(metrics, "decode", end_time - first_token_time)
+        return generated_ids
+
+    def _rope_index(self, **kwargs) -> torch.Tensor:
+        # Newer transformers moved get_rope_index onto the inner multimodal model
+        get_rope_index = (
+            getattr(self.model, "get_rope_index", None)
+            or self.model.model.get_rope_index
+        )
+        position_ids, _ = get_rope_index(**kwargs)
+        return position_ids
+
+    @torch.inference_mode()
+    def _generate_with_prefix(
+        self,
+        inputs,
+        max_new_tokens: int,
+        metrics: Optional[dict] = None,
+        fields: Optional[list[Optional[list[str]]]] = None,
+    ) -> torch.Tensor:
+        """
+        Greedy generation that reuses the KV cache of the shared text prefix.
+        Rows are prefilled and decoded one at a time, because left padding shifts
+        where the prefix starts in each row, so a batch runs sequentially. Only
+        the repetition penalty of the generation config is applied.
+        :return: Prompt ids followed by generated ids, right padded like `generate`.
+        """
+        config = self.model.config
+        generation_config = self.model.generation_config
+        eos_token_ids = self._eos_token_ids()
+        pad_token_id = self._pad_token_id()
+        repetition_penalty = generation_config.repetition_penalty
+
+        image_grid_thw = inputs.get("image_grid_thw")
+        batch_keys = self.vision_tower.keys if self.vision_tower is not None else None
+        image_index, patch_offset = 0, 0
+
+        sequences = []
+        for row in range(inputs.input_ids.shape[0]):
+            mask = inputs.attention_mask[row].bool()
+            input_ids = inputs.input_ids[row][mask].unsqueeze(0)
+
+            vision_starts = (input_ids[0] == config.vision_start_token_id).nonzero()
+            num_images = len(vision_starts)
+            prefix_length = int(vision_starts[0]) if num_images else 0
+
+            model_inputs, rope_inputs = {}, {}
+            if num_images:
+                grid_thw = image_grid_thw[image_index : image_index + num_images]
+                num_patches = int(grid_thw.prod(-1).sum())
+                model_inputs["pixel_values"] = inputs.pixel_values[
+                    patch_offset : patch_offset + num_patches
+                ]
+                model_inputs["image_grid_thw"] = grid_thw
+                rope_inputs["image_grid_thw"] = grid_thw
+                if batch_keys is not None:
+                    self.vision_tower.keys = batch_keys[
+                        image_index : image_index + num_images
+                    ]
+                image_index += num_images
+                patch_offset += num_patches
+            if "mm_token_type_ids" in inputs:
+                rope_inputs["mm_token_type_ids"] = inputs.mm_token_type_ids[row][
+                    mask
+                ].unsqueeze(0)
+
+            position_ids = self._rope_index(
+                input_ids=input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                **rope_inputs,
+            )
+            with span(metrics, "prefill"):
+                outputs = self.prefix_cache.prefill(
+                    input_ids, prefix_length, position_ids, **model_inputs
+                )
+
+            row_fields = [fields[row]] if fields is not None else None
+            logits_processor = self._logits_processor(row_fields)
+            stopping_criteria = self._stopping_criteria(row_fields)
+            if repetition_penalty is not None and repetition_penalty != 1.0:
+                logits_processor.insert(
+                    0, RepetitionPenaltyLogitsProcessor(repetition_penalty)
+                )
+
+            with span(metrics, "decode"):
+                sequence = input_ids
+                next_position = int(position_ids.max()) + 1
+                for _ in range(max_new_tokens):
+                    scores = logits_processor(sequence, outputs.logits[:, -1, :].float())
+                    next_token = scores.argmax(dim=-1, keepdim=True)
+                    sequence = torch.cat([sequence, next_token], dim=-1)
+                    if int(next_token) in eos_token_ids:
+                        break
+                    if stopping_criteria and stopping_criteria(sequence, scores).all():
+                        break
+
+                    # Generated tokens are text, so all three rope dimensions advance together
+                    outputs = self.model(
+                        input_ids=next_token,
+                        attention_mask=torch.ones_like(sequence),
+                        position_ids=PrefixKVCache.text_positions(
+                            next_position, 1, sequence.device
+                        ),
+                        past_key_values=outputs.past_key_values,
+                        use_cache=True,
+                    )
+                    next_position += 1
+
+            generated = sequence[0, input_ids.shape[1] :]
+            sequences.append(torch.cat([inputs.input_ids[row], generated]))
+
+        if self.vision_tower is not None:
+            self.vision_tower.keys = batch_keys
+
+        max_length = max(len(sequence) for sequence in sequences)
+        return torch.stack(
+            [
+                torch.nn.functional.pad(
+                    sequence, (0, max_length - len(sequence)), value=pad_token_id
+                )
+                for sequence in sequences
+            ]
+        )
+
+    def _generated_lengths(self, inputs, generated_ids) -> list[int]:
+        """
+        Number of tokens generated per row, up to and including the first EOS.
+        Rows stopped early are padded after their last token.
+        """
+        stop_ids = torch.tensor(
+            self._eos_token_ids() + [self._pad_token_id()], device=generated_ids.device
+        )
+        generated = generated_ids[:, inputs.input_ids.shape[1] :]
+        is_stop = torch.isin(generated, stop_ids)
+        lengths = []
+        for row in range(generated.shape[0]):
+            stops = is_stop[row].nonzero()
+            if not len(stops):
+                lengths.append(generated.shape[1])
+                continue
+            first = int(stops[0])
+            ended = int(generated[row, first]) in self._eos_token_ids()
+            lengths.append(first + 1 if ended else first)
+        return lengths
+
+    def generate_batch(
+        self,
+        inputs,
+        max_new_tokens: int,
+        image_keys: Optional[list[str]] = None,
+        metrics: Optional[dict] = None,
+        fields: Optional[list[Optional[list[str]]]] = None,
+    ) -> torch.Tensor:
+        if self.vision_tower is not None:
+            self.vision_tower.keys = image_keys
+        try:
+            return self._generate(
+                inputs, max_new_tokens=max_new_tokens, metrics=metrics, fields=fields
+            )
+        finally:
+            if self.vision_tower is not None:
+                self.vision_tower.keys = None
+
+    def decode(self, inputs, outputs: torch.Tensor) -> tuple[list[str], list[int]]:
+        return self._decode_texts(inputs, outputs), self._generated_lengths(inputs, outputs)
+
+    def _decode_texts(self, inputs, generated_ids) -> list[str]:
+        # Prompts are left padded, so every row shares the same prompt length
+        generated_ids_trimmed = [
+            out_ids[len(in_ids) :]
+            for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
+        ]
+
+        return self.processor.batch_decode(
+            generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization=False
+        )
+
+
+class StubBackend(InferenceBackend):
+    """
+    Deterministic model stand-in for profiling and load tests on any CPU.
+
+    Canned outputs are replayed in turn, one per prompt, and every batch sleeps
+    `latency_ms + per_item_ms * batch size`. With `process_images` the images
+    still go through `process_vision_info`, and with a `processor` the batch
+    also goes through the chat template, tokenisation and pixel preprocessing,
+    so preprocessing costs what it would with the real model. Token counts are
+    approximated as 4 characters per token.
+    """
+
+    DEFAULT_OUTPUT = "\n".join(
+        f"{field}: {OCRPostProcessor.EXPECTED_VALUES.get(field, ['A-100'])[0]}"
+        for field in OCRPostProcessor.FIELDS
+    )
+    CHARS_PER_TOKEN = 4
+
+    def __init__(
+        self,
+        outputs: Optional[list[str]] = None,
+        latency_ms: float = 0.0,
+        per_item_ms: float = 0.0,
+        process_images: bool = True,
+        model_name: str = "stub",
+        min_pixels: int = 512 * 28 * 28,
+        max_pixels: int = 1536 * 28 * 28,
+        processor=None,
+    ) -> None:
+        """
+        :param processor: `transformers` processor of the model stood in for, such
+            as `AutoProcessor.from_pretrained(model_name)`, to run on every batch.
+            Its outputs are discarded.
+        """
+        self.outputs = outputs or [self.DEFAULT_OUTPUT]
+        self.latency = latency_ms / 1000
+        self.per_item = per_item_ms / 1000
+        self.process_images = process_images
+        self.model_name = model_name
+        self.min_pixels = min_pixels
+        self.max_pixels = max_pixels
+        self.processor = processor
+
+        self._next_output = 0
+
+    def prepare(
+        self, prompts: list[list[dict]], metrics: Optional[dict] = None
+    ) -> list[list[dict]]:
+        if self.process_images or self.processor is not None:
+            with span(metrics, "load_images"):
+                image_inputs, _ = process_vision_info(prompts)
+            if metrics is not None:
+                metrics["image_pixels"].extend(
+                    image.width * image.height for image in image_inputs or []
+                )
+        if self.processor is not None:
+            with span(metrics, "processor"):
+                texts = [
+                    self.processor.apply_chat_template(
+                        prompt, tokenize=False, add_generation_prompt=True
+                    )
+                    for prompt in prompts
+                ]
+                inputs = self.processor(
+                    text=texts,
+                    images=image_inputs,
+                    videos=None,
+                    padding=True,
+                    return_tensors="pt",
+                )
+            if metrics is not None:
+                metrics["input_tokens"].extend(inputs.attention_mask.sum(dim=-1).tolist())
+        return prompts
+
+    def generate_batch(
+        self,
+        inputs,
+        max_new_tokens: int,
+        image_keys: Optional[list[str]] = None,
+        metrics: Optional[dict] = None,
+        fields: Optional[list[Optional[list[str]]]] = None,
+    ) -> list[str]:
+        with span(metrics, "decode"):
+            time.sleep(self.latency + self.per_item * len(inputs))
+        outputs = []
+        for _ in inputs:
+            output = self.outputs[self._next_output % len(self.outputs)]
+            self._next_output += 1
+            outputs.append(output[: max_new_tokens * self.CHARS_PER_TOKEN])
+        return outputs
+
+    def decode(self, inputs, outputs: list[str]) -> tuple[list[str], list[int]]:
+        return outputs, [
+            math.ceil(len(output) / self.CHARS_PER_TOKEN) for output in outputs
+        ]
@@ -0,0 +1,253 @@
+from typing import Optional, Sequence, Union
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+from transformers import BatchFeature
+
+from test_process_vision_info_image import IMAGE_FACTOR, MAX_PIXELS, MAX_RATIO, MIN_PIXELS
+
+# CLIP statistics used by the Qwen2.5-VL image processor
+IMAGE_MEAN = (0.48145466, 0.4578275, 0.40821073)
+IMAGE_STD = (0.26862954, 0.26130258, 0.27577711)
+
+
+def _floor_by_factor(numbers: np.ndarray, factor: int) -> np.ndarray:
+    return np.floor(numbers / factor).astype(np.int64) * factor
+
+
+def _ceil_by_factor(numbers: np.ndarray, factor: int) -> np.ndarray:
+    return np.ceil(numbers / factor).astype(np.int64) * factor
+
+
+def batch_smart_resize(
+    heights: Sequence[int],
+    widths: Sequence[int],
+    factor: int = IMAGE_FACTOR,
+    min_pixels: int = MIN_PIXELS,
+    max_pixels: int = MAX_PIXELS,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    `smart_resize` of a whole batch of sizes at once, with the same float64
+    arithmetic and round-half-to-even, so the sizes are identical.
+    :return: (resized heights, resized widths)
+    """
+    heights = np.asarray(heights, dtype=np.int64)
+    widths = np.asarray(widths, dtype=np.int64)
+    ratios = np.maximum(heights, widths) / np.minimum(heights, widths)
+    if (ratios > MAX_RATIO).any():
+        raise ValueError(
+            f"absolute aspect ratio must be smaller than {MAX_RATIO}, got {ratios.max()}"
+        )
+
+    h_bar = np.maximum(factor, np.round(heights / factor).astype(np.int64) * factor)
+    w_bar = np.maximum(factor, np.round(widths / factor).astype(np.int64) * factor)
+    too_large = h_bar * w_bar > max_pixels
+    too_small = ~too_large & (h_bar * w_bar < min_pixels)
+
+    beta = np.sqrt(heights * widths / max_pixels)
+    h_bar = np.where(too_large, _floor_by_factor(heights / beta, factor), h_bar)
+    w_bar = np.where(too_large, _floor_by_factor(widths / beta, factor), w_bar)
+
+    beta = np.sqrt(min_pixels / (heights * widths))
+    h_bar = np.where(too_small, _ceil_by_factor(heights * beta, factor), h_bar)
+    w_bar = np.where(too_small, _ceil_by_factor(widths * beta, factor), w_bar)
+    return h_bar, w_bar
+
+
+def _image_size(image: Union[Image.Image, np.ndarray]) -> tuple[int, int]:
+    """
+    (height, width) of a PIL image or an array.
+    """
+    if isinstance(image, np.ndarray):
+        return image.shape[0], image.shape[1]
+    return image.height, image.width
+
+
+def _stack(images: list, indices: list[int], size: tuple[int, int]) -> torch.Tensor:
+    """
+    uint8 tensor of shape (N, H, W, 3) holding the given images of one size.
+    Images are copied in one at a time, so at most one converted image is held
+    besides the stack.
+    """
+    stack = np.empty((len(indices), *size, 3), dtype=np.uint8)
+    for row, index in enumerate(indices):
+        image = images[index]
+        if isinstance(image, Image.Image) and image.mode != "RGB":
+            image = image.convert("RGB")
+        stack[row] = np.asarray(image)
+    return torch.from_numpy(stack)
+
+
+class BatchImageProcessor:
+    """
+    Drop-in replacement of the Qwen2.5-VL image processor for a whole batch.
+
+    Target sizes are computed for all images at once. Images that already have
+    their target size, as prompts built by `load_prompt` do, are not resized;
+    the others are resized in stacks of equal size with the uint8 SIMD kernels
+    of `torch.nn.functional.interpolate`. Each stack of equal target size is then
+    patchified as uint8, with the 2 temporal copies of every patch written by the
+    same reshape, and copied straight into the one float `pixel_values` tensor,
+    which is rescaled and normalised in place. The output matches the
+    processor's `pixel_values` and `image_grid_thw`.
+
+    Installed on a processor with
+    `processor.image_processor = BatchImageProcessor.from_image_processor(processor.image_processor)`.
+    """
+
+    def __init__(
+        self,
+        min_pixels: int = MIN_PIXELS,
+        max_pixels: int = MAX_PIXELS,
+        patch_size: int = 14,
+        merge_size: int = 2,
+        temporal_patch_size: int = 2,
+        image_mean: Sequence[float] = IMAGE_MEAN,
+        image_std: Sequence[float] = IMAGE_STD,
+        resample: str = "bicubic",
+        image_processor=None,
+    ) -> None:
+        """
+        :param resample: `interpolate` mode of images not at their target size.
+        :param image_processor: Image processor being replaced. Everything but the
+            preprocessing itself, such as `fetch_images`, is left to it.
+        """
+        self.image_processor = image_processor
+        self.min_pixels = min_pixels
+        self.max_pixels = max_pixels
+        self.patch_size = patch_size
+        self.merge_size = merge_size
+        self.temporal_patch_size = temporal_patch_size
+        self.resample = resample
+
+        # (x / 255 - mean) / std as one multiply-add per value, laid out like the
+        # (channel, temporal, patch, patch) columns of `pixel_values`
+        repeats = temporal_patch_size * patch_size * patch_size
+        std = torch.tensor(image_std, dtype=torch.float32)
+        mean = torch.tensor(image_mean, dtype=torch.float32)
+        self._scale = (1 / (255 * std)).repeat_interleave(repeats)
+        self._bias = (-mean / std).repeat_interleave(repeats)
+
+    @classmethod
+    def from_image_processor(cls, image_processor) -> "BatchImageProcessor":
+        """
+        Take the configuration of a `transformers` Qwen2-VL image processor.
+        """
+        size = getattr(image_processor, "size", None) or {}
+        get = size.get if isinstance(size, dict) else lambda key: getattr(size, key, None)
+        return cls(
+            min_pixels=getattr(image_processor, "min_pixels", None) or get("shortest_edge"),
+            max_pixels=getattr(image_processor, "max_pixels", None) or get("longest_edge"),
+            patch_size=image_processor.patch_size,
+            merge_size=image_processor.merge_size,
+            temporal_patch_size=image_processor.temporal_patch_size,
+            image_mean=image_processor.image_mean,
+            image_std=image_processor.image_std,
+            image_processor=image_processor,
+        )
+
+    def __getattr__(self, name: str):
+        image_processor = self.__dict__.get("image_processor")
+        if image_processor is None or name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(image_processor, name)
+
+    def resize(self, images: list, sizes: list[tuple[int, int]]) -> list:
+        """
+        :param images: PIL images or RGB uint8 arrays of shape (H, W, 3).
+        :param sizes: Target (height, width) of every image.
+        :return: Resized arrays, images already at their target size unchanged.
+        """
+        resized = list(images)
+        groups: dict[tuple, list[int]] = {}
+        for index, (image, size) in enumerate(zip(images, sizes)):
+            if _image_size(image) != size:
+                groups.setdefault((_image_size(image), size), []).append(index)
+
+        for (source_size, size), indices in groups.items():
+            # Channels last keeps the uint8 kernels of interpolate on the fast path
+            stack = _stack(images, indices, source_size).permute(0, 3, 1, 2)
+            output = F.interpolate(stack, size=size, mode=self.resample, antialias=True)
+            output = output.permute(0, 2, 3, 1).numpy()
+            for index, image in zip(indices, output):
+                resized[index] = image
+        return resized
+
+    def patchify(self, stack: torch.Tensor) -> torch.Tensor:
+        """
+        Patches of a stack of images of one size, in the layout of `pixel_values`.
+        :param stack: uint8 tensor of shape (N, H, W, 3).
+        :return: uint8 tensor of shape (N * grid_h * grid_w, 3 * temporal * patch * patch).
+        """
+        batch_size, height, width, channel = stack.shape
+        patch, merge = self.patch_size, self.merge_size
+        grid_h, grid_w = height // patch, width // patch
+        patches = stack.permute(0, 3, 1, 2).reshape(
+            batch_size, channel, grid_h // merge, merge, patch, grid_w // merge, merge, patch
+        )
+        # [batch, grid_h/merge, grid_w/merge, merge, merge, channel, patch, patch]
+        patches = patches.permute(0, 2, 5, 3, 6, 1, 4, 7)
+        return (
+            patches.unsqueeze(6)
+            .expand(-1, -1, -1, -1, -1, -1, self.temporal_patch_size, -1, -1)
+            .reshape(batch_size * grid_h * grid_w, -1)
+        )
+
+    def __call__(
+        self,
+        images: Union[Image.Image, np.ndarray, list],
+        return_tensors: Optional[str] = None,
+        **kwargs,
+    ) -> BatchFeature:
+        """
+        Preprocess a batch of images like the processor's image processor.
+        :param images: PIL images or RGB uint8 arrays, possibly nested per prompt.
+        :return: `pixel_values` of all images concatenated in input order, and
+            their `image_grid_thw`.
+        """
+        if not isinstance(images, (list, tuple)):
+            images = [images]
+        # Prompts with several images come as nested lists
+        images = [
+            image
+            for item in images
+            for image in (item if isinstance(item, (list, tuple)) else [item])
+        ]
+
+        image_sizes = [_image_size(image) for image in images]
+        heights, widths = batch_smart_resize(
+            [height for height, _ in image_sizes],
+            [width for _, width in image_sizes],
+            factor=self.patch_size * self.merge_size,
+            min_pixels=self.min_pixels,
+            max_pixels=self.max_pixels,
+        )
+        sizes = list(zip(heights.tolist(), widths.tolist()))
+        images = self.resize(images, sizes)
+
+        patch = self.patch_size
+        tokens = [(height // patch) * (width // patch) for height, width in sizes]
+        offsets = np.concatenate([[0], np.cumsum(tokens)]).tolist()
+        # The only float tensor: patches are converted while being copied in
+        pixel_values = torch.empty(offsets[-1], self._scale.numel(), dtype=torch.float32)
+        groups: dict[tuple, list[int]] = {}
+        for index, size in enumerate(sizes):
+            groups.setdefault(size, []).append(index)
+        for size, indices in groups.items():
+            patches = self.patchify(_stack(images, indices, size))
+            for row, index in enumerate(indices):
+                pixel_values[offsets[index] : offsets[index + 1]].copy_(
+                    patches[row * tokens[index] : (row + 1) * tokens[index]]
+                )
+        pixel_values.mul_(self._scale).add_(self._bias)
+
+        grid_thw = torch.tensor(
+            [[1, height // patch, width // patch] for height, width in sizes],
+            dtype=torch.int64,
+        )
+        return BatchFeature(
+            {"pixel_values": pixel_values, "image_grid_thw": grid_thw},
+            tensor_type=return_tensors,
+        )
@@ -0,0 +1,75 @@
+from typing import Optional, Sequence
+
+
+def padded_tokens(token_counts: Sequence[int]) -> int:
+    """
+    Tokens a batch costs once every sequence is padded to its longest member.
+    """
+    return len(token_counts) * max(token_counts, default=0)
+
+
+def padding_stats(token_counts: Sequence[int], batches: list[list[int]]) -> dict:
+    """
+    :param token_counts: Visual tokens of every drawing.
+    :param batches: Indices into `token_counts` of the drawings of each batch.
+    :return: Real and padded visual tokens of the batches, and the share of the
+        padded tokens that are real (1.0 means no padding at all).
+    """
+    real = sum(token_counts[index] for batch in batches for index in batch)
+    padded = sum(padded_tokens([token_counts[index] for index in batch]) for batch in batches)
+    return {
+        "batches": len(batches),
+        "visual_tokens": real,
+        "padded_visual_tokens": padded,
+        "padding_efficiency": real / padded if padded else 1.0,
+    }
+
+
+def fixed_batches(count: int, batch_size: int) -> list[list[int]]:
+    """
+    Consecutive batches of `batch_size` drawings, in input order.
+    """
+    return [
+        list(range(start, min(start + batch_size, count)))
+        for start in range(0, count, batch_size)
+    ]
+
+
+def pack_batches(
+    token_counts: Sequence[int],
+    max_batch_tokens: int,
+    max_batch_size: Optional[int] = None,
+) -> list[list[int]]:
+    """
+    Pack drawings into batches whose padded visual tokens stay within a budget.
+
+    Drawings are sorted by visual token count, largest first, and each batch
+    takes the next drawings in that order while `batch size * largest member`
+    fits the budget. Drawings of similar size therefore share a batch, small
+    drawings make large batches and large ones small batches. A drawing over the
+    budget on its own gets a batch to itself.
+    :param token_counts: Visual tokens of every drawing, see
+        `TechnicalDrawingExtractor.visual_tokens`.
+    :param max_batch_tokens: Budget of padded visual tokens per batch.
+    :param max_batch_size: Also cap the number of drawings per batch.
+    :return: Indices into `token_counts` of the drawings of each batch, largest
+        drawings first.
+    """
+    if max_batch_tokens < 1:
+        raise ValueError(f"max_batch_tokens must be positive, got {max_batch_tokens}")
+    if max_batch_size is not None and max_batch_size < 1:
+        raise ValueError(f"max_batch_size must be positive, got {max_batch_size}")
+
+    # Stable, so drawings of equal size keep their input order
+    order = sorted(range(len(token_counts)), key=lambda index: -token_counts[index])
+    batches, batch = [], []
+    for index in order:
+        # The first drawing of a batch is its largest, so it sets the padding
+        fits = batch and (len(batch) + 1) * token_counts[batch[0]] <= max_batch_tokens
+        if batch and (not fits or len(batch) == max_batch_size):
+            batches.append(batch)
+            batch = []
+        batch.append(index)
+    if batch:
+        batches.append(batch)
+    return batches
@@ -0,0 +1,161 @@
+"""
+Image preprocessing of a batch with `BatchImageProcessor` against the per-image
+path (`fetch_image` resizing each drawing with Pillow, then the processor's own
+image processor), from decoded drawings to `pixel_values`:
+
+    python -m benchmarks.batch_preprocess --batch-sizes 1 2 4 8 16 32 64
+
+Drawings come in a few scanner sizes, as real batches do. Both paths are also
+timed from drawings already at their target size, as `load_prompt` hands them
+over, where only rescaling, normalisation and patching are left. The
+`pixel_values` of both paths are compared on the distinct drawings.
+"""
+
+import argparse
+import gc
+import json
+import time
+
+import torch
+from transformers import AutoProcessor
+
+from batch_preprocessing import BatchImageProcessor
+from benchmarks.end_to_end import parse_resolution
+from benchmarks.synthetic import make_drawing
+from test_process_vision_info_image import fetch_image
+
+
+def _best_of(repeat: int, fn) -> float:
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start_time = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start_time)
+    return min(timings)
+
+
+def run_benchmark(
+    processor_path: str,
+    batch_sizes: list[int],
+    resolutions: list[tuple[int, int]],
+    min_pixels: int,
+    max_pixels: int,
+    repeat: int,
+) -> dict:
+    processor = AutoProcessor.from_pretrained(
+        processor_path, min_pixels=min_pixels, max_pixels=max_pixels
+    )
+    image_processor = processor.image_processor
+    batch_processor = BatchImageProcessor.from_image_processor(image_processor)
+
+    # Every resolution in turn, so a batch mixes scanner sizes. A few distinct
+    # drawings are repeated, which keeps the inputs of a batch of 64 in memory
+    distinct = [
+        make_drawing(*resolutions[seed % len(resolutions)], seed=seed)
+        for seed in range(2 * len(resolutions))
+    ]
+    drawings = [distinct[index % len(distinct)] for index in range(max(batch_sizes))]
+
+    def per_image(images: list) -> torch.Tensor:
+        resized = [
+            fetch_image({"image": image, "min_pixels": min_pixels, "max_pixels": max_pixels})
+            for image in images
+        ]
+        return image_processor(resized, return_tensors="pt")["pixel_values"]
+
+    def batched(images: list) -> torch.Tensor:
+        return batch_processor(images, return_tensors="pt")["pixel_values"]
+
+    first = distinct
+    resized_first = [
+        fetch_image({"image": image, "min_pixels": min_pixels, "max_pixels": max_pixels})
+        for image in first
+    ]
+    parity = {
+        "raw_max_abs_diff": float((per_image(first) - batched(first)).abs().max()),
+        "resized_max_abs_diff": float(
+            (
+                image_processor(resized_first, return_tensors="pt")["pixel_values"]
+                - batched(resized_first)
+            )
+            .abs()
+            .max()
+        ),
+    }
+
+    results = []
+    for batch_size in batch_sizes:
+        images = drawings[:batch_size]
+        resized = [
+            fetch_image({"image": image, "min_pixels": min_pixels, "max_pixels": max_pixels})
+            for image in images
+        ]
+        timings = {
+            "per_image_ms": _best_of(repeat, lambda: per_image(images)),
+            "batched_ms": _best_of(repeat, lambda: batched(images)),
+            "per_image_resized_ms": _best_of(
+                repeat, lambda: image_processor(resized, return_tensors="pt")
+            ),
+            "batched_resized_ms": _best_of(repeat, lambda: batch_processor(resized)),
+        }
+        timings = {name: seconds * 1000 for name, seconds in timings.items()}
+        results.append(
+            {
+                "batch_size": batch_size,
+                **timings,
+                "speedup": timings["per_image_ms"] / timings["batched_ms"],
+                "resized_speedup": (
+                    timings["per_image_resized_ms"] / timings["batched_resized_ms"]
+                ),
+            }
+        )
+    return {
+        "threads": torch.get_num_threads(),
+        "resolutions": [f"{width}x{height}" for width, height in resolutions],
+        "parity": parity,
+        "batches": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--processor", required=True, help="model name or directory of a Qwen2.5-VL processor"
+    )
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument(
+        "--resolutions",
+        nargs="+",
+        type=parse_resolution,
+        default=[(2480, 1754), (1754, 2480), (1240, 877)],
+    )
+    parser.add_argument("--min-pixels", type=int, default=512 * 28 * 28)
+    parser.add_argument("--max-pixels", type=int, default=1536 * 28 * 28)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    result = run_benchmark(
+        args.processor,
+        args.batch_sizes,
+        args.resolutions,
+        args.min_pixels,
+        args.max_pixels,
+        args.repeat,
+    )
+    print(
+        f"pixel_values max abs diff: {result['parity']['raw_max_abs_diff']:.3g} with "
+        f"resizing, {result['parity']['resized_max_abs_diff']:.3g} without"
+    )
+    for batch in result["batches"]:
+        print(
+            f"batch {batch['batch_size']:>2}: per-image {batch['per_image_ms']:.0f} ms, "
+            f"batched {batch['batched_ms']:.0f} ms ({batch['speedup']:.2f}x); "
+            f"already resized {batch['per_image_resized_ms']:.0f} ms vs "
+            f"{batch['batched_resized_ms']:.0f} ms ({batch['resized_speedup']:.2f}x)"
+        )
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
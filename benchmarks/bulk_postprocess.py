@@ -0,0 +1,105 @@
+"""
+Columnar `ColumnarPostProcessor.convert_many` against a per-record loop over
+`OCRPostProcessor.convert_to_output_format`, on synthetic raw outputs:
+
+    python -m benchmarks.bulk_postprocess --records 1000000
+
+Every run first checks that both paths give identical outputs, including for
+entries with malformed and non-string values, and exits non-zero if they differ.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+
+from benchmarks.synthetic import make_raw_entry
+from bulk_postprocessing import ColumnarPostProcessor
+from post_processing import OCRPostProcessor
+
+# Values the rules must survive, mixed into the parity corpus
+ODD_VALUES = [
+    "", "'", '""', "(())", "]]", "[[x", "nan", "±nan", "±inf", "±-1", "±0.1.2",
+    "±1e-3", "±0.0009", "⌀nanx3", "⌀(3)x[4]", "{3x4x5}", "'iron'", "  Ra0.8 ",
+    "YES", None, 5, 1.5, True, ["±0.1"], {"a": 1},
+]
+
+
+def parity_corpus(records: int, seed: int = 1) -> list:
+    rng = random.Random(seed)
+    entries = []
+    for i in range(records):
+        entry = make_raw_entry(rng)
+        if i % 2:
+            for field in entry:
+                if rng.random() < 0.3:
+                    entry[field] = rng.choice(ODD_VALUES)
+        if i % 97 == 0:
+            del entry[rng.choice(list(entry))]
+        entries.append(entry)
+    # Not a dict: the scalar path falls back to its empty output
+    entries.extend([None, "not a record", ["Product code"]])
+    return entries
+
+
+def check_parity(records: int) -> int:
+    """
+    :return: Number of records that differ between the two paths.
+    """
+    scalar = OCRPostProcessor()
+    columnar = ColumnarPostProcessor(scalar)
+    entries = parity_corpus(records)
+    expected = [scalar.convert_to_output_format(entry) for entry in entries]
+    return sum(
+        a != b for a, b in zip(expected, columnar.convert_many(entries), strict=True)
+    )
+
+
+def run_benchmark(records: int, repeats: int = 3, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    entries = [make_raw_entry(rng) for _ in range(records)]
+    scalar = OCRPostProcessor()
+    columnar = ColumnarPostProcessor(scalar)
+
+    timings = {}
+    for name, convert in [
+        ("per_record", lambda: [scalar.convert_to_output_format(e) for e in entries]),
+        ("columnar", lambda: columnar.convert_many(entries)),
+        # Output columns only, for consumers that store them column-wise
+        ("columns_only", lambda: columnar.convert_columns(columnar.load_columns(entries))),
+    ]:
+        best = float("inf")
+        for _ in range(repeats):
+            start_time = time.perf_counter()
+            convert()
+            best = min(best, time.perf_counter() - start_time)
+        timings[name] = {"seconds": best, "records_per_second": records / best}
+    return {
+        "records": records,
+        "results": timings,
+        "speedup": timings["per_record"]["seconds"] / timings["columnar"]["seconds"],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--records", type=int, default=1_000_000)
+    parser.add_argument("--parity-records", type=int, default=100_000)
+    parser.add_argument("--repeats", type=int, default=3, help="best of this many runs")
+    args = parser.parse_args()
+
+    mismatches = check_parity(args.parity_records)
+    print(f"parity: {mismatches} mismatching records of {args.parity_records + 3}")
+    if mismatches:
+        sys.exit(1)
+
+    report = run_benchmark(args.records, args.repeats)
+    for name, result in report["results"].items():
+        print(f"{name:>12}: {result['records_per_second']:,.0f} records/s")
+    print(f"{'speedup':>12}: {report['speedup']:.2f}x")
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Throughput of `DataParallelRunner` with 1, 2 and 4 stub replicas in worker
+processes, on synthetic drawings:
+
+    python -m benchmarks.data_parallel --replicas 1 2 4 --images 64
+
+The stub sleeps per batch like a model on its own device would keep it busy,
+so replicas scale even on a single core as long as loading keeps up. The
+replicas are started before the run is timed. Records are checked to come back
+in input order. A last run makes replica 0 `--slowdown` times slower than the
+others, and compares its wall time against an estimate of a static split,
+where every replica gets the same share.
+"""
+
+import argparse
+import json
+import tempfile
+
+from backends import StubBackend
+from benchmarks.end_to_end import build_corpus, parse_resolution
+from data_parallel import DataParallelRunner
+from model import TechnicalDrawingExtractor
+
+
+def stub_extractor(
+    device_map: str, latency_ms: float, per_item_ms: float
+) -> TechnicalDrawingExtractor:
+    """
+    Extractor of a replica. A device of the form "stub:<factor>" makes the stub
+    that many times slower.
+    """
+    _, _, slowdown = device_map.partition(":")
+    slowdown = float(slowdown or 1)
+    backend = StubBackend(
+        latency_ms=latency_ms * slowdown,
+        per_item_ms=per_item_ms * slowdown,
+        process_images=False,
+    )
+    return TechnicalDrawingExtractor(backend=backend)
+
+
+def _run(
+    paths: list[str],
+    devices: list[str],
+    latency_ms: float,
+    per_item_ms: float,
+    runner_kwargs: dict,
+) -> dict:
+    with DataParallelRunner(
+        devices,
+        extractor_kwargs={"latency_ms": latency_ms, "per_item_ms": per_item_ms},
+        runner_kwargs=runner_kwargs,
+        extractor_factory=stub_extractor,
+    ) as runner:
+        records = list(runner.run_records(paths))
+    summary = runner.summary()
+
+    # Seconds of generation per drawing of each replica, for a static split of
+    # `paths` into equal shares
+    seconds_per_image = [
+        replica["stage_timings"]["generate"] / replica["num_images"]
+        for replica in summary["replica_summaries"]
+        if replica["num_images"]
+    ]
+    return {
+        "replicas": len(devices),
+        "devices": devices,
+        "in_order": [record["image_path"] for record in records] == paths,
+        "wall_time": summary["wall_time"],
+        "startup_time": summary["startup_time"],
+        "images_per_second": summary["images_per_second"],
+        "images_per_replica": summary["images_per_replica"],
+        "static_split_estimate": len(paths) / len(devices) * max(seconds_per_image),
+    }
+
+
+def run_benchmark(
+    paths: list[str],
+    replica_counts: list[int],
+    slowdown: float,
+    latency_ms: float,
+    per_item_ms: float,
+    runner_kwargs: dict,
+) -> dict:
+    scaling = [
+        _run(paths, ["stub"] * replicas, latency_ms, per_item_ms, runner_kwargs)
+        for replicas in replica_counts
+    ]
+    for result in scaling:
+        result["speedup"] = result["images_per_second"] / scaling[0]["images_per_second"]
+
+    replicas = max(replica_counts)
+    heterogeneous = _run(
+        paths,
+        [f"stub:{slowdown}"] + ["stub"] * (replicas - 1),
+        latency_ms,
+        per_item_ms,
+        runner_kwargs,
+    )
+    return {"scaling": scaling, "heterogeneous": heterogeneous}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--replicas", nargs="+", type=int, default=[1, 2, 4])
+    parser.add_argument("--images", type=int, default=64)
+    parser.add_argument("--resolution", type=parse_resolution, default=(1240, 877))
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--per-item-ms", type=float, default=200.0)
+    parser.add_argument("--slowdown", type=float, default=3.0)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--prefetch", type=int, default=8)
+    parser.add_argument("--num-workers", type=int, default=2)
+    args = parser.parse_args()
+
+    runner_kwargs = {
+        "batch_size": args.batch_size,
+        "prefetch": args.prefetch,
+        "num_workers": args.num_workers,
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        corpus = build_corpus([args.resolution], args.images, "jpeg", workdir)
+        paths = corpus[args.resolution]
+        result = run_benchmark(
+            paths,
+            args.replicas,
+            args.slowdown,
+            args.latency_ms,
+            args.per_item_ms,
+            runner_kwargs,
+        )
+
+    for run in result["scaling"]:
+        print(
+            f"{run['replicas']} replicas: {run['images_per_second']:.2f} images/s "
+            f"({run['speedup']:.2f}x, {run['startup_time']:.1f} s to start), "
+            f"images per replica {run['images_per_replica']}, in order: {run['in_order']}"
+        )
+    run = result["heterogeneous"]
+    print(
+        f"replica 0 {args.slowdown}x slower: {run['wall_time']:.1f} s, static split "
+        f"~{run['static_split_estimate']:.1f} s, images per replica "
+        f"{run['images_per_replica']}, in order: {run['in_order']}"
+    )
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
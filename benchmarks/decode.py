@@ -0,0 +1,136 @@
+"""
+Compare full-resolution decoding against reduced decoding of oversized scans.
+
+Every measurement runs in a fresh process so that peak RSS is not polluted by
+earlier runs:
+
+    python -m benchmarks.decode --width 10000 --height 7000 --repeat 3
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+from PIL import Image
+
+from benchmarks.synthetic import make_drawing
+from image_loader import load_image
+from test_process_vision_info_image import smart_resize
+
+MIN_PIXELS = 512 * 28 * 28
+MAX_PIXELS = 1536 * 28 * 28
+
+
+def _full_decode(path: str, target_size: tuple[int, int]) -> Image.Image:
+    # Previous behaviour of fetch_image: decode everything, then resize
+    return Image.open(path).convert("RGB").resize(target_size)
+
+
+def _reduced_decode(path: str, target_size: tuple[int, int]) -> Image.Image:
+    return load_image(path, target_size=target_size)
+
+
+METHODS = {"full": _full_decode, "reduced": _reduced_decode}
+
+
+def _peak_rss_kb() -> int:
+    # ru_maxrss survives exec on Linux, so the spawned child would report the
+    # parent's peak; VmHWM belongs to the child's own address space
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _measure(method: str, path: str, target_size: tuple[int, int], result_queue) -> None:
+    baseline_kb = _peak_rss_kb()
+    start_time = time.perf_counter()
+    image = METHODS[method](path, target_size)
+    elapsed = time.perf_counter() - start_time
+    peak_kb = _peak_rss_kb()
+    result_queue.put(
+        {
+            "seconds": elapsed,
+            "peak_rss_mb": peak_kb / 1024,
+            "peak_rss_increase_mb": (peak_kb - baseline_kb) / 1024,
+            "size": list(image.size),
+        }
+    )
+
+
+def run_benchmark(
+    width: int, height: int, formats: list[str], repeat: int, workdir: str
+) -> list[dict]:
+    context = multiprocessing.get_context("spawn")
+    resized_height, resized_width = smart_resize(
+        height, width, min_pixels=MIN_PIXELS, max_pixels=MAX_PIXELS
+    )
+    target_size = (resized_width, resized_height)
+
+    drawing = make_drawing(width, height)
+    paths = {}
+    for image_format in formats:
+        paths[image_format] = os.path.join(workdir, f"drawing.{image_format}")
+        drawing.save(paths[image_format], format=image_format, quality=90)
+    del drawing
+
+    results = []
+    for image_format, path in paths.items():
+        for method in METHODS:
+            runs = []
+            for _ in range(repeat):
+                result_queue = context.Queue()
+                process = context.Process(
+                    target=_measure, args=(method, path, target_size, result_queue)
+                )
+                process.start()
+                runs.append(result_queue.get())
+                process.join()
+
+            results.append(
+                {
+                    "format": image_format,
+                    "method": method,
+                    "source_size": [width, height],
+                    "target_size": list(target_size),
+                    "best_seconds": min(run["seconds"] for run in runs),
+                    "peak_rss_increase_mb": max(
+                        run["peak_rss_increase_mb"] for run in runs
+                    ),
+                }
+            )
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--width", type=int, default=10000)
+    parser.add_argument("--height", type=int, default=7000)
+    parser.add_argument("--formats", nargs="+", default=["jpeg", "png"])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = run_benchmark(
+            args.width, args.height, args.formats, args.repeat, workdir
+        )
+
+    for result in results:
+        print(
+            f"{result['format']:>5} {result['method']:>8}: "
+            f"{result['best_seconds'] * 1000:8.1f} ms, "
+            f"+{result['peak_rss_increase_mb']:7.1f} MB peak RSS"
+        )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
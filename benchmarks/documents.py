@@ -0,0 +1,128 @@
+"""
+Prompt building for multi-page documents: pages streamed from the file against
+pages exploded to JPEG files first, on a synthetic multi-frame TIFF (and a PDF
+when pypdfium2 is installed):
+
+    python -m benchmarks.documents --pages 16 --resolution 2480x1754
+
+Streamed TIFF pages are checked pixel for pixel against pages exploded to PNG,
+which go through the same decode and resize as the streamed ones.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from backends import StubBackend
+from benchmarks.end_to_end import parse_resolution
+from benchmarks.synthetic import make_drawing
+from documents import iter_sources
+from model import TechnicalDrawingExtractor
+from pipeline import load_prompt
+
+
+def _prompt_image(extractor: TechnicalDrawingExtractor, prompt: list[dict]) -> Image.Image:
+    return extractor.image_elements(prompt)[0]["image"]
+
+
+def explode(path: str, image_format: str, workdir: str) -> tuple[list[str], int]:
+    """
+    Write every frame of a TIFF to its own file, the way documents were ingested so far.
+    :return: (paths of the page files, bytes written)
+    """
+    paths, written = [], 0
+    with Image.open(path) as img:
+        for index in range(img.n_frames):
+            img.seek(index)
+            page_path = os.path.join(workdir, f"page_{index}.{image_format}")
+            img.convert("RGB").save(page_path, quality=95)
+            paths.append(page_path)
+            written += os.path.getsize(page_path)
+    return paths, written
+
+
+def run_benchmark(pages: int, resolution: tuple[int, int], workdir: str) -> dict:
+    extractor = TechnicalDrawingExtractor(backend=StubBackend())
+    width, height = resolution
+    drawings = [make_drawing(width, height, seed=seed) for seed in range(pages)]
+    tiff_path = os.path.join(workdir, "document.tiff")
+    drawings[0].save(
+        tiff_path, save_all=True, append_images=drawings[1:], compression="tiff_lzw"
+    )
+
+    start_time = time.perf_counter()
+    exploded_dir = os.path.join(workdir, "exploded")
+    os.makedirs(exploded_dir)
+    page_paths, written = explode(tiff_path, "jpg", exploded_dir)
+    for page_path in page_paths:
+        load_prompt(extractor, page_path)
+    exploded_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    streamed = [
+        _prompt_image(extractor, load_prompt(extractor, page))
+        for page in iter_sources([tiff_path])
+    ]
+    streamed_seconds = time.perf_counter() - start_time
+
+    lossless_dir = os.path.join(workdir, "lossless")
+    os.makedirs(lossless_dir)
+    mismatches = 0
+    for page_path, image in zip(explode(tiff_path, "png", lossless_dir)[0], streamed):
+        expected = _prompt_image(extractor, load_prompt(extractor, page_path))
+        mismatches += not np.array_equal(np.asarray(expected), np.asarray(image))
+
+    result = {
+        "pages": pages,
+        "resolution": f"{width}x{height}",
+        "exploded_ms_per_page": exploded_seconds / pages * 1000,
+        "exploded_bytes_written": written,
+        "streamed_ms_per_page": streamed_seconds / pages * 1000,
+        "speedup": exploded_seconds / streamed_seconds,
+        "streamed_pages": len(streamed),
+        "mismatching_pages": mismatches,
+    }
+
+    try:
+        import pypdfium2  # noqa: F401
+    except ImportError:
+        result["pdf"] = "skipped: pypdfium2 is not installed"
+        return result
+
+    pdf_path = os.path.join(workdir, "document.pdf")
+    drawings[0].save(pdf_path, save_all=True, append_images=drawings[1:], resolution=200)
+    start_time = time.perf_counter()
+    pdf_pages = [load_prompt(extractor, page) for page in iter_sources([pdf_path])]
+    result["pdf"] = {
+        "pages": len(pdf_pages),
+        "streamed_ms_per_page": (time.perf_counter() - start_time) / pages * 1000,
+    }
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, default=16)
+    parser.add_argument("--resolution", type=parse_resolution, default=(2480, 1754))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        result = run_benchmark(args.pages, args.resolution, workdir)
+
+    print(
+        f"{result['pages']} pages at {result['resolution']}: exploded to JPEG "
+        f"{result['exploded_ms_per_page']:.0f} ms/page "
+        f"({result['exploded_bytes_written'] / 1e6:.1f} MB written), streamed "
+        f"{result['streamed_ms_per_page']:.0f} ms/page ({result['speedup']:.2f}x); "
+        f"{result['mismatching_pages']} pages differ from a lossless explode"
+    )
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Per-stage timings of the extraction pipeline over a synthetic corpus of drawings
+at several resolutions. Runs offline with the stub backend by default, or with a
+real model through `--model`:
+
+    python -m benchmarks.end_to_end --resolutions 1240x877 2480x1754 4960x3508 \
+        --images 8 --output results.json
+
+Stages, timed separately for every drawing:
+    image_dimension  `TechnicalDrawingExtractor.get_image_dimension` (header only)
+    fetch_image      `fetch_image`: `smart_resize` and reduced-resolution decode
+    processor        `backend.prepare`: chat template, tokenisation and pixel
+                     preprocessing. The stub runs the chat template and the
+                     tokeniser only with `--processor`; without it this stage
+                     is image preprocessing only, and is reported as such
+    generate         `backend.generate_batch` and `backend.decode`
+    parse            `OCRPostProcessor.parse_model_output`
+"""
+
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+
+import numpy as np
+import torch
+import transformers
+from transformers import AutoProcessor
+
+from backends import HFBackend, StubBackend
+from benchmarks.synthetic import make_drawing
+from model import TechnicalDrawingExtractor
+from prompt_generator import Prompt
+from test_process_vision_info_image import fetch_image
+
+STAGES = ["image_dimension", "fetch_image", "processor", "generate", "parse"]
+
+
+def parse_resolution(value: str) -> tuple[int, int]:
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def build_corpus(
+    resolutions: list[tuple[int, int]], images: int, image_format: str, workdir: str
+) -> dict[tuple[int, int], list[str]]:
+    corpus = {}
+    for width, height in resolutions:
+        paths = []
+        for seed in range(images):
+            path = os.path.join(workdir, f"drawing_{width}x{height}_{seed}.{image_format}")
+            make_drawing(width, height, seed=seed).save(path, format=image_format, quality=90)
+            paths.append(path)
+        corpus[(width, height)] = paths
+    return corpus
+
+
+def _summarise(timings: list[float]) -> dict:
+    milliseconds = np.array(timings) * 1000
+    return {
+        "mean_ms": float(milliseconds.mean()),
+        "p50_ms": float(np.percentile(milliseconds, 50)),
+        "p95_ms": float(np.percentile(milliseconds, 95)),
+        "total_s": float(milliseconds.sum() / 1000),
+    }
+
+
+def time_drawing(
+    extractor: TechnicalDrawingExtractor, path: str, max_new_tokens: int
+) -> dict[str, float]:
+    """
+    Run one drawing through every stage of the extractor.
+    :return: Seconds spent in each stage.
+    """
+    timings = {}
+
+    start_time = time.perf_counter()
+    extractor.get_image_dimension(path)
+    timings["image_dimension"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    image = fetch_image(
+        {
+            "image": path,
+            "min_pixels": extractor.min_pixels,
+            "max_pixels": extractor.max_pixels,
+        }
+    )
+    timings["fetch_image"] = time.perf_counter() - start_time
+
+    prompt = Prompt.technical_drawing_extraction_prompt(
+        image,
+        resized_width=image.width,
+        resized_height=image.height,
+        text_first=extractor.prefix_cache is not None,
+    )
+    start_time = time.perf_counter()
+    inputs = extractor.backend.prepare([prompt])
+    timings["processor"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    outputs = extractor.backend.generate_batch(inputs, max_new_tokens=max_new_tokens)
+    texts, _ = extractor.backend.decode(inputs, outputs)
+    timings["generate"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    extractor.model_parser.parse_model_output(texts[0])
+    timings["parse"] = time.perf_counter() - start_time
+    return timings
+
+
+def run_benchmark(
+    extractor: TechnicalDrawingExtractor,
+    corpus: dict[tuple[int, int], list[str]],
+    max_new_tokens: int,
+    warmup: int = 1,
+) -> list[dict]:
+    results = []
+    for (width, height), paths in corpus.items():
+        for path in paths[:warmup]:
+            time_drawing(extractor, path, max_new_tokens)
+
+        timings = {stage: [] for stage in STAGES}
+        for path in paths:
+            for stage, seconds in time_drawing(extractor, path, max_new_tokens).items():
+                timings[stage].append(seconds)
+
+        results.append(
+            {
+                "resolution": f"{width}x{height}",
+                "images": len(paths),
+                "stages": {stage: _summarise(timings[stage]) for stage in STAGES},
+                "total_mean_ms": sum(
+                    _summarise(timings[stage])["mean_ms"] for stage in STAGES
+                ),
+            }
+        )
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--resolutions",
+        nargs="+",
+        type=parse_resolution,
+        default=[(1240, 877), (2480, 1754), (4960, 3508)],
+        help="WIDTHxHEIGHT of the synthetic drawings",
+    )
+    parser.add_argument("--images", type=int, default=8, help="drawings per resolution")
+    parser.add_argument("--format", default="jpeg", choices=["jpeg", "png"])
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--max-new-tokens", type=int, default=512)
+    parser.add_argument("--min-pixels", type=int, default=512 * 28 * 28)
+    parser.add_argument("--max-pixels", type=int, default=1536 * 28 * 28)
+    parser.add_argument(
+        "--model", help="generate with this Hugging Face model instead of the stub"
+    )
+    parser.add_argument("--device-map", default="auto")
+    parser.add_argument("--dtype", default="bfloat16")
+    parser.add_argument("--attn-implementation", default="flash_attention_2")
+    parser.add_argument(
+        "--stub-latency-ms", type=float, default=0.0, help="sleep per stub batch"
+    )
+    parser.add_argument(
+        "--processor",
+        help="Hugging Face processor the stub runs on every drawing, so that the "
+        "processor stage includes the chat template and tokenisation",
+    )
+    parser.add_argument("--output", help="also write the JSON results to this file")
+    args = parser.parse_args()
+
+    if args.model:
+        backend = HFBackend(
+            model_name=args.model,
+            dtype=getattr(torch, args.dtype),
+            attn_implementation=args.attn_implementation,
+            device_map=args.device_map,
+            min_pixels=args.min_pixels,
+            max_pixels=args.max_pixels,
+        )
+    else:
+        processor = None
+        if args.processor:
+            processor = AutoProcessor.from_pretrained(
+                args.processor, min_pixels=args.min_pixels, max_pixels=args.max_pixels
+            )
+        backend = StubBackend(
+            latency_ms=args.stub_latency_ms,
+            min_pixels=args.min_pixels,
+            max_pixels=args.max_pixels,
+            processor=processor,
+        )
+    # The stub without a processor leaves out the chat template and tokenisation
+    processor_stage = (
+        "image preprocessing only"
+        if isinstance(backend, StubBackend) and backend.processor is None
+        else "chat template, tokenisation and image preprocessing"
+    )
+    extractor = TechnicalDrawingExtractor(backend=backend)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        corpus = build_corpus(args.resolutions, args.images, args.format, workdir)
+        results = run_benchmark(extractor, corpus, args.max_new_tokens, args.warmup)
+
+    report = {
+        "config": {
+            "backend": type(backend).__name__,
+            "model": backend.model_name,
+            "processor": args.model or args.processor,
+            "processor_stage": processor_stage,
+            "format": args.format,
+            "images_per_resolution": args.images,
+            "max_new_tokens": args.max_new_tokens,
+            "min_pixels": args.min_pixels,
+            "max_pixels": args.max_pixels,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "transformers": transformers.__version__,
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+
+    for result in results:
+        stages = ", ".join(
+            f"{stage} {result['stages'][stage]['mean_ms']:.1f}" for stage in STAGES
+        )
+        print(f"{result['resolution']:>10}: {stages} (ms/drawing)")
+    print(f"processor stage: {processor_stage}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Prompt building from in-memory drawings: encoded bytes, a `memoryview` of them
+and a decoded uint8 array, against the base64 data URI round trip they needed
+so far:
+
+    python -m benchmarks.memory_inputs --resolution 4960x3508 --repeat 5
+
+Peak memory is the peak of Python allocations during one `load_prompt` from
+an input built beforehand, as traced by `tracemalloc`; the pixel buffers of
+Pillow are not included. Every
+encoded input must give the same prompt image as the file on disk, and the
+array the same as the decoded `PIL.Image` it was taken from.
+"""
+
+import argparse
+import base64
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from backends import StubBackend
+from benchmarks.end_to_end import parse_resolution
+from benchmarks.synthetic import make_drawing
+from model import TechnicalDrawingExtractor
+from image_loader import load_image
+from pipeline import load_prompt
+
+
+def run_benchmark(
+    resolution: tuple[int, int], image_format: str, repeat: int, workdir: str
+) -> dict:
+    extractor = TechnicalDrawingExtractor(backend=StubBackend())
+    width, height = resolution
+    path = os.path.join(workdir, f"drawing.{image_format}")
+    make_drawing(width, height, seed=0).save(path, quality=90)
+    with open(path, "rb") as f:
+        data = f.read()
+
+    def prompt_image(source) -> np.ndarray:
+        prompt = load_prompt(extractor, source)
+        return np.asarray(extractor.image_elements(prompt)[0]["image"])
+
+    decoded_image = load_image(path)
+    decoded = np.asarray(decoded_image)
+    expected = {"encoded": prompt_image(path), "ndarray": prompt_image(decoded_image)}
+    inputs = {
+        "data_uri": lambda: f"data:image/{image_format};base64,"
+        + base64.b64encode(data).decode(),
+        "bytes": lambda: data,
+        "memoryview": lambda: memoryview(data),
+        "ndarray": lambda: decoded,
+    }
+
+    results = {}
+    for name, make_input in inputs.items():
+        timings = []
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            # The data URI is built by the caller, so its encoding is part of the cost
+            image = prompt_image(make_input())
+            timings.append(time.perf_counter() - start_time)
+
+        source = make_input()
+        tracemalloc.start()
+        load_prompt(extractor, source)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        results[name] = {
+            "ms": min(timings) * 1000,
+            "peak_python_mb": peak / 1e6,
+            "identical": bool(
+                np.array_equal(image, expected.get(name, expected["encoded"]))
+            ),
+        }
+    return {
+        "resolution": f"{width}x{height}",
+        "format": image_format,
+        "file_mb": len(data) / 1e6,
+        "inputs": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--resolution", type=parse_resolution, default=(4960, 3508))
+    parser.add_argument("--format", choices=["jpeg", "png"], default="jpeg")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        result = run_benchmark(args.resolution, args.format, args.repeat, workdir)
+
+    for name, stats in result["inputs"].items():
+        print(
+            f"{name:>10}: {stats['ms']:.0f} ms, {stats['peak_python_mb']:.1f} MB peak "
+            f"Python allocations, identical: {stats['identical']}"
+        )
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Scaling of `parallel_postprocessing.reprocess` with the number of worker
+processes, on a synthetic extraction log:
+
+    python -m benchmarks.parallel_postprocess --size-mb 512 --workers 1 2 4 8 16 32
+
+The serial baseline is `OCRPostProcessor.iter_parse` in this process. Every
+parallel output is checked to be identical to it, in the same order.
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from benchmarks.parse_log import write_log
+from parallel_postprocessing import reprocess
+from post_processing import OCRPostProcessor
+
+
+def serial_baseline(log_path: str, output_path: str) -> float:
+    processor = OCRPostProcessor()
+    start_time = time.perf_counter()
+    with open(log_path, "r", encoding="utf-8") as f_in, open(
+        output_path, "w", encoding="utf-8"
+    ) as f_out:
+        for result in processor.iter_parse(f_in):
+            f_out.write(json.dumps(result, ensure_ascii=False) + "\n")
+    return time.perf_counter() - start_time
+
+
+def _cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _same_file(path_a: str, path_b: str) -> bool:
+    with open(path_a, "rb") as a, open(path_b, "rb") as b:
+        while True:
+            chunk_a, chunk_b = a.read(1 << 20), b.read(1 << 20)
+            if chunk_a != chunk_b:
+                return False
+            if not chunk_a:
+                return True
+
+
+def run_benchmark(log_path: str, workers: list[int], chunk_mb: float, workdir: str) -> dict:
+    baseline_path = os.path.join(workdir, "serial.jsonl")
+    serial_seconds = serial_baseline(log_path, baseline_path)
+
+    runs = []
+    for n in workers:
+        output_path = os.path.join(workdir, f"parallel_{n}.jsonl")
+        main_cpu_seconds = _cpu_seconds()
+        stats = reprocess(log_path, output_path, "log", workers=n, chunk_mb=chunk_mb)
+        main_cpu_seconds = _cpu_seconds() - main_cpu_seconds
+        runs.append(
+            {
+                "workers": n,
+                "seconds": stats["seconds"],
+                "blocks_per_second": stats["units"] / stats["seconds"],
+                "speedup": serial_seconds / stats["seconds"],
+                "efficiency": serial_seconds / stats["seconds"] / n,
+                # The serial part: cutting the ranges, numbering and writing
+                "main_cpu_seconds": main_cpu_seconds,
+                "speedup_bound": serial_seconds / main_cpu_seconds,
+                "identical": _same_file(baseline_path, output_path),
+            }
+        )
+        os.remove(output_path)
+    return {
+        "log_mb": os.path.getsize(log_path) / 1024 / 1024,
+        "cpu_count": os.cpu_count(),
+        "chunk_mb": chunk_mb,
+        "serial_seconds": serial_seconds,
+        "runs": runs,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=512)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--chunk-mb", type=float, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        log_path = os.path.join(workdir, "extraction_log.txt")
+        write_log(log_path, args.size_mb)
+        report = run_benchmark(log_path, args.workers, args.chunk_mb, workdir)
+
+    print(f"serial iter_parse: {report['serial_seconds']:.1f} s ({report['cpu_count']} CPUs)")
+    for run in report["runs"]:
+        print(
+            f"{run['workers']:>3} workers: {run['seconds']:.1f} s, speedup "
+            f"{run['speedup']:.2f}x, efficiency {run['efficiency']:.0%}, "
+            f"main process bounds the speedup at {run['speedup_bound']:.0f}x"
+            + ("" if run["identical"] else " OUTPUT DIFFERS")
+        )
+    print(json.dumps(report, indent=2))
+    if not all(run["identical"] for run in report["runs"]):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Streaming `iter_parse` against `parse_model_output` on a synthetic multi-GB
+extraction log in the `inference.py` text format:
+
+    python -m benchmarks.parse_log --size-mb 2048 --compare-mb 256
+
+The whole log is parsed with `iter_parse`. `parse_model_output` needs the log as
+one string, so it only gets the first `--compare-mb` megabytes.
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.decode import _peak_rss_kb
+from post_processing import OCRPostProcessor
+
+MALFORMED_RATE = 0.05
+
+
+def _block(rng: random.Random, index: int) -> str:
+    fields = {
+        field: rng.choice(OCRPostProcessor.EXPECTED_VALUES.get(field, [f"V-{rng.randint(0, 99999)}"]))
+        for field in OCRPostProcessor.FIELDS
+    }
+    fields["Dimension of object"] = f"⌀{rng.randint(5, 200)}x{rng.randint(10, 500)}"
+    fields["Dimensional tolerance"] = rng.choice(["±0.1", "±0.05, ±0.01", "general tolerance"])
+
+    roll = rng.random()
+    if roll < MALFORMED_RATE:
+        # Trailing comma: the fence matches but the JSON does not decode
+        response = "```json\n" + json.dumps(fields)[:-1] + ",}\n```"
+    elif roll < 0.6:
+        response = "```json\n" + json.dumps(fields, ensure_ascii=False, indent=2) + "\n```"
+    else:
+        response = "\n".join(f"{key}: {value}" for key, value in fields.items())
+    return (
+        f"Image path: ./images/drawing_{index:08d}.jpg\n"
+        f"Response:\n{response}\n"
+        f"Time taken: {rng.uniform(0.5, 3.0):.2f} seconds\n"
+        + OCRPostProcessor.BLOCK_SEPARATOR
+        + "\n"
+    )
+
+
+def write_log(path: str, size_mb: int, seed: int = 0) -> int:
+    """
+    Write blocks until the log reaches `size_mb` megabytes.
+    :return: Number of blocks written.
+    """
+    rng = random.Random(seed)
+    target = size_mb * 1024 * 1024
+    # A pool of distinct blocks keeps generation from dominating the setup time
+    pool = [_block(rng, index) for index in range(4096)]
+    written, blocks = 0, 0
+    with open(path, "w", encoding="utf-8") as f:
+        while written < target:
+            block = pool[blocks % len(pool)]
+            f.write(block)
+            written += len(block.encode("utf-8"))
+            blocks += 1
+    return blocks
+
+
+def run_benchmark(path: str, compare_mb: int) -> dict:
+    processor = OCRPostProcessor()
+    size_mb = os.path.getsize(path) / 1024 / 1024
+
+    baseline_kb = _peak_rss_kb()
+    start_time = time.perf_counter()
+    records = errors = 0
+    with open(path, "r", encoding="utf-8") as f:
+        for result in processor.iter_parse(f):
+            records += 1
+            errors += "error" in result
+    stream_seconds = time.perf_counter() - start_time
+    stream_peak_mb = (_peak_rss_kb() - baseline_kb) / 1024
+
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read(compare_mb * 1024 * 1024)
+    start_time = time.perf_counter()
+    outputs = processor.parse_model_output(text)
+    split_seconds = time.perf_counter() - start_time
+    split_mb = len(text.encode("utf-8")) / 1024 / 1024
+    del text, outputs
+    split_peak_mb = (_peak_rss_kb() - baseline_kb) / 1024
+
+    return {
+        "log_mb": size_mb,
+        "iter_parse": {
+            "blocks": records,
+            "error_records": errors,
+            "seconds": stream_seconds,
+            "mb_per_second": size_mb / stream_seconds,
+            "blocks_per_second": records / stream_seconds,
+            "peak_rss_increase_mb": stream_peak_mb,
+        },
+        "parse_model_output": {
+            "log_mb": split_mb,
+            "seconds": split_seconds,
+            "mb_per_second": split_mb / split_seconds,
+            "peak_rss_increase_mb": split_peak_mb,
+        },
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=2048)
+    parser.add_argument("--compare-mb", type=int, default=256)
+    parser.add_argument("--log", help="reuse or keep the synthetic log at this path")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = args.log or os.path.join(workdir, "extraction_log.txt")
+        if not os.path.exists(path):
+            write_log(path, args.size_mb)
+        result = run_benchmark(path, args.compare_mb)
+
+    stream, split = result["iter_parse"], result["parse_model_output"]
+    print(
+        f"iter_parse: {result['log_mb']:.0f} MB in {stream['seconds']:.1f} s "
+        f"({stream['mb_per_second']:.1f} MB/s, {stream['error_records']} error records), "
+        f"+{stream['peak_rss_increase_mb']:.1f} MB peak RSS"
+    )
+    print(
+        f"parse_model_output: {split['log_mb']:.0f} MB in {split['seconds']:.1f} s "
+        f"({split['mb_per_second']:.1f} MB/s), "
+        f"+{split['peak_rss_increase_mb']:.1f} MB peak RSS"
+    )
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
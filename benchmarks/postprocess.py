@@ -0,0 +1,58 @@
+"""
+Records per second of bulk re-processing of historical raw outputs through
+`OCRPostProcessor` and the `refactorisation.MainPostprocessor` engine:
+
+    python -m benchmarks.postprocess --records 200000
+"""
+
+import argparse
+import json
+import random
+import time
+
+from benchmarks.synthetic import make_raw_entry
+from post_processing import OCRPostProcessor
+from refactorisation import MainPostprocessor
+
+
+def run_benchmark(records: int, repeats: int = 3, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    entries = [make_raw_entry(rng) for _ in range(records)]
+
+    results = {}
+    for name, processor in [
+        ("OCRPostProcessor", OCRPostProcessor()),
+        ("MainPostprocessor", MainPostprocessor()),
+    ]:
+        convert = processor.convert_to_output_format
+        best = float("inf")
+        for _ in range(repeats):
+            start_time = time.perf_counter()
+            for entry in entries:
+                convert(entry)
+            best = min(best, time.perf_counter() - start_time)
+        results[name] = {
+            "seconds": best,
+            "records_per_second": records / best,
+            "us_per_record": best / records * 1e6,
+        }
+    return {"records": records, "repeats": repeats, "results": results}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--records", type=int, default=200_000)
+    parser.add_argument("--repeats", type=int, default=3, help="best of this many runs")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.records, args.repeats)
+    for name, result in report["results"].items():
+        print(
+            f"{name:>18}: {result['records_per_second']:,.0f} records/s "
+            f"({result['us_per_record']:.1f} µs/record)"
+        )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Prefill latency with and without reuse of the shared prefix KV cache, on a tiny
+randomly initialised Qwen2.5-VL language model running on CPU:
+
+    python -m benchmarks.prefix_cache --prefix-tokens 400 --suffix-tokens 256
+"""
+
+import argparse
+import json
+import time
+
+import torch
+from transformers import Qwen2_5_VLConfig, Qwen2_5_VLForConditionalGeneration
+
+from prefix_cache import PrefixKVCache
+
+
+def build_tiny_model(layers: int, hidden_size: int) -> Qwen2_5_VLForConditionalGeneration:
+    num_heads = 4
+    # The multimodal rope splits half the head dimension into temporal/height/width
+    rotary_half = hidden_size // num_heads // 2
+    temporal = rotary_half // 4
+    height = (rotary_half - temporal) // 2
+    config = Qwen2_5_VLConfig(
+        vocab_size=1024,
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 2,
+        num_hidden_layers=layers,
+        num_attention_heads=num_heads,
+        num_key_value_heads=2,
+        max_position_embeddings=8192,
+        rope_scaling={
+            "type": "mrope",
+            "mrope_section": [temporal, height, rotary_half - temporal - height],
+        },
+        vision_config={
+            "depth": 1,
+            "hidden_size": 32,
+            "intermediate_size": 64,
+            "num_heads": 2,
+            "out_hidden_size": hidden_size,
+        },
+        image_token_id=1000,
+        video_token_id=1001,
+        vision_start_token_id=1002,
+        vision_end_token_id=1003,
+        bos_token_id=1004,
+        eos_token_id=1005,
+        pad_token_id=1006,
+    )
+    torch.manual_seed(0)
+    return Qwen2_5_VLForConditionalGeneration(config).eval()
+
+
+def _best_of(repeat: int, fn) -> float:
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start_time)
+    return min(timings)
+
+
+def run_benchmark(
+    prefix_tokens: int, suffix_tokens: int, layers: int, hidden_size: int, repeat: int
+) -> dict:
+    model = build_tiny_model(layers, hidden_size)
+    prefix_cache = PrefixKVCache(model)
+
+    generator = torch.Generator().manual_seed(0)
+    prefix_ids = torch.randint(0, 1000, (1, prefix_tokens), generator=generator)
+    length = prefix_tokens + suffix_tokens
+
+    def prompt() -> torch.Tensor:
+        suffix_ids = torch.randint(0, 1000, (1, suffix_tokens), generator=generator)
+        return torch.cat([prefix_ids, suffix_ids], dim=1)
+
+    position_ids = PrefixKVCache.text_positions(0, length, prefix_ids.device)
+
+    def full_prefill() -> None:
+        with torch.inference_mode():
+            model(input_ids=prompt(), position_ids=position_ids, use_cache=True)
+
+    def reused_prefill() -> None:
+        with torch.inference_mode():
+            prefix_cache.prefill(prompt(), prefix_tokens, position_ids)
+
+    # Warm up both paths; this also computes the prefix cache once
+    full_prefill()
+    reused_prefill()
+
+    full_seconds = _best_of(repeat, full_prefill)
+    reused_seconds = _best_of(repeat, reused_prefill)
+    return {
+        "prefix_tokens": prefix_tokens,
+        "suffix_tokens": suffix_tokens,
+        "layers": layers,
+        "hidden_size": hidden_size,
+        "full_prefill_ms": full_seconds * 1000,
+        "reused_prefill_ms": reused_seconds * 1000,
+        "speedup": full_seconds / reused_seconds,
+        "prefix_cache": prefix_cache.stats(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--prefix-tokens", type=int, default=400)
+    parser.add_argument("--suffix-tokens", type=int, default=256)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--hidden-size", type=int, default=256)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    result = run_benchmark(
+        args.prefix_tokens,
+        args.suffix_tokens,
+        args.layers,
+        args.hidden_size,
+        args.repeat,
+    )
+    print(
+        f"prefill without reuse: {result['full_prefill_ms']:.1f} ms, "
+        f"with reuse: {result['reused_prefill_ms']:.1f} ms "
+        f"({result['speedup']:.2f}x)"
+    )
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Latency of the asynchronous extraction service under concurrent load, with a
+stub model whose batch latency is `base + per-drawing` sleep:
+
+    python -m benchmarks.serving --requests 400 --rate 40 --max-batch-size 1 8
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import numpy as np
+
+from backends import StubBackend
+from benchmarks.synthetic import make_drawing
+from model import TechnicalDrawingExtractor
+from serving import ExtractionService
+
+
+async def _load(
+    service: ExtractionService, images: list, rate: float, seed: int
+) -> tuple[list[float], float]:
+    rng = random.Random(seed)
+    latencies = []
+
+    async def request(image) -> None:
+        start_time = time.perf_counter()
+        await service.extract(image)
+        latencies.append(time.perf_counter() - start_time)
+
+    # Open-loop load: arrivals follow a Poisson process regardless of completions
+    start_time = time.perf_counter()
+    tasks = []
+    for image in images:
+        tasks.append(asyncio.create_task(request(image)))
+        await asyncio.sleep(rng.expovariate(rate))
+    await asyncio.gather(*tasks)
+    return latencies, time.perf_counter() - start_time
+
+
+async def _serve(
+    images: list,
+    max_batch_size: int,
+    max_wait_ms: float,
+    rate: float,
+    base_ms: float,
+    per_item_ms: float,
+) -> dict:
+    # Prompts arrive already resized, so the stub skips the processor work
+    extractor = TechnicalDrawingExtractor(
+        backend=StubBackend(
+            latency_ms=base_ms, per_item_ms=per_item_ms, process_images=False
+        )
+    )
+    async with ExtractionService(
+        extractor,
+        max_batch_size=max_batch_size,
+        max_wait_ms=max_wait_ms,
+        max_queue_size=max(64, max_batch_size),
+        timeout=None,
+    ) as service:
+        latencies, wall_time = await _load(service, images, rate, seed=0)
+        stats = service.stats()
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "max_batch_size": max_batch_size,
+        "max_wait_ms": max_wait_ms,
+        "requests": len(images),
+        "throughput": len(images) / wall_time,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "mean_batch_size": stats["mean_batch_size"],
+    }
+
+
+def run_benchmark(
+    requests: int,
+    rate: float,
+    max_batch_sizes: list[int],
+    max_wait_ms: float,
+    base_ms: float,
+    per_item_ms: float,
+) -> list[dict]:
+    # Each request still resizes its drawing, as uploads would be
+    drawings = [make_drawing(800, 566, seed=seed) for seed in range(8)]
+    images = [drawings[index % len(drawings)] for index in range(requests)]
+    return [
+        asyncio.run(
+            _serve(images, max_batch_size, max_wait_ms, rate, base_ms, per_item_ms)
+        )
+        for max_batch_size in max_batch_sizes
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--rate", type=float, default=40.0, help="requests per second")
+    parser.add_argument("--max-batch-size", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--max-wait-ms", type=float, default=10.0)
+    parser.add_argument("--base-ms", type=float, default=40.0)
+    parser.add_argument("--per-item-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        args.requests,
+        args.rate,
+        args.max_batch_size,
+        args.max_wait_ms,
+        args.base_ms,
+        args.per_item_ms,
+    )
+    for result in results:
+        print(
+            f"max_batch_size={result['max_batch_size']}: "
+            f"p50 {result['p50_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms, "
+            f"{result['throughput']:.1f} requests/s, "
+            f"mean batch {result['mean_batch_size']:.2f}"
+        )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import random
+
+from PIL import Image, ImageDraw
+
+
+def title_block_box(width: int, height: int) -> tuple[int, int, int, int]:
+    """
+    Box of the title block drawn by `make_drawing`, as (left, top, right, bottom).
+    """
+    margin = max(width, height) // 100
+    block_width = width * 2 // 5
+    block_height = height // 5
+    return (
+        width - margin - block_width,
+        height - margin - block_height,
+        width - margin,
+        height - margin,
+    )
+
+
+def make_drawing(width: int, height: int, seed: int = 0) -> Image.Image:
+    """
+    Draw a synthetic technical drawing: sheet border, part outlines with dimension
+    lines and a gridded title block in the bottom right corner.
+    :param width: Width of the sheet in pixels.
+    :param height: Height of the sheet in pixels.
+    :param seed: Seed of the random part geometry.
+    :return: RGB image of the drawing.
+    """
+    rng = random.Random(seed)
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    stroke = max(1, max(width, height) // 1500)
+    margin = max(width, height) // 100
+
+    draw.rectangle(
+        (margin, margin, width - margin, height - margin), outline="black", width=stroke * 2
+    )
+
+    # Part outlines and dimension lines in the drawing area
+    for _ in range(12):
+        left = rng.randint(margin * 2, width // 2)
+        top = rng.randint(margin * 2, height // 2)
+        right = left + rng.randint(width // 20, width // 4)
+        bottom = top + rng.randint(height // 20, height // 4)
+        if rng.random() < 0.5:
+            draw.rectangle((left, top, right, bottom), outline="black", width=stroke)
+        else:
+            draw.ellipse((left, top, right, bottom), outline="black", width=stroke)
+        draw.line((left, bottom + margin, right, bottom + margin), fill="black", width=1)
+        draw.text((left, bottom + margin * 1.5), f"{right - left:.1f}±0.1", fill="black")
+
+    # Title block
+    left, top, right, bottom = title_block_box(width, height)
+    draw.rectangle((left, top, right, bottom), outline="black", width=stroke * 2)
+    rows, columns = 5, 4
+    for row in range(1, rows):
+        y = top + (bottom - top) * row // rows
+        draw.line((left, y, right, y), fill="black", width=stroke)
+    for column in range(1, columns):
+        x = left + (right - left) * column // columns
+        draw.line((x, top, x, bottom), fill="black", width=stroke)
+    labels = ["Product name", "Product code", "Material", "Customer", "Surface"]
+    for row, label in enumerate(labels):
+        y = top + (bottom - top) * row // rows + stroke * 3
+        draw.text((left + stroke * 3, y), f"{label}: {rng.randint(1000, 9999)}", fill="black")
+
+    return image
+
+
+# Raw values a model emits per field, including the noise the post-processing
+# rules exist for: wrappers, placeholders, case variants and malformed numbers
+_RAW_VALUES = {
+    "Material type": ["stainless steel", "Iron", "ALUMINUM", "brass", "kkkk", "[value]", ""],
+    "Shape of object": ["round", "Plate", "angle", "cylinder", "none", ""],
+    "Tolerance grade": ["Medium grade", "coarse grade", "fine", "Not selected", ""],
+    "Surface roughness": ["Ra0.8", "ra1.6", "Ra3.2", "Ra 6.3", "Ra25~", ""],
+    "Polishing": ["Yes", "No", "yes", "none", ""],
+    "Painting": ["Yes", "No", "NO", ""],
+    "Heat treatment": ["MTB", "quench", "none", "[none]", ""],
+    "Surface treatment": ["GC", "zinc plating", "null", ""],
+    "Customer": ["TOYOTA BOSHOKU CORPORATION", "(ACME)", "name", ""],
+}
+
+
+def make_raw_entry(rng: random.Random) -> dict[str, str]:
+    """
+    Draw the raw fields of one extraction, as parsed from the model output.
+    :param rng: Source of randomness.
+    :return: Field name to raw string value, for all 14 fields.
+    """
+    diameter, length = rng.randint(5, 200), rng.randint(10, 500)
+    return {
+        "Product name": rng.choice(["JOINT", "SHAFT", "'BRACKET'", "text", ""]),
+        "Product code": f"{rng.randint(10000, 99999)}-X{rng.randint(0, 9)}JJ0-A",
+        "Material code": rng.choice(["SS400", "S45C", "SUS304", "code", ""]),
+        "Dimension of object": rng.choice(
+            [
+                f"⌀{diameter}x{length}",
+                f"{length}x⌀{diameter}",
+                f"{diameter} × {length} × {rng.randint(1, 50)}",
+                f"[{diameter}x{length}x{rng.uniform(0.5, 9):.2f}]",
+                f"{diameter}x{length}",
+                "",
+            ]
+        ),
+        "Dimensional tolerance": rng.choice(
+            [
+                f"±{rng.choice(['0.1', '0.05', '0.01', '0.005', '0.001', '0.0005', '0.6'])}",
+                "±0.05, ±0.01",
+                "±0.1 general tolerance",
+                "general tolerance",
+                "±abc",
+                "no tolerance",
+                "",
+            ]
+        ),
+        **{field: rng.choice(values) for field, values in _RAW_VALUES.items()},
+    }
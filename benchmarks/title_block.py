@@ -0,0 +1,170 @@
+"""
+Visual tokens, CPU preprocessing time and prefill latency of sending the title
+block crop instead of the whole sheet, on synthetic drawings:
+
+    python -m benchmarks.title_block --resolutions 1240x877 2480x1754 4960x3508
+
+Every drawing is checked against the box `make_drawing` drew its title block
+in. Prefill latency is measured on the tiny randomly initialised language model
+of `benchmarks.prefix_cache`, over the visual tokens of each prompt plus
+`--text-tokens`; the vision encoder is not included.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+from backends import StubBackend
+from benchmarks.end_to_end import parse_resolution
+from benchmarks.prefix_cache import _best_of, build_tiny_model
+from benchmarks.synthetic import make_drawing, title_block_box
+from model import TechnicalDrawingExtractor
+from pipeline import load_prompt, load_title_block_prompt
+from prefix_cache import PrefixKVCache
+from title_block import find_title_block
+
+MODES = ["whole_sheet", "title_block", "title_block_overview"]
+
+
+def _iou(a: tuple, b: tuple) -> float:
+    left, top = max(a[0], b[0]), max(a[1], b[1])
+    right, bottom = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    area = lambda box: (box[2] - box[0]) * (box[3] - box[1])
+    return inter / (area(a) + area(b) - inter)
+
+
+def _visual_tokens(extractor: TechnicalDrawingExtractor, prompt: list[dict]) -> int:
+    # One token per 28x28 area, after the 2x2 merge of 14 pixel patches
+    return sum(
+        element["resized_width"] // 28 * (element["resized_height"] // 28)
+        for element in extractor.image_elements(prompt)
+    )
+
+
+def run_benchmark(
+    resolutions: list[tuple[int, int]],
+    images: int,
+    overview_max_pixels: int,
+    text_tokens: int,
+    layers: int,
+    hidden_size: int,
+    workdir: str,
+) -> list[dict]:
+    extractor = TechnicalDrawingExtractor(backend=StubBackend())
+    model = build_tiny_model(layers, hidden_size)
+    loaders = {
+        "whole_sheet": lambda path: load_prompt(extractor, path),
+        "title_block": lambda path: load_title_block_prompt(extractor, path),
+        "title_block_overview": lambda path: load_title_block_prompt(
+            extractor, path, overview_max_pixels=overview_max_pixels
+        ),
+    }
+
+    def prefill_seconds(tokens: int) -> float:
+        input_ids = torch.randint(0, 1000, (1, tokens), generator=torch.Generator().manual_seed(0))
+        position_ids = PrefixKVCache.text_positions(0, tokens, input_ids.device)
+
+        def prefill() -> None:
+            with torch.inference_mode():
+                model(input_ids=input_ids, position_ids=position_ids, use_cache=True)
+
+        prefill()
+        return _best_of(3, prefill)
+
+    results = []
+    for width, height in resolutions:
+        ious, detect_ms = [], []
+        load_ms = {mode: [] for mode in MODES}
+        tokens = {mode: [] for mode in MODES}
+        for seed in range(images):
+            path = os.path.join(workdir, f"drawing_{width}x{height}_{seed}.png")
+            drawing = make_drawing(width, height, seed=seed)
+            drawing.save(path)
+
+            start_time = time.perf_counter()
+            box = find_title_block(drawing)
+            detect_ms.append((time.perf_counter() - start_time) * 1000)
+            ious.append(_iou(box, title_block_box(width, height)) if box else 0.0)
+
+            for mode, loader in loaders.items():
+                start_time = time.perf_counter()
+                prompt = loader(path)
+                load_ms[mode].append((time.perf_counter() - start_time) * 1000)
+                tokens[mode].append(_visual_tokens(extractor, prompt))
+
+        modes = {}
+        for mode in MODES:
+            visual_tokens = float(np.mean(tokens[mode]))
+            modes[mode] = {
+                "visual_tokens": visual_tokens,
+                "load_ms": float(np.mean(load_ms[mode])),
+                "prefill_ms": prefill_seconds(round(visual_tokens) + text_tokens) * 1000,
+            }
+        for mode in MODES[1:]:
+            modes[mode]["token_reduction"] = (
+                modes["whole_sheet"]["visual_tokens"] / modes[mode]["visual_tokens"]
+            )
+            modes[mode]["prefill_speedup"] = (
+                modes["whole_sheet"]["prefill_ms"] / modes[mode]["prefill_ms"]
+            )
+        results.append(
+            {
+                "resolution": f"{width}x{height}",
+                "images": images,
+                "detected": sum(iou > 0 for iou in ious),
+                "min_iou": float(min(ious)),
+                "detect_ms": float(np.mean(detect_ms)),
+                "modes": modes,
+            }
+        )
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--resolutions",
+        nargs="+",
+        type=parse_resolution,
+        default=[(1240, 877), (2480, 1754), (4960, 3508)],
+    )
+    parser.add_argument("--images", type=int, default=8)
+    parser.add_argument("--overview-max-pixels", type=int, default=512 * 28 * 28)
+    parser.add_argument("--text-tokens", type=int, default=300)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--hidden-size", type=int, default=256)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = run_benchmark(
+            args.resolutions,
+            args.images,
+            args.overview_max_pixels,
+            args.text_tokens,
+            args.layers,
+            args.hidden_size,
+            workdir,
+        )
+
+    for result in results:
+        modes = result["modes"]
+        print(
+            f"{result['resolution']}: detected {result['detected']}/{result['images']} "
+            f"(min IoU {result['min_iou']:.3f}, {result['detect_ms']:.1f} ms); "
+            + ", ".join(
+                f"{mode} {modes[mode]['visual_tokens']:.0f} tokens "
+                f"{modes[mode]['prefill_ms']:.0f} ms prefill"
+                for mode in MODES
+            )
+        )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
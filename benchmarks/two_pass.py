@@ -0,0 +1,241 @@
+"""
+Visual patches and generated tokens of `TwoPassExtractor` against a single
+full-resolution pass, on synthetic drawings with a stub model:
+
+    python -m benchmarks.two_pass --images 64
+
+The stub reads the title block fields at any resolution. A fraction `--dense`
+of the drawings is printed too small for the other fields to be legible within
+the first pass pixel budget. Each of those fields is also absent from a drawing
+altogether with probability `--absent`. Absent fields are asked again at full
+resolution too, as the first pass cannot tell them from illegible ones.
+
+The zoom pass asks for a subset of the fields. Every second-pass prompt is
+checked to reach the backend with exactly its subset, and the schema constraint
+and the early stopping criterion are checked on a character vocabulary to emit,
+and stop after, exactly the fields of each row.
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+from typing import Optional
+
+import torch
+
+from backends import StubBackend
+from benchmarks.synthetic import make_drawing
+from constrained_decoding import SchemaLogitsProcessor, SchemaVocabulary
+from model import TechnicalDrawingExtractor
+from pipeline import load_prompt
+from post_processing import OCRPostProcessor
+from prompt_generator import Prompt
+from stopping import FieldsEmittedCriteria, FieldTracker
+from two_pass import TwoPassExtractor
+
+TITLE_BLOCK_FIELDS = {"Product name", "Product code", "Material code", "Customer"}
+VALUES = {
+    "Material type": "stainless steel",
+    "Shape of object": "round",
+    "Tolerance grade": "Medium grade",
+    "Dimension of object": "⌀30x150",
+    "Dimensional tolerance": "±0.01",
+    "Surface roughness": "Ra1.6",
+    "Polishing": "No",
+    "Painting": "No",
+}
+
+
+class ResolutionStub(StubBackend):
+    """
+    Answers only the fields a prompt asks for, leaving out the ones the drawing
+    does not show at the prompt's resolution.
+    """
+
+    def __init__(self, dense: float, absent: float, low_max_pixels: int, **kwargs) -> None:
+        super().__init__(process_images=False, **kwargs)
+        self.dense = dense
+        self.absent = absent
+        self.low_max_pixels = low_max_pixels
+        # (fields asked by the prompt, fields passed to the backend) of every prompt
+        self.field_requests: list[tuple[list[str], Optional[list[str]]]] = []
+
+    def _answer(self, prompt: list[dict]) -> str:
+        image, text = None, ""
+        for element in prompt[0]["content"]:
+            if element["type"] == "image":
+                image = element
+            else:
+                text = element["text"]
+        pixels = image["resized_width"] * image["resized_height"]
+        # The same drawing has the same fields at every resolution
+        rng = random.Random(image["image_hash"])
+        dense = rng.random() < self.dense
+
+        lines = []
+        for field in OCRPostProcessor.FIELDS:
+            absent = rng.random() < self.absent and field not in TITLE_BLOCK_FIELDS
+            legible = field in TITLE_BLOCK_FIELDS or not dense
+            if Prompt.FIELD_LINES[field] not in text:
+                continue
+            shown = not absent and (legible or pixels > self.low_max_pixels)
+            lines.append(f"{field}: {VALUES.get(field, 'A-100') if shown else ''}")
+        return "\n".join(lines)
+
+    def generate_batch(
+        self, inputs, max_new_tokens, image_keys=None, metrics=None, fields=None
+    ):
+        for row, prompt in enumerate(inputs):
+            text = next(
+                element["text"] for element in prompt[0]["content"] if element["type"] == "text"
+            )
+            asked = [
+                field for field in OCRPostProcessor.FIELDS if Prompt.FIELD_LINES[field] in text
+            ]
+            self.field_requests.append((asked, fields[row] if fields is not None else None))
+        return [self._answer(prompt)[: max_new_tokens * self.CHARS_PER_TOKEN] for prompt in inputs]
+
+
+class _CharTokenizer:
+    """
+    One token per character, plus an end-of-sequence token.
+    """
+
+    def __init__(self, chars: list[str]) -> None:
+        self.strings = chars + [""]
+        self.eos_token_id = len(chars)
+        self.all_special_ids = [self.eos_token_id]
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def batch_decode(self, sequences, skip_special_tokens: bool = False, **kwargs) -> list[str]:
+        return ["".join(self.strings[int(token_id)] for token_id in ids) for ids in sequences]
+
+
+def check_field_subsets(row_fields: list[Optional[list[str]]], max_steps: int = 1000) -> bool:
+    """
+    Greedy decoding under the schema constraint and the early stopping criterion,
+    with random scores that favour short values.
+    :return: Whether every row emitted exactly its fields, in order, and was
+        stopped right after the last one, while the adaptive budget would take
+        the output as complete.
+    """
+    chars = {chr(code) for code in range(32, 127)} | {"\n"}
+    for field in OCRPostProcessor.FIELDS:
+        chars.update(field)
+    for values in OCRPostProcessor.EXPECTED_VALUES.values():
+        for value in values:
+            chars.update(value)
+    tokenizer = _CharTokenizer(sorted(chars))
+    vocabulary = SchemaVocabulary(tokenizer)
+    processor = SchemaLogitsProcessor(
+        vocabulary, [tokenizer.eos_token_id], row_fields=row_fields
+    )
+    criteria = FieldsEmittedCriteria(tokenizer, row_fields=row_fields)
+
+    generator = torch.Generator().manual_seed(0)
+    rows = len(row_fields)
+    input_ids = torch.full((rows, 1), vocabulary.newline_ids[0])
+    stopped_at = [None] * rows
+    for step in range(max_steps):
+        scores = torch.rand(rows, len(tokenizer), generator=generator)
+        scores[:, vocabulary.newline_ids] += 0.5
+        next_ids = processor(input_ids, scores).argmax(dim=-1, keepdim=True)
+        input_ids = torch.cat([input_ids, next_ids], dim=-1)
+        for row, done in enumerate(criteria(input_ids, scores).tolist()):
+            if done and stopped_at[row] is None:
+                stopped_at[row] = step + 2
+        if all(stop is not None for stop in stopped_at):
+            break
+
+    for row, fields in enumerate(row_fields):
+        fields = fields or OCRPostProcessor.FIELDS
+        if stopped_at[row] is None:
+            return False
+        text = tokenizer.batch_decode([input_ids[row, 1 : stopped_at[row]]])[0]
+        keys = [line.split(":", 1)[0] for line in text.splitlines() if line]
+        if keys != list(fields) or not text.endswith("\n"):
+            return False
+        if not FieldTracker(fields).feed(text):
+            return False
+    return True
+
+
+def run_benchmark(
+    paths: list[str], dense: float, absent: float, low_max_pixels: int, workdir: str
+) -> dict:
+    min_pixels, max_pixels = 512 * 28 * 28, 1536 * 28 * 28
+
+    def extractor(name: str) -> TechnicalDrawingExtractor:
+        backend = ResolutionStub(
+            dense, absent, low_max_pixels, min_pixels=min_pixels, max_pixels=max_pixels
+        )
+        # With a result cache, prompts carry the `image_hash` the stub keys on
+        return TechnicalDrawingExtractor(
+            backend=backend, cache_dir=os.path.join(workdir, f"cache_{name}")
+        )
+
+    single = extractor("single")
+    baseline = single.run_batch([load_prompt(single, path) for path in paths])
+    single_stats = single.generation_stats()
+
+    two_pass = TwoPassExtractor(extractor("two_pass"), low_max_pixels=low_max_pixels)
+    results = two_pass.run(paths)
+    stats = two_pass.stats()
+    requests = two_pass.extractor.backend.field_requests
+    stats["subset_fields_passed"] = all(
+        fields == asked for asked, fields in requests[len(paths) :]
+    ) and all(fields is None for _, fields in requests[: len(paths)])
+    stats["subset_decoding_ok"] = check_field_subsets(
+        [
+            ["Material type", "Polishing"],
+            None,
+            ["Shape of object", "Surface roughness", "Painting"],
+        ]
+    )
+    stats["single_pass_generated_tokens_per_drawing"] = single_stats["tokens_per_drawing"]
+    stats["saved_generated_tokens_per_drawing"] = (
+        single_stats["tokens_per_drawing"] - stats["generated_tokens_per_drawing"]
+    )
+    stats["identical_results"] = sum(a == b for a, b in zip(baseline, results))
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--images", type=int, default=64)
+    parser.add_argument("--dense", type=float, default=0.3)
+    parser.add_argument("--absent", type=float, default=0.02)
+    parser.add_argument("--low-max-pixels", type=int, default=512 * 28 * 28)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        paths = []
+        for seed in range(args.images):
+            width, height = random.Random(seed).choice([(1240, 877), (2480, 1754), (4960, 3508)])
+            path = os.path.join(workdir, f"drawing_{seed}.png")
+            make_drawing(width, height, seed=seed).save(path)
+            paths.append(path)
+        stats = run_benchmark(
+            paths, args.dense, args.absent, args.low_max_pixels, workdir
+        )
+
+    print(
+        f"{stats['second_pass_fraction']:.0%} of drawings zoomed in; per drawing: "
+        f"{stats['saved_visual_patches_per_drawing']:.0f} visual patches "
+        f"({stats['saved_visual_tokens_per_drawing']:.0f} tokens) and "
+        f"{stats['saved_generated_tokens_per_drawing']:.1f} generated tokens saved; "
+        f"{stats['identical_results']}/{stats['drawings']} results identical to a single pass"
+    )
+    print(
+        f"field subsets passed to the backend: {stats['subset_fields_passed']}, "
+        f"constrained to and stopped at the subset: {stats['subset_decoding_ok']}"
+    )
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
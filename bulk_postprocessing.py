@@ -0,0 +1,299 @@
+import gc
+from operator import methodcaller
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from post_processing import OCRPostProcessor, _tolerance_table
+
+# Output fields holding a cleaned raw field, and the raw field they come from
+CLEANED_FIELDS = {
+    "ocr_product_code": "Product code",
+    "ocr_product_name": "Product name",
+    "ocr_drawing_number": "Product code",
+    "ocr_drawing_issuer": "Customer",
+    "material_type.material_code": "Material code",
+    "material_type.material_type": "Material type",
+    "required_precision.tolerance_grade": "Tolerance grade",
+    "product_shape.shape": "Shape of object",
+    "surface_roughness": "Surface roughness",
+    "polishing": "Polishing",
+    "painting": "Painting",
+    "surface_treatment.content": "Surface treatment",
+    "heat_treatment.content": "Heat treatment",
+}
+
+
+def _factorize(values: List) -> Tuple[List, np.ndarray]:
+    """
+    Distinct values of a column and, for every row, the index of its value.
+    Values of different types never share an index, so `1` and `"1"` stay apart.
+    :return: (uniques, codes)
+    """
+    if set(map(type, values)) <= {str}:
+        # The common all-string column, hashed and looked up at C speed
+        index = dict.fromkeys(values)
+        for code, value in enumerate(index):
+            index[value] = code
+        codes = np.fromiter(map(index.__getitem__, values), dtype=np.intp, count=len(values))
+        return list(index), codes
+
+    index: Dict = {}
+    uniques: List = []
+    codes = np.empty(len(values), dtype=np.intp)
+    for row, value in enumerate(values):
+        try:
+            key = (value.__class__, value)
+            code = index.get(key)
+        except TypeError:
+            # Unhashable (a list or dict from the JSON): a value of its own
+            key, code = None, None
+        if code is None:
+            code = len(uniques)
+            uniques.append(value)
+            if key is not None:
+                index[key] = code
+        codes[row] = code
+    return uniques, codes
+
+
+def _map_unique(values: List, rule: Callable) -> np.ndarray:
+    """
+    Apply a scalar rule once per distinct value and scatter the results to all rows.
+    """
+    uniques, codes = _factorize(values)
+    mapped = np.empty(len(uniques), dtype=object)
+    mapped[:] = [rule(value) for value in uniques]
+    return mapped[codes]
+
+
+class ColumnarPostProcessor:
+    """
+    Bulk version of `OCRPostProcessor.convert_to_output_format`, for re-running
+    post-processing over many stored raw outputs at once.
+
+    Raw values are loaded into one column per field. Every column is factorized,
+    so each rule runs once per distinct raw value rather than once per record.
+    Enum normalisation, the yes/no flags and the dimension rules are then
+    scattered back with a vectorized take, and tolerances are classified with one
+    `searchsorted` over the whole column. Results are identical to calling
+    `convert_to_output_format` on every record.
+    """
+
+    def __init__(self, processor: Optional[OCRPostProcessor] = None) -> None:
+        """
+        :param processor: Post-processor whose rules are applied. Rules changed on
+            it (followed by `compile_rules`) are picked up by the next call.
+        """
+        self.processor = processor or OCRPostProcessor()
+
+    @staticmethod
+    def load_columns(entries: List[Dict]) -> Dict[str, List]:
+        """
+        One column of raw values per field, "" where a record lacks the field.
+        """
+        fields = set(CLEANED_FIELDS.values()) | {
+            "Dimensional tolerance",
+            "Dimension of object",
+        }
+        return {
+            field: list(map(methodcaller("get", field, ""), entries)) for field in fields
+        }
+
+    def classify_tolerances(
+        self,
+        values: List,
+        general_tolerance_label: str = "GENERAL_TOLERANCE",
+        default_value: str = "NO_SELECTION",
+    ) -> np.ndarray:
+        """
+        `postprocess_dimensional_tolerance_general` over a column.
+        """
+        processor = self.processor
+        uniques, codes = _factorize(values)
+        most_precise = [
+            processor.get_most_precise_dimensional_tolerance(
+                value,
+                default_value=default_value,
+                general_tolerance_label=general_tolerance_label,
+            )
+            for value in uniques
+        ]
+
+        # The numeric value of every `±x` answer, NaN for the others
+        labels = np.empty(len(uniques), dtype=object)
+        numbers = np.full(len(uniques), np.nan)
+        for i, tolerance in enumerate(most_precise):
+            labels[i] = default_value
+            if not tolerance or "no" in tolerance.lower():
+                continue
+            if general_tolerance_label in tolerance:
+                labels[i] = general_tolerance_label
+                continue
+            tolerance = tolerance.strip().lower()
+            if tolerance.startswith("±"):
+                try:
+                    numbers[i] = float(tolerance[1:])
+                except ValueError:
+                    continue
+
+        thresholds, threshold_labels = _tolerance_table(
+            tuple(processor.ALLOWED_TOLERANCES)
+        )
+        if thresholds:
+            # NaN compares False, so it stays at the default like the scalar rule
+            matched = numbers >= thresholds[0]
+            classes = np.searchsorted(thresholds, numbers[matched], side="right") - 1
+            labels[matched] = np.array(threshold_labels, dtype=object)[classes]
+        return labels[codes]
+
+    def convert_columns(self, columns: Dict[str, List]) -> Dict[str, np.ndarray]:
+        """
+        Output columns, keyed by the dotted path of the output field.
+        :param columns: Raw columns as returned by `load_columns`.
+        """
+        processor = self.processor
+        cleaned_raw = {
+            field: _map_unique(
+                columns[field], lambda value, field=field: processor.clean_value(value, field)
+            )
+            for field in set(CLEANED_FIELDS.values())
+            if field not in ("Surface treatment", "Heat treatment")
+        }
+        for field in ("Surface treatment", "Heat treatment"):
+            # `get_instruction_and_content` cleans without a field name
+            cleaned_raw[field] = _map_unique(columns[field], processor.clean_value)
+
+        outputs = {
+            name: cleaned_raw[field] for name, field in CLEANED_FIELDS.items()
+        }
+        outputs["product_shape.shape"] = np.where(
+            outputs["product_shape.shape"] == "", "others", outputs["product_shape.shape"]
+        ).astype(object)
+        for name in ("polishing", "painting"):
+            lowered = np.array([value.lower() for value in outputs[name]], dtype=object)
+            outputs[name] = np.where(
+                (lowered == "") | (lowered == "no"), "NO", "YES"
+            ).astype(object)
+        for name in ("surface_treatment", "heat_treatment"):
+            outputs[f"{name}.instruction"] = np.where(
+                outputs[f"{name}.content"] == "", "NO", "YES"
+            ).astype(object)
+
+        outputs["required_precision.dimensional_tolerance"] = self.classify_tolerances(
+            columns["Dimensional tolerance"]
+        )
+        outputs["product_shape.dimension"] = _map_unique(
+            columns["Dimension of object"], processor.clean_dimension
+        )
+        return outputs
+
+    def convert_many(self, entries: Iterable[Dict]) -> List[Dict]:
+        """
+        `convert_to_output_format` of every entry, in order.
+        """
+        entries = list(entries)
+        # Anything but a dict goes through the scalar path and its fallback
+        rows = [i for i, entry in enumerate(entries) if isinstance(entry, dict)]
+        results: List[Optional[Dict]] = [
+            None if isinstance(entry, dict) else self.processor.convert_to_output_format(entry)
+            for entry in entries
+        ]
+        if not rows:
+            return results
+
+        outputs = self.convert_columns(self.load_columns([entries[i] for i in rows]))
+        columns = {name: column.tolist() for name, column in outputs.items()}
+        # Millions of new acyclic dicts would otherwise trigger collection passes
+        # over every live object, over and over
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self._assemble(rows, columns, results)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        return results
+
+    @staticmethod
+    def _assemble(rows: List[int], columns: Dict[str, List], results: List) -> None:
+        for (
+            i,
+            product_code,
+            product_name,
+            drawing_number,
+            drawing_issuer,
+            material_code,
+            material_type,
+            tolerance_grade,
+            dimensional_tolerance,
+            shape,
+            dimension,
+            surface_roughness,
+            polishing,
+            surface_treatment_instruction,
+            surface_treatment,
+            heat_treatment_instruction,
+            heat_treatment,
+            painting,
+        ) in zip(
+            rows,
+            *(
+                columns[name]
+                for name in (
+                    "ocr_product_code",
+                    "ocr_product_name",
+                    "ocr_drawing_number",
+                    "ocr_drawing_issuer",
+                    "material_type.material_code",
+                    "material_type.material_type",
+                    "required_precision.tolerance_grade",
+                    "required_precision.dimensional_tolerance",
+                    "product_shape.shape",
+                    "product_shape.dimension",
+                    "surface_roughness",
+                    "polishing",
+                    "surface_treatment.instruction",
+                    "surface_treatment.content",
+                    "heat_treatment.instruction",
+                    "heat_treatment.content",
+                    "painting",
+                )
+            ),
+        ):
+            results[i] = {
+                "ocr_product_code": product_code,
+                "ocr_product_name": product_name,
+                "ocr_drawing_number": drawing_number,
+                "ocr_drawing_issuer": drawing_issuer,
+                "material_type": {
+                    "material_code": material_code,
+                    "material_type": material_type,
+                },
+                "required_precision": {
+                    "tolerance_grade": tolerance_grade,
+                    "dimensional_tolerance": dimensional_tolerance,
+                },
+                "product_shape": {"shape": shape, "dimension": dimension},
+                "processing_content": {
+                    "processing_surface": 0,
+                    "processing_locations": 0,
+                    "number_of_special_processing_locations": 0,
+                },
+                "lathe_processing_content": {
+                    "processing_surface": 0,
+                    "processing_locations": 0,
+                    "number_of_special_processing_locations": 0,
+                },
+                "surface_roughness": surface_roughness,
+                "polishing": polishing,
+                "surface_treatment": {
+                    "instruction": surface_treatment_instruction,
+                    "content": surface_treatment,
+                },
+                "heat_treatment": {
+                    "instruction": heat_treatment_instruction,
+                    "content": heat_treatment,
+                },
+                "painting": painting,
+            }
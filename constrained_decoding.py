@@ -0,0 +1,167 @@
+from collections import defaultdict
+from typing import Optional
+
+import torch
+from transformers import LogitsProcessor
+
+from post_processing import OCRPostProcessor
+
+
+class SchemaVocabulary:
+    """
+    Decoded text of every token of a tokenizer, indexed for the schema constraint.
+    Building it decodes the whole vocabulary once, so it is meant to be shared.
+    """
+
+    def __init__(self, tokenizer) -> None:
+        vocab_size = len(tokenizer)
+        self.strings = tokenizer.batch_decode(
+            [[token_id] for token_id in range(vocab_size)],
+            skip_special_tokens=False,
+            clean_up_tokenization_spaces=False,
+        )
+
+        self.ids_by_string = defaultdict(list)
+        for token_id, string in enumerate(self.strings):
+            if string:
+                self.ids_by_string[string].append(token_id)
+
+        self.special_ids = set(tokenizer.all_special_ids)
+        self.newline_ids = self.ids_by_string.get("\n", [])
+        # Free-form values may use any ordinary token that does not end the line
+        self.free_text_mask = torch.tensor(
+            [
+                bool(string) and "\n" not in string and token_id not in self.special_ids
+                for token_id, string in enumerate(self.strings)
+            ]
+        )
+
+    def prefix_ids(self, text: str) -> list[int]:
+        """
+        Ids of the tokens whose text is a non-empty prefix of `text`.
+        """
+        token_ids = []
+        for end in range(1, len(text) + 1):
+            token_ids.extend(self.ids_by_string.get(text[:end], ()))
+        return token_ids
+
+
+class SchemaLogitsProcessor(LogitsProcessor):
+    """
+    Forces the output into the exact `Key: value` schema of the extraction prompt.
+
+    Keys are emitted verbatim and in order, one field per line. Fields listed in
+    `expected_values` may only take one of their allowed values or stay blank;
+    other values are free text up to the end of the line. Once the last field
+    is closed only the end-of-sequence token is allowed. A new instance is
+    needed for every `generate` call, as it tracks the state of each row.
+    Rows of a batch can each be held to their own fields with `row_fields`.
+    """
+
+    # Key phase emits the field name, value phase its value, done allows only EOS
+    KEY, VALUE, DONE = range(3)
+
+    def __init__(
+        self,
+        vocabulary: SchemaVocabulary,
+        eos_token_ids: list[int],
+        fields: Optional[list[str]] = None,
+        expected_values: Optional[dict[str, list[str]]] = None,
+        row_fields: Optional[list[Optional[list[str]]]] = None,
+    ) -> None:
+        """
+        :param fields: Fields of every row, in prompt order. All of them by default.
+        :param row_fields: Fields of each row of the batch, None for a row
+            asking for `fields`.
+        """
+        self.vocabulary = vocabulary
+        self.eos_token_ids = list(eos_token_ids)
+        self.fields = fields if fields is not None else OCRPostProcessor.FIELDS
+        self.row_fields = row_fields
+        expected_values = (
+            expected_values
+            if expected_values is not None
+            else OCRPostProcessor.EXPECTED_VALUES
+        )
+        # Values are written after "Key:", usually with a separating space
+        self.options = {
+            field: [f" {value}" for value in values] + list(values)
+            for field, values in expected_values.items()
+        }
+
+        self._prompt_length = None
+        self._states = None
+        self._fields = None
+
+    def _initial_state(self, fields: list[str]) -> list:
+        return [0, self.KEY, f"{fields[0]}:"]
+
+    def _advance(self, state: list, text: str, fields: list[str]) -> None:
+        field_index, phase, pending = state
+        if phase == self.KEY:
+            pending = pending[len(text) :]
+            if not pending:
+                phase = self.VALUE
+        elif phase == self.VALUE:
+            if text == "\n":
+                field_index += 1
+                if field_index == len(fields):
+                    phase, pending = self.DONE, ""
+                else:
+                    phase, pending = self.KEY, f"{fields[field_index]}:"
+            else:
+                pending += text
+        state[:] = [field_index, phase, pending]
+
+    def _allowed_ids(self, state: list, fields: list[str]) -> Optional[list[int]]:
+        """
+        Allowed token ids in `state`, or None for free text.
+        """
+        field_index, phase, pending = state
+        if phase == self.DONE:
+            return self.eos_token_ids
+        if phase == self.KEY:
+            return self.vocabulary.prefix_ids(pending)
+
+        field = fields[field_index]
+        if field not in self.options:
+            return None
+
+        allowed = []
+        for option in self.options[field]:
+            if option.startswith(pending) and len(option) > len(pending):
+                allowed.extend(self.vocabulary.prefix_ids(option[len(pending) :]))
+        if pending.strip() == "" or pending in self.options[field]:
+            allowed.extend(self.vocabulary.newline_ids)
+        return allowed
+
+    def __call__(
+        self, input_ids: torch.LongTensor, scores: torch.FloatTensor
+    ) -> torch.FloatTensor:
+        if self._states is None:
+            self._prompt_length = input_ids.shape[1]
+            self._fields = [
+                fields or self.fields
+                for fields in (self.row_fields or [None] * input_ids.shape[0])
+            ]
+            self._states = [self._initial_state(fields) for fields in self._fields]
+        elif input_ids.shape[1] > self._prompt_length:
+            strings = self.vocabulary.strings
+            for row, state in enumerate(self._states):
+                token_id = int(input_ids[row, -1])
+                if state[1] != self.DONE and token_id < len(strings):
+                    self._advance(state, strings[token_id], self._fields[row])
+
+        vocab_size = scores.shape[-1]
+        mask = torch.zeros_like(scores, dtype=torch.bool)
+        free_text_mask = self.vocabulary.free_text_mask.to(scores.device)
+        for row, state in enumerate(self._states):
+            allowed = self._allowed_ids(state, self._fields[row])
+            if allowed is None:
+                shared = min(vocab_size, len(free_text_mask))
+                mask[row, :shared] = free_text_mask[:shared]
+                allowed = self.vocabulary.newline_ids
+            allowed = [token_id for token_id in allowed if token_id < vocab_size]
+            mask[row, allowed] = True
+
+        return scores.masked_fill(~mask, float("-inf"))
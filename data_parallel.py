@@ -0,0 +1,382 @@
+import multiprocessing
+import os
+import queue
+import time
+import traceback
+from collections import deque
+from typing import Callable, Iterable, Iterator, Optional
+
+import torch
+
+from image_loader import ImageSource
+from model import TechnicalDrawingExtractor
+from pipeline import PipelinedRunner
+
+
+def _claim_tasks(task_queue, indices: deque) -> Iterator[ImageSource]:
+    """
+    Take the drawings sent to the replica one at a time, as the runner's loader
+    threads get to them, and note their position in the input. A run ends at
+    the first None.
+    """
+    while True:
+        task = task_queue.get()
+        if task is None:
+            return
+        index, image_path = task
+        indices.append(index)
+        yield image_path
+
+
+def _worker(
+    replica: int,
+    device: str,
+    extractor_factory: Callable[..., TechnicalDrawingExtractor],
+    extractor_kwargs: dict,
+    runner_kwargs: dict,
+    torch_threads: Optional[int],
+    control_queue,
+    task_queue,
+    result_queue,
+) -> None:
+    try:
+        if torch_threads is not None:
+            torch.set_num_threads(torch_threads)
+        extractor = extractor_factory(device_map=device, **extractor_kwargs)
+        runner = PipelinedRunner(extractor, **runner_kwargs)
+        result_queue.put(("ready", replica, runner.window))
+
+        while (message := control_queue.get()) is not None:
+            if message == "reset":
+                runner.reset_stats()
+                extractor.reset_generation_stats()
+                continue
+            # Records come out in the order the drawings were claimed
+            indices: deque = deque()
+            for record in runner.run_records(_claim_tasks(task_queue, indices)):
+                record["replica"] = replica
+                result_queue.put(("record", indices.popleft(), record))
+            result_queue.put(("done", replica, runner.summary()))
+    except BaseException:
+        result_queue.put(("error", replica, traceback.format_exc()))
+
+
+def _merge_summaries(summaries: list[dict]) -> dict:
+    """
+    Combine the `PipelinedRunner` summaries of the replicas into one: counters
+    and stage timings are summed, and rates are recomputed from the sums.
+    """
+    merged = {
+        "num_images": sum(summary["num_images"] for summary in summaries),
+        "stage_timings": {
+            stage: sum(summary["stage_timings"][stage] for summary in summaries)
+            for stage in (summaries[0]["stage_timings"] if summaries else ())
+        },
+    }
+
+    result_caches = [summary["result_cache"] for summary in summaries if summary["result_cache"]]
+    merged["result_cache"] = None
+    if result_caches:
+        cache = {
+            key: sum(stats[key] for stats in result_caches)
+            for key in ("hits", "misses", "evictions")
+        }
+        lookups = cache["hits"] + cache["misses"]
+        cache["hit_rate"] = cache["hits"] / lookups if lookups else 0.0
+        # Replicas given the same cache directory share one database
+        cache["bytes"] = max(stats["bytes"] for stats in result_caches)
+        merged["result_cache"] = cache
+
+    embedding_caches = [
+        summary["embedding_cache"] for summary in summaries if summary["embedding_cache"]
+    ]
+    merged["embedding_cache"] = None
+    if embedding_caches:
+        cache = {
+            key: sum(stats[key] for stats in embedding_caches)
+            for key in ("memory_hits", "disk_hits", "misses", "memory_items")
+        }
+        lookups = cache["memory_hits"] + cache["disk_hits"] + cache["misses"]
+        cache["hit_rate"] = (
+            (cache["memory_hits"] + cache["disk_hits"]) / lookups if lookups else 0.0
+        )
+        merged["embedding_cache"] = cache
+
+    generation = {
+        key: sum(summary["generation"][key] for summary in summaries)
+        for key in (
+            "drawings",
+            "generated_tokens",
+            "max_new_tokens",
+            "retries",
+            "visual_tokens",
+            "padded_visual_tokens",
+        )
+    }
+    drawings = generation["drawings"]
+    saved = generation["max_new_tokens"] - generation["generated_tokens"]
+    generation["tokens_per_drawing"] = (
+        generation["generated_tokens"] / drawings if drawings else 0.0
+    )
+    generation["saved_tokens_per_drawing"] = saved / drawings if drawings else 0.0
+    generation["padding_efficiency"] = (
+        generation["visual_tokens"] / generation["padded_visual_tokens"]
+        if generation["padded_visual_tokens"]
+        else 1.0
+    )
+    merged["generation"] = generation
+    return merged
+
+
+class DataParallelRunner:
+    """
+    Runs extraction on several extractor replicas at once, one worker process
+    per device.
+
+    Every replica builds its own extractor on its device once, and runs a
+    `PipelinedRunner`. The drawings of a run are read from the input as they
+    are needed and sent to the replica with the fewest unfinished drawings, up
+    to two batching windows of its runner: one generating and one loading. A
+    fast or lightly loaded replica thus takes on more of the work than a slow
+    one, instead of each getting a fixed share up front, and a long input,
+    such as the pages of a folder of documents, is never held in full. The
+    records of all replicas are merged back into input order.
+
+    The replicas are started by the first run, or by `start`, and are kept for
+    the next runs until `close`.
+    """
+
+    def __init__(
+        self,
+        devices: list[str],
+        extractor_kwargs: Optional[dict] = None,
+        runner_kwargs: Optional[dict] = None,
+        torch_threads: Optional[int] = None,
+        extractor_factory: Callable[..., TechnicalDrawingExtractor] = TechnicalDrawingExtractor,
+        start_method: str = "spawn",
+    ) -> None:
+        """
+        :param devices: Device of every replica, such as `["cuda:0", "cuda:1"]`,
+            or `["cpu"] * 4` for four CPU worker processes.
+        :param extractor_kwargs: Arguments of the extractor of each replica, besides
+            `device_map`. With a `backend`, such as a `StubBackend`, every replica
+            gets a copy of it and the device is ignored.
+        :param runner_kwargs: Arguments of the `PipelinedRunner` of each replica.
+        :param torch_threads: Intra-op threads per replica. Replicas on the CPU
+            share the cores evenly by default.
+        :param extractor_factory: Builds the extractor of a replica from
+            `device_map` and `extractor_kwargs`. Must be importable by the workers.
+        :param start_method: `multiprocessing` start method. CUDA needs "spawn".
+        """
+        if not devices:
+            raise ValueError("devices must not be empty")
+
+        self.devices = list(devices)
+        self.extractor_kwargs = extractor_kwargs or {}
+        self.runner_kwargs = runner_kwargs or {}
+        if torch_threads is None and all(device == "cpu" for device in self.devices):
+            torch_threads = max(1, (os.cpu_count() or 1) // len(self.devices))
+        self.torch_threads = torch_threads
+        self.extractor_factory = extractor_factory
+        self._context = multiprocessing.get_context(start_method)
+
+        self._workers: list = []
+        self._control_queues: list = []
+        self._task_queues: list = []
+        # Unfinished drawings each replica is sent at most
+        self._claim_limits: list[int] = []
+        self.startup_time = 0.0
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        # Running replicas reset theirs before their next run
+        if self._workers:
+            for control_queue in self._control_queues:
+                control_queue.put("reset")
+        self.replica_summaries: list[Optional[dict]] = [None] * len(self.devices)
+        self.images_per_replica = [0] * len(self.devices)
+        self.num_images = 0
+        self.wall_time = 0.0
+
+    def _get(self, poll_interval: float = 1.0) -> tuple:
+        """
+        Next (kind, replica or drawing index, payload) message of the replicas.
+        Raises when a replica failed or died.
+        """
+        while True:
+            try:
+                kind, key, payload = self._result_queue.get(timeout=poll_interval)
+            except queue.Empty:
+                for replica, worker in enumerate(self._workers):
+                    if not worker.is_alive():
+                        raise RuntimeError(
+                            f"Replica {replica} on {self.devices[replica]} exited with "
+                            f"code {worker.exitcode}"
+                        )
+                continue
+            if kind == "error":
+                raise RuntimeError(f"Replica {key} on {self.devices[key]} failed:\n{payload}")
+            return kind, key, payload
+
+    def start(self) -> None:
+        """
+        Start the replicas and wait until all of them have built their extractor.
+        """
+        if self._workers:
+            return
+        start_time = time.perf_counter()
+        self._result_queue = self._context.Queue()
+        self._control_queues = [self._context.Queue() for _ in self.devices]
+        self._task_queues = [self._context.Queue() for _ in self.devices]
+        self._claim_limits = [0] * len(self.devices)
+        self._workers = [
+            self._context.Process(
+                target=_worker,
+                args=(
+                    replica,
+                    device,
+                    self.extractor_factory,
+                    self.extractor_kwargs,
+                    self.runner_kwargs,
+                    self.torch_threads,
+                    self._control_queues[replica],
+                    self._task_queues[replica],
+                    self._result_queue,
+                ),
+                daemon=True,
+            )
+            for replica, device in enumerate(self.devices)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+        try:
+            for _ in self._workers:
+                _, replica, window = self._get()
+                self._claim_limits[replica] = 2 * window
+        except BaseException:
+            self.close()
+            raise
+        self.startup_time = time.perf_counter() - start_time
+
+    def close(self, timeout: float = 10.0) -> None:
+        """
+        Stop the replicas.
+        :param timeout: Seconds a replica gets to stop before it is terminated,
+            such as one still busy with an interrupted run.
+        """
+        for control_queue, worker in zip(self._control_queues, self._workers):
+            if worker.is_alive():
+                control_queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout)
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+        self._workers = []
+
+    def __enter__(self) -> "DataParallelRunner":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def run_records(self, image_paths: Iterable[ImageSource]) -> Iterator[dict]:
+        """
+        Run extraction over `image_paths` on all replicas.
+        :param image_paths: Paths to the drawings to process, or pages from
+            `documents.iter_sources`. They are sent to the workers, so they must
+            be picklable. An iterator is consumed only as the replicas have room.
+        :return: Iterator of the records of `PipelinedRunner.run_records`, with
+            the `replica` that made each one, in input order.
+        """
+        self.start()
+        start_time = time.perf_counter()
+
+        for control_queue in self._control_queues:
+            control_queue.put("run")
+        tasks = enumerate(image_paths)
+        exhausted = False
+        unfinished = [0] * len(self._workers)
+
+        # Records that arrive ahead of an earlier drawing wait here
+        pending: dict[int, dict] = {}
+        next_index = 0
+        running = len(self._workers)
+        finished = False
+        try:
+            while running:
+                # Top up the replicas, the one with the fewest unfinished drawings first
+                while not exhausted:
+                    replica = min(range(len(unfinished)), key=unfinished.__getitem__)
+                    if unfinished[replica] >= self._claim_limits[replica]:
+                        break
+                    task = next(tasks, None)
+                    if task is None:
+                        exhausted = True
+                        for task_queue in self._task_queues:
+                            task_queue.put(None)
+                        break
+                    self._task_queues[replica].put(task)
+                    unfinished[replica] += 1
+
+                kind, key, payload = self._get()
+                if kind == "done":
+                    self.replica_summaries[key] = payload
+                    running -= 1
+                    continue
+
+                unfinished[payload["replica"]] -= 1
+                pending[key] = payload
+                while next_index in pending:
+                    record = pending.pop(next_index)
+                    self.images_per_replica[record["replica"]] += 1
+                    self.num_images += 1
+                    yield record
+                    next_index += 1
+            finished = True
+        finally:
+            if not finished:
+                # Stopped early or failed: the replicas are still busy with this run
+                self.close(timeout=0)
+            self.wall_time += time.perf_counter() - start_time
+
+    def summary(self) -> dict:
+        """
+        Throughput of the runs so far and the drawings each replica made, with
+        the stage timings, cache and generation statistics of all replicas
+        combined, and the `PipelinedRunner` summary of every replica.
+        `startup_time` is the time the replicas took to build their extractors.
+        """
+        summaries = [summary for summary in self.replica_summaries if summary is not None]
+        merged = _merge_summaries(summaries)
+        return {
+            "replicas": len(self.devices),
+            "num_images": self.num_images,
+            "wall_time": self.wall_time,
+            "startup_time": self.startup_time,
+            "images_per_second": (
+                self.num_images / self.wall_time if self.wall_time > 0 else 0.0
+            ),
+            "images_per_replica": list(self.images_per_replica),
+            "stage_timings": merged["stage_timings"],
+            "result_cache": merged["result_cache"],
+            "embedding_cache": merged["embedding_cache"],
+            "generation": merged["generation"],
+            "replica_summaries": list(self.replica_summaries),
+        }
+
+    def report(self) -> str:
+        summary = self.summary()
+        max_new_tokens = self.runner_kwargs.get("max_new_tokens", 512)
+        lines = [
+            f"Replicas: {summary['replicas']} "
+            f"(started in {summary['startup_time']:.2f} seconds)",
+            PipelinedRunner.format_report(summary, max_new_tokens),
+        ]
+        for replica, (device, images) in enumerate(
+            zip(self.devices, summary["images_per_replica"])
+        ):
+            lines.append(f"  replica {replica} ({device}): {images} images")
+        return "\n".join(lines)
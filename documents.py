@@ -0,0 +1,174 @@
+import functools
+import os
+import threading
+from typing import Iterable, Iterator, Optional
+
+from PIL import Image
+
+from image_loader import DocumentPage, ImageSource, hash_image, load_image
+
+PDF_EXTENSIONS = (".pdf",)
+TIFF_EXTENSIONS = (".tif", ".tiff")
+
+# pdfium is not thread safe, and the loader threads render pages concurrently
+_PDFIUM_LOCK = threading.Lock()
+
+
+class _Document:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._content_hash: Optional[str] = None
+
+    def _open_args(self) -> tuple:
+        return ()
+
+    def __reduce__(self):
+        # Pickled as its path, for worker processes: each of them rebuilds a
+        # document once for all the pages it is sent, and hashes it once
+        return _reopen, (type(self), self.path, *self._open_args())
+
+    def content_hash(self) -> str:
+        """
+        Hash of the file, computed once for all its pages.
+        """
+        with self._lock:
+            if self._content_hash is None:
+                self._content_hash = hash_image(self.path)
+            return self._content_hash
+
+    def pages(self) -> Iterator[DocumentPage]:
+        raise NotImplementedError
+
+    def render_page(
+        self, index: int, target_size: Optional[tuple[int, int]] = None
+    ) -> Image.Image:
+        raise NotImplementedError
+
+
+class TiffDocument(_Document):
+    """
+    Multi-frame TIFF. Listing the pages reads the frame headers only; each page is
+    decoded when rendered, reduced by an integer factor towards the target size.
+    """
+
+    def pages(self) -> Iterator[DocumentPage]:
+        with Image.open(self.path) as img:
+            for index in range(getattr(img, "n_frames", 1)):
+                img.seek(index)
+                yield DocumentPage(self, index, img.size)
+
+    def render_page(
+        self, index: int, target_size: Optional[tuple[int, int]] = None
+    ) -> Image.Image:
+        # A handle per render, so that pages can be rendered from several threads
+        with Image.open(self.path) as img:
+            img.seek(index)
+            return load_image(img, target_size=target_size)
+
+
+class PdfDocument(_Document):
+    """
+    PDF rendered with pdfium (`pip install pypdfium2`). Pages have no pixel size
+    of their own: their native size is taken at `dpi`, and each page is
+    rasterised straight at its target size rather than at `dpi` and resized.
+    The file is opened only while its pages are listed or one is rendered, so
+    that documents waiting in a queue hold no file handle or parsed PDF.
+    """
+
+    def __init__(self, path: str, dpi: int = 200) -> None:
+        """
+        :param path: Path to the PDF file.
+        :param dpi: Resolution the native page size is given at.
+        """
+        try:
+            import pypdfium2  # noqa: F401
+        except ImportError as e:
+            raise ImportError(
+                "Reading PDF files requires pypdfium2: pip install pypdfium2"
+            ) from e
+
+        super().__init__(path)
+        self.dpi = dpi
+
+    def _open_args(self) -> tuple:
+        return (self.dpi,)
+
+    def _open(self):
+        import pypdfium2
+
+        return pypdfium2.PdfDocument(self.path)
+
+    def pages(self) -> Iterator[DocumentPage]:
+        with _PDFIUM_LOCK:
+            pdf = self._open()
+            try:
+                sizes = [pdf.get_page_size(index) for index in range(len(pdf))]
+            finally:
+                pdf.close()
+
+        for index, (width, height) in enumerate(sizes):
+            yield DocumentPage(
+                self,
+                index,
+                (round(width * self.dpi / 72), round(height * self.dpi / 72)),
+            )
+
+    def render_page(
+        self, index: int, target_size: Optional[tuple[int, int]] = None
+    ) -> Image.Image:
+        with _PDFIUM_LOCK:
+            pdf = self._open()
+            try:
+                page = pdf[index]
+                try:
+                    width, _ = page.get_size()
+                    scale = (target_size[0] if target_size else width * self.dpi / 72) / width
+                    image = page.render(scale=scale).to_pil()
+                finally:
+                    page.close()
+            finally:
+                pdf.close()
+
+        image = image.convert("RGB")
+        # The raster size is rounded by pdfium and can be a pixel off the target
+        if target_size is not None and image.size != tuple(target_size):
+            image = image.resize(target_size)
+        return image
+
+
+@functools.lru_cache(maxsize=32)
+def _reopen(cls: type, path: str, *args) -> _Document:
+    return cls(path, *args)
+
+
+def is_document(path: str) -> bool:
+    return path.lower().endswith(PDF_EXTENSIONS + TIFF_EXTENSIONS)
+
+
+def open_document(path: str, dpi: int = 200) -> _Document:
+    """
+    :param path: Path to a PDF or TIFF file.
+    :param dpi: Resolution PDF pages are sized at.
+    """
+    if path.lower().endswith(PDF_EXTENSIONS):
+        return PdfDocument(path, dpi=dpi)
+    if path.lower().endswith(TIFF_EXTENSIONS):
+        return TiffDocument(path)
+    raise ValueError(f"Unsupported document type: {os.path.splitext(path)[1]}")
+
+
+def iter_sources(paths: Iterable[str], dpi: int = 200) -> Iterator[ImageSource]:
+    """
+    Expand PDF and TIFF files into their pages, one at a time, and pass every
+    other path through. Pages are not rendered here: `load_prompt` renders each
+    one at its `smart_resize` target, so no page is written to disk.
+    :param paths: Paths to drawings and multi-page documents.
+    :param dpi: Resolution PDF pages are sized at.
+    :return: Iterator of paths and `DocumentPage`s, in input and page order.
+    """
+    for path in paths:
+        if is_document(path):
+            yield from open_document(path, dpi=dpi).pages()
+        else:
+            yield path
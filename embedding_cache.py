@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+import torch
+import transformers
+from transformers.modeling_outputs import BaseModelOutputWithPooling
+
+# transformers 5 returns a model output from the vision tower instead of a tensor
+VISION_TOWER_RETURNS_TENSOR = int(transformers.__version__.split(".")[0]) < 5
+
+
+class VisualEmbeddingCache:
+    """
+    Two-tier cache of vision tower outputs, one tensor of merged visual
+    embeddings per image.
+
+    The memory tier keeps the `max_items` most recently used tensors. The
+    optional disk tier stores every tensor as a `.npy` file that is memory
+    mapped on read.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_items: int = 256) -> None:
+        self.cache_dir = cache_dir
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.max_items = max_items
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, torch.Tensor]" = OrderedDict()
+
+    @staticmethod
+    def make_key(
+        image_hash: str,
+        resized_size: Optional[tuple[int, int]],
+        min_pixels: int,
+        max_pixels: int,
+        model_name: str,
+    ) -> str:
+        """
+        Build the cache key of one image.
+        :param image_hash: Content hash of the drawing, see `image_loader.hash_image`.
+        :param resized_size: Optional (width, height) requested in the prompt.
+        :param min_pixels: Minimum pixel count of the processor.
+        :param max_pixels: Maximum pixel count of the processor.
+        :param model_name: Name or path of the model owning the vision tower.
+        :return: Hex encoded sha256 digest of all the parameters.
+        """
+        payload = json.dumps(
+            [
+                image_hash,
+                list(resized_size) if resized_size else None,
+                min_pixels,
+                max_pixels,
+                model_name,
+            ]
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def _remember(self, key: str, embeds: torch.Tensor) -> None:
+        self._memory[key] = embeds
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[torch.Tensor]:
+        with self._lock:
+            if key in self._memory:
+                self.memory_hits += 1
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+            if self.cache_dir and os.path.exists(self._path(key)):
+                # Copy-on-write mapping: pages are read lazily and never written back
+                array = np.load(self._path(key), mmap_mode="c")
+                embeds = torch.from_numpy(array)
+                # numpy has no bfloat16, such tensors are stored as their int16 bit pattern
+                if embeds.dtype == torch.int16:
+                    embeds = embeds.view(torch.bfloat16)
+                self.disk_hits += 1
+                self._remember(key, embeds)
+                return embeds
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, embeds: torch.Tensor) -> None:
+        embeds = embeds.detach().cpu()
+        with self._lock:
+            self._remember(key, embeds)
+            if not self.cache_dir or os.path.exists(self._path(key)):
+                return
+
+            array = (
+                embeds.view(torch.int16).numpy()
+                if embeds.dtype == torch.bfloat16
+                else embeds.numpy()
+            )
+            # Write then rename, so readers never map a partially written file
+            tmp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, array)
+            os.replace(tmp_path, self._path(key))
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_items": len(self._memory),
+        }
+
+
+class CachedVisionTower:
+    """
+    Routes the vision tower of a Qwen2.5-VL model through a `VisualEmbeddingCache`.
+
+    Before each forward pass the caller sets `keys`, one per image in the batch
+    and in the order the processor emitted them. Cached images are skipped;
+    only the missing ones are encoded, in one call.
+    """
+
+    def __init__(self, visual: torch.nn.Module, cache: VisualEmbeddingCache) -> None:
+        self.visual = visual
+        self.cache = cache
+        self.keys: Optional[list[str]] = None
+
+        self._forward = visual.forward
+        visual.forward = self.forward
+
+    def forward(self, hidden_states: torch.Tensor, grid_thw: torch.Tensor, **kwargs):
+        keys = self.keys
+        if keys is None or len(keys) != len(grid_thw):
+            return self._forward(hidden_states, grid_thw=grid_thw, **kwargs)
+
+        merge_length = self.visual.spatial_merge_size**2
+        patch_counts = grid_thw.prod(-1).tolist()
+        embeds = [self.cache.get(key) for key in keys]
+        missing = [index for index, cached in enumerate(embeds) if cached is None]
+
+        if missing:
+            pixel_chunks = torch.split(hidden_states, patch_counts)
+            outputs = self._forward(
+                torch.cat([pixel_chunks[index] for index in missing]),
+                grid_thw=grid_thw[missing],
+                **kwargs,
+            )
+            merged = outputs if VISION_TOWER_RETURNS_TENSOR else outputs.pooler_output
+            split_sizes = [patch_counts[index] // merge_length for index in missing]
+            for index, computed in zip(missing, torch.split(merged, split_sizes)):
+                embeds[index] = computed
+                self.cache.put(keys[index], computed)
+
+        reference = next(
+            (embeds[index] for index in missing),
+            next(self.visual.parameters()),
+        )
+        merged = torch.cat(
+            [e.to(device=reference.device, dtype=reference.dtype) for e in embeds]
+        )
+        if VISION_TOWER_RETURNS_TENSOR:
+            return merged
+        return BaseModelOutputWithPooling(last_hidden_state=merged, pooler_output=merged)
@@ -0,0 +1,257 @@
+import base64
+import hashlib
+import io
+from typing import Optional, Union
+
+import numpy as np
+from PIL import Image
+
+BUFFER_TYPES = (bytes, bytearray, memoryview)
+
+
+class DocumentPage:
+    """
+    One page of a multi-page document, see `documents.py`. Its size is known
+    without rendering it; the pixels are rendered on demand, directly at the
+    size they are needed at.
+    """
+
+    def __init__(self, document, index: int, size: tuple[int, int]) -> None:
+        """
+        :param document: Document the page belongs to, with `path`,
+            `render_page(index, target_size)` and `content_hash()`.
+        :param index: Zero-based page number.
+        :param size: (width, height) of the page at its native resolution.
+        """
+        self.document = document
+        self.index = index
+        self.size = size
+
+    def __str__(self) -> str:
+        return f"{self.document.path}#page={self.index + 1}"
+
+    def __repr__(self) -> str:
+        return f"DocumentPage({str(self)!r}, size={self.size})"
+
+    @property
+    def width(self) -> int:
+        return self.size[0]
+
+    @property
+    def height(self) -> int:
+        return self.size[1]
+
+    def render(self, target_size: Optional[tuple[int, int]] = None) -> Image.Image:
+        """
+        :param target_size: Optional (width, height) the page is rendered at.
+        :return: RGB image of the page, at its native size without `target_size`.
+        """
+        return self.document.render_page(self.index, target_size)
+
+    def content_hash(self) -> str:
+        return f"{self.document.content_hash()}:{self.index}"
+
+
+ImageSource = Union[str, bytes, bytearray, memoryview, np.ndarray, Image.Image, DocumentPage]
+
+
+class _BufferReader(io.RawIOBase):
+    """
+    Read-only file over an in-memory buffer, so that `Image.open` parses a
+    `bytearray` or `memoryview` in place rather than from a copy in a `BytesIO`.
+    """
+
+    def __init__(self, buffer: Union[bytearray, memoryview]) -> None:
+        self._view = memoryview(buffer).cast("B")
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        size = max(0, min(len(b), len(self._view) - self._position))
+        b[:size] = self._view[self._position : self._position + size]
+        self._position += size
+        return size
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        if offset < 0:
+            raise ValueError(f"negative seek position {offset}")
+        self._position = offset
+        return offset
+
+    def tell(self) -> int:
+        return self._position
+
+
+def _array_image(array: np.ndarray) -> Image.Image:
+    """
+    Wrap a uint8 array of shape (H, W), (H, W, 1), (H, W, 3) or (H, W, 4).
+    Grayscale and RGBA arrays are shared with the image; RGB arrays are copied
+    once, as Pillow stores RGB pixels padded to 4 bytes.
+    """
+    if array.dtype != np.uint8:
+        raise ValueError(f"Image arrays must be uint8, got {array.dtype}")
+    if array.ndim == 3 and array.shape[2] == 1:
+        array = array[:, :, 0]
+    if array.ndim not in (2, 3) or (array.ndim == 3 and array.shape[2] not in (3, 4)):
+        raise ValueError(
+            f"Image arrays must have shape (H, W), (H, W, 3) or (H, W, 4), got {array.shape}"
+        )
+    return Image.fromarray(array)
+
+
+def open_image(source: ImageSource) -> Image.Image:
+    """
+    Open an image lazily. Only the header is read; pixels are decoded on first access.
+    :param source: Local path, `file://` URI, base64 data URI, encoded image
+        bytes, `bytearray` or `memoryview`, uint8 `np.ndarray`, `PIL.Image` or
+        `DocumentPage`. Buffers are read in place and arrays are wrapped, not
+        copied (except RGB arrays). A page is rendered at its native size.
+    :return: The opened image.
+    """
+    if isinstance(source, Image.Image):
+        return source
+    if isinstance(source, DocumentPage):
+        return source.render()
+    if isinstance(source, np.ndarray):
+        return _array_image(source)
+    if isinstance(source, bytes):
+        # A BytesIO shares the bytes object it is created from until written to
+        return Image.open(io.BytesIO(source))
+    if isinstance(source, (bytearray, memoryview)):
+        return Image.open(_BufferReader(source))
+    if not isinstance(source, str):
+        raise ValueError(
+            "Unrecognized image input, support local path, base64, bytes, "
+            f"np.ndarray and PIL.Image, got {type(source)}"
+        )
+
+    if source.startswith("file://"):
+        return Image.open(source[7:])
+    if source.startswith("data:image"):
+        if "base64," not in source:
+            raise ValueError("Only base64 encoded data URIs are supported")
+        _, base64_data = source.split("base64,", 1)
+        return Image.open(io.BytesIO(base64.b64decode(base64_data)))
+    return Image.open(source)
+
+
+def read_image_size(source: ImageSource) -> tuple[int, int]:
+    """
+    Read the size of an image from its header, without decoding the pixels.
+    :param source: Any source `open_image` takes.
+    :return: Tuple containing width and height of the image.
+    """
+    if isinstance(source, (Image.Image, DocumentPage)):
+        return source.size
+    if isinstance(source, np.ndarray):
+        height, width = source.shape[:2]
+        return width, height
+
+    with open_image(source) as img:
+        return img.size
+
+
+def _decode_rgb(img: Image.Image, owned: bool) -> Image.Image:
+    """
+    Decode `img` as RGB. An owned image is closed once converted; one that is
+    RGB already is returned itself.
+    """
+    if img.mode == "RGB":
+        # Single-frame files release their handle once the pixels are loaded
+        img.load()
+        return img
+    if not owned:
+        return img.convert("RGB")
+    with img:
+        return img.convert("RGB")
+
+
+def load_image(
+    source: ImageSource,
+    target_size: Optional[tuple[int, int]] = None,
+    owned: Optional[bool] = None,
+) -> Image.Image:
+    """
+    Read and decode an image exactly once.
+
+    When `target_size` is given the image is decoded as close to that size as the
+    codec allows: JPEG files are decoded at 1/2, 1/4 or 1/8 scale by libjpeg, other
+    formats are reduced by an integer factor before the final resize. Document
+    pages are rendered at `target_size` directly.
+    :param source: Any source `open_image` takes.
+    :param target_size: Optional (width, height) the image is resized to.
+    :param owned: Whether the image is the loader's own, to decode in place and
+        close: True for an image `open_image` returned to the caller, which is
+        not used afterwards. By default, every source but a `PIL.Image`.
+    :return: Decoded RGB image. Without `target_size` it keeps the original size.
+    """
+    if isinstance(source, DocumentPage):
+        return source.render(target_size)
+    if owned is None:
+        owned = not isinstance(source, Image.Image)
+    img = open_image(source)
+    if target_size is None:
+        return _decode_rgb(img, owned)
+
+    target_width, target_height = target_size
+    # Drafting changes the image in place, so a caller's image is decoded in full
+    if owned and img.format == "JPEG":
+        # Never scales below the requested size, so only the final resize loses detail
+        img.draft("RGB", (target_width, target_height))
+    image = _decode_rgb(img, owned)
+
+    resized = image
+    factor = min(image.width // target_width, image.height // target_height)
+    if factor >= 2:
+        resized = resized.reduce(factor)
+    if resized.size != (target_width, target_height):
+        resized = resized.resize((target_width, target_height))
+    # The full-size decode is not returned: release its pixels, and the file
+    # handle multi-frame files keep, unless it is the caller's image
+    if resized is not image and (owned or image is not img):
+        image.close()
+    return resized
+
+
+def hash_image(source: ImageSource) -> str:
+    """
+    Content hash of an image. Files are hashed byte for byte without decoding;
+    in-memory images are hashed over their mode, size and pixels, and document
+    pages over the hash of their file and their page number. Encoded buffers
+    and base64 data URIs are hashed like the file they came from, and arrays
+    over their shape and pixels, buffers and arrays in place.
+    :param source: Any source `open_image` takes.
+    :return: Hex encoded sha256 digest.
+    """
+    digest = hashlib.sha256()
+    if isinstance(source, BUFFER_TYPES):
+        digest.update(source)
+    elif isinstance(source, np.ndarray):
+        digest.update(f"{source.dtype}:{source.shape}:".encode())
+        digest.update(np.ascontiguousarray(source).data)
+    elif isinstance(source, DocumentPage):
+        digest.update(source.content_hash().encode())
+    elif isinstance(source, Image.Image):
+        digest.update(f"{source.mode}:{source.width}x{source.height}:".encode())
+        digest.update(source.tobytes())
+    elif source.startswith("data:image"):
+        # Hashed like the file it encodes
+        if "base64," not in source:
+            raise ValueError("Only base64 encoded data URIs are supported")
+        _, base64_data = source.split("base64,", 1)
+        digest.update(base64.b64decode(base64_data))
+    else:
+        path = source[7:] if source.startswith("file://") else source
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
@@ -1,9 +1,7 @@
-from transformers import Qwen2_5_VLForConditionalGeneration, AutoProcessor
-from qwen_vl_utils import process_vision_info
 import torch
-from prompt_generator import Prompt
-from model import TechnicalDrawingExtractor
-import time
+from data_parallel import DataParallelRunner
+from documents import iter_sources
+from result_writer import JSONLResultWriter
 import glob
 from tqdm import tqdm
 
@@ -12,43 +10,50 @@ if __name__ == "__main__":
     model_name = "Qwen/Qwen2.5-VL-3B-Instruct-AWQ"
     dtype = torch.float16
     attn_implementation = "flash_attention_2"
-    device_map = "cuda:1"
+    # One extractor replica per device, e.g. ["cuda:0", "cuda:1"]
+    devices = ["cuda:1"]
     min_pixels = 512 * 28 * 28
     max_pixels = 1536 * 28 * 28
     use_fast = True
+    batch_size = 4
+    prefetch = 8
+    num_workers = 4
 
-    td_extractor = TechnicalDrawingExtractor(
-        model_name=model_name,
-        dtype=dtype,
-        attn_implementation=attn_implementation,
-        device_map=device_map,
-        min_pixels=min_pixels,
-        max_pixels=max_pixels,
-        use_fast=use_fast,
+    output_jsonl_path = "extraction_results_3B_AWQ.jsonl"
+
+    # Reopening the results of a crashed run skips the drawings already written
+    writer = JSONLResultWriter(output_jsonl_path, resume=True)
+    # PDF and TIFF files are streamed page by page, without exploding them to disk.
+    # Counting the pages for the progress bar reads their sizes only
+    def pending_sources():
+        return (source for source in iter_sources(img_dirs) if str(source) not in writer)
+
+    total = sum(1 for _ in pending_sources())
+
+    # Drawings are taken from a shared queue by whichever replica is free
+    runner = DataParallelRunner(
+        devices,
+        extractor_kwargs={
+            "model_name": model_name,
+            "dtype": dtype,
+            "attn_implementation": attn_implementation,
+            "min_pixels": min_pixels,
+            "max_pixels": max_pixels,
+            "use_fast": use_fast,
+        },
+        runner_kwargs={
+            "batch_size": batch_size,
+            "prefetch": prefetch,
+            "num_workers": num_workers,
+        },
     )
 
-    output_txt_path = "extraction_results_3B_AWQ.txt"
-
-    with open(output_txt_path, "w", encoding="utf-8") as f:
-        for img_dir in tqdm(img_dirs):
-            print(f"Image path: {img_dir}")
-            resized_width, resized_height = td_extractor.get_image_dimension(img_dir)
-            print(f"Original image size: {resized_width} x {resized_height}")
-            prompt = Prompt.technical_drawing_extraction_prompt(
-                image_path=img_dir,
-                resized_width=resized_width * 2,
-                resized_height=resized_height * 2,
-            )
-
-            start_time = time.time()
-            response = td_extractor.run(prompt)
-            end_time = time.time()
-
-            print(f"Raw_response: {response}\n")
-            print(f"Time taken: {end_time - start_time:.2f} seconds\n")
-
-            # Save to txt file
-            f.write(f"Image path: {img_dir}\n")
-            f.write(f"Response:\n{response}\n")
-            f.write(f"Time taken: {end_time - start_time:.2f} seconds\n")
-            f.write("=" * 80 + "\n")
+    with writer, runner:
+        for record in tqdm(runner.run_records(pending_sources()), total=total):
+            print(f"Image path: {record['image_path']}")
+            print(f"Raw_response: {record['response']}\n")
+            print(f"Time taken: {record['timings']['generate']:.2f} seconds\n")
+
+            writer.write(record)
+
+    print(runner.report())
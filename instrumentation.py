@@ -0,0 +1,187 @@
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+import torch
+from transformers import StoppingCriteria
+
+Hook = Callable[[dict], None]
+
+
+@contextmanager
+def span(metrics: Optional[dict], name: str):
+    """
+    Add the time spent in the block to `metrics["spans"][name]`. Does nothing
+    when `metrics` is None, which is the case when instrumentation is off.
+    """
+    if metrics is None:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(metrics, name, time.perf_counter() - start_time)
+
+
+def add_time(metrics: Optional[dict], name: str, seconds: float) -> None:
+    if metrics is not None:
+        metrics["spans"][name] = metrics["spans"].get(name, 0.0) + seconds
+
+
+class FirstTokenTimer(StoppingCriteria):
+    """
+    Never stops generation; records when the first token was produced, which
+    separates the prefill from the decode steps of a `generate` call.
+    """
+
+    def __init__(self) -> None:
+        self.first_token_time: Optional[float] = None
+
+    def __call__(
+        self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs
+    ) -> torch.BoolTensor:
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+
+def _peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Instrumentation:
+    """
+    Opt-in metrics of `TechnicalDrawingExtractor.run_batch`.
+
+    Every call produces one record with the time spent per stage, the input
+    and output token counts and image pixel counts of the generated drawings,
+    and peak memory. Records are handed to each hook as soon as the call ends.
+    """
+
+    def __init__(self, hooks: Optional[list[Hook]] = None) -> None:
+        self.hooks = list(hooks or [])
+
+    def add_hook(self, hook: Hook) -> None:
+        self.hooks.append(hook)
+
+    def start(self, model_name: str, drawings: int) -> dict:
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            torch.cuda.reset_peak_memory_stats()
+        return {
+            "timestamp": time.time(),
+            "model": model_name,
+            "drawings": drawings,
+            "cached": 0,
+            "spans": {},
+            "input_tokens": [],
+            "output_tokens": [],
+            "image_pixels": [],
+        }
+
+    def finish(self, metrics: dict) -> None:
+        # ru_maxrss is the peak of the whole process, not of this call
+        metrics["peak_rss_bytes"] = _peak_rss_bytes()
+        metrics["peak_cuda_bytes"] = (
+            torch.cuda.max_memory_allocated()
+            if torch.cuda.is_available() and torch.cuda.is_initialized()
+            else None
+        )
+        for hook in self.hooks:
+            hook(metrics)
+
+
+class JSONLExporter:
+    """
+    Hook appending every record as one JSON line, flushed immediately.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def __call__(self, metrics: dict) -> None:
+        with self._lock:
+            self._file.write(json.dumps(metrics, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class PrometheusExporter:
+    """
+    Hook aggregating records into Prometheus counters.
+
+    `render` returns the text exposition format. With `path` the metrics are
+    also rewritten to that file after each record, for the node exporter
+    textfile collector.
+    """
+
+    PREFIX = "raijin_ocr"
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self.counters: dict[str, float] = defaultdict(float)
+        self.stage_seconds: dict[str, float] = defaultdict(float)
+        self.peak_rss_bytes = 0
+        self.peak_cuda_bytes = 0
+
+    def __call__(self, metrics: dict) -> None:
+        with self._lock:
+            self.counters["calls"] += 1
+            self.counters["drawings"] += metrics["drawings"]
+            self.counters["cached_drawings"] += metrics["cached"]
+            self.counters["input_tokens"] += sum(metrics["input_tokens"])
+            self.counters["output_tokens"] += sum(metrics["output_tokens"])
+            self.counters["image_pixels"] += sum(metrics["image_pixels"])
+            for stage, seconds in metrics["spans"].items():
+                self.stage_seconds[stage] += seconds
+            self.peak_rss_bytes = max(self.peak_rss_bytes, metrics["peak_rss_bytes"])
+            self.peak_cuda_bytes = max(
+                self.peak_cuda_bytes, metrics["peak_cuda_bytes"] or 0
+            )
+            text = self._render()
+        if self.path:
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, self.path)
+
+    def render(self) -> str:
+        with self._lock:
+            return self._render()
+
+    @staticmethod
+    def _format_value(value: float) -> str:
+        # Full precision: rounded counters move in steps and break rate()
+        if float(value).is_integer():
+            return str(int(value))
+        return repr(float(value))
+
+    def _render(self) -> str:
+        lines = []
+        for name, value in self.counters.items():
+            lines.append(f"# TYPE {self.PREFIX}_{name}_total counter")
+            lines.append(f"{self.PREFIX}_{name}_total {self._format_value(value)}")
+        lines.append(f"# TYPE {self.PREFIX}_stage_seconds_total counter")
+        for stage, seconds in self.stage_seconds.items():
+            lines.append(
+                f'{self.PREFIX}_stage_seconds_total{{stage="{stage}"}} '
+                f"{self._format_value(seconds)}"
+            )
+        lines.append(f"# TYPE {self.PREFIX}_peak_rss_bytes gauge")
+        lines.append(f"{self.PREFIX}_peak_rss_bytes {self.peak_rss_bytes}")
+        lines.append(f"# TYPE {self.PREFIX}_peak_cuda_bytes gauge")
+        lines.append(f"{self.PREFIX}_peak_cuda_bytes {self.peak_cuda_bytes}")
+        return "\n".join(lines) + "\n"
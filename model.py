@@ -1,10 +1,14 @@
-from transformers import Qwen2_5_VLForConditionalGeneration, AutoProcessor
-from qwen_vl_utils import process_vision_info
 import torch
-from PIL import Image
-import numpy as np
-from typing import Union
+from typing import Optional
+from backends import HFBackend, InferenceBackend
+from batch_scheduler import fixed_batches, pack_batches, padding_stats
+from embedding_cache import VisualEmbeddingCache
+from image_loader import ImageSource, hash_image, read_image_size
+from instrumentation import Instrumentation, span
 from post_processing import OCRPostProcessor
+from result_cache import ResultCache
+from stopping import FieldTracker, TokenBudget
+from test_process_vision_info_image import IMAGE_FACTOR, MAX_PIXELS, MIN_PIXELS, smart_resize
 
 
 class TechnicalDrawingExtractor:
@@ -17,70 +21,404 @@ class TechnicalDrawingExtractor:
         min_pixels: int = 512 * 28 * 28,
         max_pixels: int = 1536 * 28 * 28,
         use_fast: bool = True,
+        cache_dir: Optional[str] = None,
+        cache_max_bytes: int = 1024**3,
+        embedding_cache: bool = False,
+        embedding_cache_dir: Optional[str] = None,
+        embedding_cache_size: int = 256,
+        reuse_prefix_cache: bool = False,
+        constrained_decoding: bool = False,
+        stop_on_fields: bool = False,
+        batch_image_processor: bool = False,
+        adaptive_max_new_tokens: bool = False,
+        token_budget_path: Optional[str] = None,
+        backend: Optional[InferenceBackend] = None,
+        instrumentation: Optional[Instrumentation] = None,
     ) -> None:
+        """
+        :param reuse_prefix_cache: Reuse the KV cache of the instructions shared by
+            every prompt. Drawings are then generated one at a time with greedy
+            decoding, giving up the parallelism of a batch and the sampling
+            settings of the generation config, which only pays off when the
+            prefill of the instructions dominates.
+        :param stop_on_fields: Stop generating a drawing as soon as all the fields
+            it asks for are emitted. Off by default: the output then ends after
+            the last field rather than where the model would have stopped.
+        :param backend: Model backend to generate with. Defaults to an `HFBackend`
+            built from the model arguments, which are ignored when a backend is given.
+        :param instrumentation: Collects per-stage metrics of every `run_batch` call
+            and passes them to its hooks. Off by default.
+        """
+        if backend is None:
+            backend = HFBackend(
+                model_name=model_name,
+                dtype=dtype,
+                attn_implementation=attn_implementation,
+                device_map=device_map,
+                min_pixels=min_pixels,
+                max_pixels=max_pixels,
+                use_fast=use_fast,
+                embedding_cache=embedding_cache,
+                embedding_cache_dir=embedding_cache_dir,
+                embedding_cache_size=embedding_cache_size,
+                reuse_prefix_cache=reuse_prefix_cache,
+                constrained_decoding=constrained_decoding,
+                stop_on_fields=stop_on_fields,
+                batch_image_processor=batch_image_processor,
+            )
+        self.backend = backend
+        self.model_name = backend.model_name
+        self.min_pixels = backend.min_pixels
+        self.max_pixels = backend.max_pixels
+        self.embedding_cache = backend.embedding_cache
+        self.prefix_cache = backend.prefix_cache
+
+        self.model_parser = OCRPostProcessor()
 
-        self.model = Qwen2_5_VLForConditionalGeneration.from_pretrained(
-            model_name,
-            torch_dtype=dtype,
-            attn_implementation=attn_implementation,
-            device_map=device_map,
+        self.result_cache = (
+            ResultCache(cache_dir, max_bytes=cache_max_bytes) if cache_dir else None
         )
 
-        self.processor = AutoProcessor.from_pretrained(
-            model_name,
-            min_pixels=min_pixels,
-            max_pixels=max_pixels,
-            use_fast=use_fast,
+        self.token_budget = (
+            TokenBudget(self.model_name, path=token_budget_path)
+            if adaptive_max_new_tokens
+            else None
         )
+        self.reset_generation_stats()
 
-        self.model_parser = OCRPostProcessor()
+        self.instrumentation = instrumentation
 
     @staticmethod
-    def get_image_dimension(image_path: Union[str, np.ndarray]) -> tuple[int, int]:
+    def get_image_dimension(image_path: ImageSource) -> tuple[int, int]:
         """
-        Get the dimensions of the image.
-        :param image_path: Path to the image file or numpy array of the image.
+        Get the dimensions of the image. Only the file header is read.
+        :param image_path: Path to the image file, encoded image bytes, PIL image,
+            document page or numpy array of the image.
         :return: Tuple containing width and height of the image.
         """
-        if isinstance(image_path, str):
-            with Image.open(image_path) as img:
-                width, height = img.size
-        else:
-            height, width = image_path.shape[:2]
+        return read_image_size(image_path)
 
-        return width, height
+    def _generate_texts(
+        self,
+        prompts: list[list[dict]],
+        max_new_tokens: int,
+        metrics: Optional[dict] = None,
+        fields: Optional[list[Optional[list[str]]]] = None,
+    ) -> tuple[list[str], list[int]]:
+        """
+        Generate the raw outputs of one batch.
+        :param fields: Fields each prompt asks for, see `run_batch`.
+        :return: Decoded outputs and the number of tokens generated for each.
+        """
+        inputs = self.backend.prepare(prompts, metrics=metrics)
+        image_keys = (
+            self.embedding_keys(prompts) if self.embedding_cache is not None else None
+        )
+        outputs = self.backend.generate_batch(
+            inputs,
+            max_new_tokens=max_new_tokens,
+            image_keys=image_keys,
+            metrics=metrics,
+            fields=fields,
+        )
+        with span(metrics, "detokenize"):
+            return self.backend.decode(inputs, outputs)
 
-    def run(self, prompt: list[dict], max_new_tokens: int = 512) -> str:
+    def reset_generation_stats(self) -> None:
+        self.generation_totals = {
+            "drawings": 0,
+            "generated_tokens": 0,
+            "max_new_tokens": 0,
+            "retries": 0,
+            "visual_tokens": 0,
+            "padded_visual_tokens": 0,
+        }
 
-        # Step 1: Prepare input for model
-        text = self.processor.apply_chat_template(
-            prompt, tokenize=False, add_generation_prompt=True
+    def generation_stats(self) -> dict:
+        """
+        Generated tokens per drawing, how many of the `max_new_tokens` budget
+        early stopping and the adaptive budget saved, and the share of padded
+        visual tokens of the batches that are real.
+        """
+        totals = dict(self.generation_totals)
+        drawings = totals["drawings"]
+        saved = totals["max_new_tokens"] - totals["generated_tokens"]
+        totals["tokens_per_drawing"] = totals["generated_tokens"] / drawings if drawings else 0.0
+        totals["saved_tokens_per_drawing"] = saved / drawings if drawings else 0.0
+        totals["padding_efficiency"] = (
+            totals["visual_tokens"] / totals["padded_visual_tokens"]
+            if totals["padded_visual_tokens"]
+            else 1.0
         )
+        return totals
+
+    @staticmethod
+    def image_elements(prompt: list[dict]) -> list[dict]:
+        """
+        Image entries of a prompt, in the order the processor consumes them.
+        """
+        return [
+            element
+            for message in prompt
+            for element in message["content"]
+            if element.get("type") == "image" or "image" in element
+        ]
 
-        image_inputs, _ = process_vision_info(prompt)
+    @staticmethod
+    def _image_hash(image_element: dict) -> str:
+        return image_element.get("image_hash") or hash_image(
+            image_element.get("image", image_element.get("image_url"))
+        )
 
-        inputs = self.processor(
-            text=[text],
-            images=image_inputs,
-            videos=None,
-            padding=True,
-            return_tensors="pt",
-        ).to(self.model.device)
+    @staticmethod
+    def _resized_size(image_element: dict) -> Optional[tuple[int, int]]:
+        if "resized_width" in image_element and "resized_height" in image_element:
+            return image_element["resized_width"], image_element["resized_height"]
+        return None
 
-        # Step 2: Generate response
-        generated_ids = self.model.generate(**inputs, max_new_tokens=max_new_tokens)
+    def visual_tokens(self, prompts: list[list[dict]]) -> list[int]:
+        """
+        Visual tokens of every prompt, one per 28x28 patch of its images once
+        resized: `(h / 28) * (w / 28)` summed over the images. Only sizes are
+        computed, from the resized size of the image entries or the file header.
+        """
+        token_counts = []
+        for prompt in prompts:
+            tokens = 0
+            for image_element in self.image_elements(prompt):
+                size = self._resized_size(image_element)
+                if size is not None:
+                    width, height = size
+                    min_pixels, max_pixels = MIN_PIXELS, MAX_PIXELS
+                else:
+                    width, height = read_image_size(
+                        image_element.get("image", image_element.get("image_url"))
+                    )
+                    min_pixels = image_element.get("min_pixels", MIN_PIXELS)
+                    max_pixels = image_element.get("max_pixels", MAX_PIXELS)
+                # Sized by `fetch_image`, then by the processor within its own budget
+                height, width = smart_resize(
+                    height, width, IMAGE_FACTOR, min_pixels=min_pixels, max_pixels=max_pixels
+                )
+                height, width = smart_resize(
+                    height,
+                    width,
+                    IMAGE_FACTOR,
+                    min_pixels=self.min_pixels,
+                    max_pixels=self.max_pixels,
+                )
+                tokens += (height // IMAGE_FACTOR) * (width // IMAGE_FACTOR)
+            token_counts.append(tokens)
+        return token_counts
 
-        generated_ids_trimmed = [
-            out_ids[len(in_ids) :]
-            for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
+    def embedding_keys(self, prompts: list[list[dict]]) -> list[str]:
+        """
+        Visual embedding cache keys of every image in `prompts`, in processor order.
+        """
+        return [
+            VisualEmbeddingCache.make_key(
+                image_hash=self._image_hash(image_element),
+                resized_size=self._resized_size(image_element),
+                min_pixels=self.min_pixels,
+                max_pixels=self.max_pixels,
+                model_name=self.model_name,
+            )
+            for prompt in prompts
+            for image_element in self.image_elements(prompt)
         ]
 
-        output_text = self.processor.batch_decode(
-            generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization=False
+    def cache_key(
+        self,
+        prompt: list[dict],
+        max_new_tokens: int = 512,
+        fields: Optional[list[str]] = None,
+    ) -> str:
+        """
+        Content-addressed key of a prompt for the result cache.
+        :param prompt: Prompt built by `Prompt.technical_drawing_extraction_prompt`.
+        :param max_new_tokens: Generation budget of the run.
+        :param fields: Fields the prompt asks for, see `run_batch`.
+        :return: Cache key combining image content, prompt text, model configuration
+            and the decoding modes of the backend.
+        """
+        image_elements = self.image_elements(prompt)
+        if not image_elements:
+            raise ValueError("Prompt does not contain an image")
+        image_element, *extra_elements = image_elements
+        # Images are kept as placeholders so that the element order is part of the key
+        prompt_text = "\n".join(
+            element["text"] if element.get("type") == "text" else "<image>"
+            for message in prompt
+            for element in message["content"]
+        )
+        return ResultCache.make_key(
+            image_hash=self._image_hash(image_element),
+            prompt_text=prompt_text,
+            model_name=self.model_name,
+            min_pixels=self.min_pixels,
+            max_pixels=self.max_pixels,
+            max_new_tokens=max_new_tokens,
+            resized_size=self._resized_size(image_element),
+            extra_images=[
+                (self._image_hash(element), self._resized_size(element))
+                for element in extra_elements
+            ],
+            fields=fields,
+            decoding={
+                "constrained_decoding": self.backend.constrained_decoding,
+                "stop_on_fields": self.backend.stop_on_fields,
+                # Generation with a reused prefix is greedy
+                "reuse_prefix_cache": self.prefix_cache is not None,
+            },
         )
 
-        if output_text:
-            response = self.model_parser.parse_model_output(output_text[0])
+    def run(self, prompt: list[dict], max_new_tokens: int = 512) -> str:
+        return self.run_batch([prompt], batch_size=1, max_new_tokens=max_new_tokens)[0]
+
+    def run_batch(
+        self,
+        prompts: list[list[dict]],
+        batch_size: int = 8,
+        max_new_tokens: int = 512,
+        return_raw: bool = False,
+        max_batch_tokens: Optional[int] = None,
+        fields: Optional[list[Optional[list[str]]]] = None,
+    ) -> list:
+        """
+        Run extraction on several drawings, generating up to `batch_size` of them per call.
+        Drawings found in the result cache are not generated again. With the adaptive
+        token budget, drawings whose output it cuts off are generated again with the
+        full `max_new_tokens`.
+        :param prompts: List of prompts built by `Prompt.technical_drawing_extraction_prompt`.
+        :param batch_size: Maximum number of prompts collated into one `generate` call.
+        :param max_new_tokens: Maximum number of tokens generated per drawing.
+        :param return_raw: Return (parsed result, raw model output) pairs instead.
+            The raw output of a drawing served from the result cache is None.
+        :param max_batch_tokens: Group drawings of similar visual token count and
+            pack each call within this budget of padded visual tokens, see
+            `batch_scheduler.pack_batches`, instead of taking them in input order.
+        :param fields: Fields each prompt asks for, as passed to
+            `Prompt.technical_drawing_extraction_prompt`, or None for a prompt
+            asking for all of them. Constrained decoding, early stopping and the
+            completeness check of the adaptive budget follow them.
+        :return: Parsed results, in the same order as `prompts`.
+        """
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be positive, got {batch_size}")
+        if fields is not None and len(fields) != len(prompts):
+            raise ValueError(
+                f"fields must have one entry per prompt ({len(prompts)}), got {len(fields)}"
+            )
+
+        metrics = (
+            self.instrumentation.start(self.model_name, len(prompts))
+            if self.instrumentation is not None
+            else None
+        )
+
+        responses = [None] * len(prompts)
+        raw_texts = [None] * len(prompts)
+        keys = [None] * len(prompts)
+        pending = []
+        with span(metrics, "cache_lookup"):
+            for index, prompt in enumerate(prompts):
+                if self.result_cache is not None:
+                    keys[index] = self.cache_key(
+                        prompt,
+                        max_new_tokens=max_new_tokens,
+                        fields=fields[index] if fields is not None else None,
+                    )
+                    cached = self.result_cache.get(keys[index])
+                    if cached is not None:
+                        responses[index] = cached
+                        continue
+                pending.append(index)
+
+        budget = (
+            self.token_budget.budget(max_new_tokens)
+            if self.token_budget is not None
+            else max_new_tokens
+        )
+        pending_prompts = [prompts[index] for index in pending]
+        if max_batch_tokens is not None:
+            token_counts = self.visual_tokens(pending_prompts)
+            batches = pack_batches(token_counts, max_batch_tokens, max_batch_size=batch_size)
         else:
-            response = ""
-        return response
+            batches = fixed_batches(len(pending), batch_size)
+            # Only for the padding statistics, which are left out for drawings
+            # `smart_resize` cannot size, rather than failing the batch over them
+            try:
+                token_counts = self.visual_tokens(pending_prompts)
+            except ValueError:
+                token_counts = None
+        if token_counts is not None:
+            padding = padding_stats(token_counts, batches)
+            self.generation_totals["visual_tokens"] += padding["visual_tokens"]
+            self.generation_totals["padded_visual_tokens"] += padding["padded_visual_tokens"]
+
+        for rows in batches:
+            indices = [pending[row] for row in rows]
+
+            batch = [prompts[index] for index in indices]
+            batch_fields = [fields[index] for index in indices] if fields is not None else None
+            output_text, lengths = self._generate_texts(
+                batch, budget, metrics=metrics, fields=batch_fields
+            )
+
+            # Outputs cut off by the learned budget are generated again with the full one
+            row_fields = batch_fields or [None] * len(batch)
+            truncated = [
+                row
+                for row, (text, length) in enumerate(zip(output_text, lengths))
+                if budget < max_new_tokens
+                and length >= budget
+                and not FieldTracker(row_fields[row]).feed(text)
+            ]
+            spent_tokens = list(lengths)
+            if truncated:
+                # Retries add to the spans, but their inputs were already counted
+                retry_metrics = (
+                    {**metrics, "input_tokens": [], "image_pixels": []}
+                    if metrics is not None
+                    else None
+                )
+                retry_text, retry_lengths = self._generate_texts(
+                    [batch[row] for row in truncated],
+                    max_new_tokens,
+                    retry_metrics,
+                    fields=[row_fields[row] for row in truncated],
+                )
+                for row, text, length in zip(truncated, retry_text, retry_lengths):
+                    output_text[row] = text
+                    lengths[row] = length
+                    spent_tokens[row] += length
+
+            self.generation_totals["drawings"] += len(batch)
+            self.generation_totals["generated_tokens"] += sum(spent_tokens)
+            self.generation_totals["max_new_tokens"] += max_new_tokens * len(batch)
+            self.generation_totals["retries"] += len(truncated)
+            # Outputs asking for a subset of the fields, such as a zoom pass, are
+            # shorter and would pull the budget of full extractions down
+            full_lengths = [
+                length for row, length in enumerate(lengths) if row_fields[row] is None
+            ]
+            if self.token_budget is not None and full_lengths:
+                self.token_budget.observe(full_lengths)
+                self.token_budget.save()
+
+            if metrics is not None:
+                metrics["output_tokens"].extend(spent_tokens)
+
+            for index, text in zip(indices, output_text):
+                raw_texts[index] = text
+                with span(metrics, "parse"):
+                    responses[index] = self.model_parser.parse_model_output(text)
+                if keys[index] is not None:
+                    self.result_cache.put(keys[index], responses[index])
+
+        if metrics is not None:
+            metrics["cached"] = len(prompts) - len(pending)
+            self.instrumentation.finish(metrics)
+        if return_raw:
+            return list(zip(responses, raw_texts))
+        return responses
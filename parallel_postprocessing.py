@@ -0,0 +1,218 @@
+import argparse
+import io
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+from post_processing import OCRPostProcessor
+
+SEPARATOR = OCRPostProcessor.BLOCK_SEPARATOR.encode("utf-8")
+
+# One post-processor per worker process, created by `_init_worker`
+_processor: Optional[OCRPostProcessor] = None
+
+
+def _init_worker() -> None:
+    global _processor
+    _processor = OCRPostProcessor()
+
+
+def _log_boundary(f: BinaryIO, offset: int, size: int) -> int:
+    """
+    First offset at or after `offset` where a log can be cut between two blocks.
+
+    `str.split` matches the separator left to right, so in a run of more than
+    80 "=" the matches start at the beginning of the run. The cut is placed
+    after the last whole match of the run, where splitting the log globally
+    would also cut it.
+    """
+    window = 1 << 16
+    while offset < size:
+        f.seek(offset)
+        data = f.read(window + len(SEPARATOR))
+        found = data.find(SEPARATOR)
+        if found < 0:
+            offset += window
+            continue
+        start = offset + found
+        # Back up to the beginning of the run of "="
+        while start > 0:
+            f.seek(start - 1)
+            if f.read(1) != b"=":
+                break
+            start -= 1
+        end = offset + found + len(SEPARATOR)
+        f.seek(end)
+        while f.read(1) == b"=":
+            end += 1
+        return start + (end - start) // len(SEPARATOR) * len(SEPARATOR)
+    return size
+
+
+def _jsonl_boundary(f: BinaryIO, offset: int, size: int) -> int:
+    """
+    First offset at or after `offset` where a line starts.
+    """
+    if offset == 0:
+        return 0
+    f.seek(offset - 1)
+    f.readline()
+    return min(f.tell(), size)
+
+
+def iter_ranges(path: str, input_format: str, chunk_bytes: int) -> Iterator[Tuple[int, int]]:
+    """
+    Split the input into byte ranges of about `chunk_bytes` that hold whole
+    blocks or lines. Only the bytes around each cut are read.
+    :return: Iterator of (start, end) offsets covering the whole file.
+    """
+    boundary = _log_boundary if input_format == "log" else _jsonl_boundary
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        start = 0
+        while start < size:
+            end = boundary(f, max(start + chunk_bytes, start + 1), size)
+            yield start, end
+            start = end
+
+
+def _process_range(
+    path: str, input_format: str, start: int, end: int
+) -> Tuple[List[bytes], int]:
+    """
+    Post-process the blocks or lines of one byte range in a worker.
+    :return: (one UTF-8 JSON object per non-empty unit, number of error
+        records). The objects lack their index key and opening brace, so the
+        main process can number them.
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start).decode("utf-8")
+    # Universal newlines, like the text mode reading of `iter_parse`
+    file_obj = io.StringIO(data, newline=None)
+
+    results, errors = [], 0
+    if input_format == "log":
+        units = (
+            _processor._parse_record(0, block) for block in _processor.iter_blocks(file_obj)
+        )
+    else:
+        units = (_reprocess_result(line) for line in file_obj if line.strip())
+    for result in units:
+        result.pop("block", None)
+        errors += "error" in result
+        results.append(json.dumps(result, ensure_ascii=False)[1:].encode("utf-8"))
+    return results, errors
+
+
+def _reprocess_result(line: str) -> dict:
+    """
+    Re-parse the raw model output of one `JSONLResultWriter` record.
+    """
+    image_path = None
+    try:
+        result = json.loads(line)
+        image_path = result.get("image_path")
+        raw_text = result.get("raw_text")
+        if raw_text is None:
+            # Served from the result cache: there is no model output to re-parse
+            raise ValueError("record has no raw_text")
+        return {
+            "image_path": image_path,
+            "record": _processor.convert_to_output_format(
+                _processor._parse_block(raw_text)
+            ),
+        }
+    except Exception as e:
+        return {"image_path": image_path, "error": f"{type(e).__name__}: {e}"}
+
+
+def reprocess(
+    input_path: str,
+    output_path: str,
+    input_format: Optional[str] = None,
+    workers: Optional[int] = None,
+    chunk_mb: float = 4,
+) -> dict:
+    """
+    Post-process an extraction log or JSONL results file on a process pool.
+
+    The input is cut into byte ranges of whole blocks or lines. Workers read and
+    parse their own ranges with one `OCRPostProcessor` each, so the main process
+    only numbers and writes the results. At most two ranges per worker are in
+    flight, so memory does not grow with the input. The output is written in
+    input order and matches `OCRPostProcessor.iter_parse` for a log.
+    :param input_path: Extraction log or JSONL results file.
+    :param output_path: JSONL output with one line per block or input line:
+        `{"block", "image_path", "record"}` (`"line"` for a JSONL input), or
+        `"error"` in place of `"record"` when the unit cannot be parsed.
+    :param input_format: "log" or "jsonl". Defaults to "jsonl" for a `.jsonl`
+        input and "log" otherwise.
+    :param workers: Worker processes, default one per CPU.
+    :param chunk_mb: Size of the byte range of one task.
+    :return: Counts of units and error records, and the elapsed seconds.
+    """
+    if input_format is None:
+        input_format = "jsonl" if input_path.endswith(".jsonl") else "log"
+    index_key = b"block" if input_format == "log" else b"line"
+    workers = workers or os.cpu_count() or 1
+
+    start_time = time.perf_counter()
+    units, errors = 0, 0
+    pending = deque()
+    ranges = iter_ranges(input_path, input_format, int(chunk_mb * 1024 * 1024))
+    with open(output_path, "wb") as f_out, ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker
+    ) as executor:
+        while True:
+            for start, end in ranges:
+                pending.append(
+                    executor.submit(_process_range, input_path, input_format, start, end)
+                )
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                break
+            results, range_errors = pending.popleft().result()
+            f_out.write(
+                b"".join(
+                    [
+                        b'{"%b": %d, %b\n' % (index_key, units + i, result)
+                        for i, result in enumerate(results)
+                    ]
+                )
+            )
+            units += len(results)
+            errors += range_errors
+
+    return {
+        "units": units,
+        "errors": errors,
+        "workers": workers,
+        "seconds": time.perf_counter() - start_time,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Re-run post-processing over an extraction log or JSONL results file."
+    )
+    parser.add_argument("input", help="extraction log, or .jsonl results of JSONLResultWriter")
+    parser.add_argument("output", help="JSONL output, in input order")
+    parser.add_argument("--format", choices=["log", "jsonl"], help="default: from the extension")
+    parser.add_argument("--workers", type=int, help="worker processes, default one per CPU")
+    parser.add_argument("--chunk-mb", type=float, default=4, help="input megabytes per task")
+    args = parser.parse_args()
+
+    stats = reprocess(args.input, args.output, args.format, args.workers, args.chunk_mb)
+    print(
+        f"{stats['units']} units ({stats['errors']} errors) in {stats['seconds']:.1f} s "
+        f"on {stats['workers']} workers"
+    )
+
+
+if __name__ == "__main__":
+    main()
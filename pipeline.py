@@ -0,0 +1,432 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable, Iterator, Optional
+
+from image_loader import DocumentPage, ImageSource, hash_image, load_image, read_image_size
+from model import TechnicalDrawingExtractor
+from prompt_generator import Prompt
+from test_process_vision_info_image import IMAGE_FACTOR, smart_resize
+from title_block import crop_title_block
+
+
+def target_size(
+    extractor: TechnicalDrawingExtractor,
+    image: ImageSource,
+    upscale: int = 2,
+    max_pixels: Optional[int] = None,
+) -> tuple[int, int]:
+    """
+    Size a drawing is resized to for the model. Only the file header is read.
+    :param max_pixels: Pixel budget, instead of the extractor's `max_pixels`.
+    :return: (resized width, resized height)
+    """
+    width, height = read_image_size(image)
+    resized_height, resized_width = smart_resize(
+        height * upscale,
+        width * upscale,
+        factor=IMAGE_FACTOR,
+        min_pixels=extractor.min_pixels,
+        max_pixels=max_pixels or extractor.max_pixels,
+    )
+    return resized_width, resized_height
+
+
+def load_prompt(
+    extractor: TechnicalDrawingExtractor,
+    image: ImageSource,
+    max_new_tokens: int = 512,
+    upscale: int = 2,
+    max_pixels: Optional[int] = None,
+    fields: Optional[list[str]] = None,
+) -> list[dict]:
+    """
+    Build the prompt for a drawing with its image already decoded and resized.
+    :param extractor: Extractor the prompt is built for.
+    :param image: Path to the image file or decoded `PIL.Image`.
+    :param max_new_tokens: Generation budget, part of the result cache key.
+    :param upscale: Factor applied to the image size before `smart_resize`.
+    :param max_pixels: Resize within this pixel budget instead of the extractor's.
+    :param fields: Only ask for these fields. All of them by default.
+    :return: Prompt whose image entry holds the resized `PIL.Image`.
+    """
+    # Size the target from the header, then decode once at reduced resolution
+    resized_width, resized_height = target_size(extractor, image, upscale, max_pixels)
+    prompt = Prompt.technical_drawing_extraction_prompt(
+        image_path=image,
+        resized_width=resized_width,
+        resized_height=resized_height,
+        text_first=extractor.prefix_cache is not None,
+        fields=fields,
+    )
+    image_element = extractor.image_elements(prompt)[0]
+
+    # Hash the file once; both caches key on it instead of the decoded pixels
+    if extractor.result_cache is not None or extractor.embedding_cache is not None:
+        image_element["image_hash"] = hash_image(image)
+
+    result_cache = extractor.result_cache
+    if result_cache is not None:
+        # Duplicate drawings cost only hashing: skip decoding on a cache hit
+        if extractor.cache_key(prompt, max_new_tokens, fields=fields) in result_cache:
+            return prompt
+
+    # Buffers and arrays were wrapped by the prompt builder already
+    image_element["image"] = load_image(
+        image_element["image"], target_size=(resized_width, resized_height)
+    )
+    return prompt
+
+
+def load_title_block_prompt(
+    extractor: TechnicalDrawingExtractor,
+    image: ImageSource,
+    max_new_tokens: int = 512,
+    upscale: int = 2,
+    overview_max_pixels: Optional[int] = None,
+) -> list[dict]:
+    """
+    Build the prompt for a drawing from a crop of its title block instead of the
+    whole sheet. The crop keeps the scale the whole sheet is resized to by
+    `load_prompt`, so its text is as legible at a fraction of the visual tokens.
+    A drawing without a detectable title block is sent whole.
+    :param extractor: Extractor the prompt is built for.
+    :param image: Path to the image file or decoded `PIL.Image`.
+    :param max_new_tokens: Generation budget, part of the result cache key.
+    :param upscale: Factor applied to the image size before `smart_resize`.
+    :param overview_max_pixels: Also send the whole sheet within this pixel
+        budget, for the fields drawn outside the title block. Floored at the
+        extractor's `min_pixels`. No overview by default.
+    :return: Prompt whose image entries hold the resized `PIL.Image`s.
+    """
+    # The crop needs full resolution pixels, so the drawing is decoded whole
+    decoded = load_image(image)
+    sheet_width, _ = target_size(extractor, decoded, upscale)
+    crop, box = crop_title_block(decoded)
+    scale = sheet_width / decoded.width
+    resized_height, resized_width = smart_resize(
+        max(IMAGE_FACTOR, round(crop.height * scale)),
+        max(IMAGE_FACTOR, round(crop.width * scale)),
+        factor=IMAGE_FACTOR,
+        min_pixels=extractor.min_pixels,
+        max_pixels=extractor.max_pixels,
+    )
+
+    overview = None
+    if overview_max_pixels is not None:
+        overview = load_image(
+            decoded,
+            target_size=target_size(
+                extractor,
+                decoded,
+                upscale,
+                max(overview_max_pixels, extractor.min_pixels),
+            ),
+        )
+
+    prompt = Prompt.technical_drawing_extraction_prompt(
+        image_path=load_image(crop, target_size=(resized_width, resized_height)),
+        resized_width=resized_width,
+        resized_height=resized_height,
+        text_first=extractor.prefix_cache is not None,
+        overview=overview,
+    )
+    if extractor.result_cache is not None or extractor.embedding_cache is not None:
+        # The crop box is part of the key: the same file cropped differently is another image
+        image_hash = hash_image(image)
+        crop_element, *overview_elements = extractor.image_elements(prompt)
+        crop_element["image_hash"] = f"{image_hash}:{box}"
+        for element in overview_elements:
+            element["image_hash"] = image_hash
+    return prompt
+
+
+class PipelinedRunner:
+    """
+    Overlaps image loading with generation.
+
+    A thread pool prefetches, decodes and resizes the next drawings while the
+    current batch is generating. Loaded drawings wait in a queue of `prefetch`,
+    on top of the `window` drawings being collected or generated and one the
+    feeder thread is handing over. At most `prefetch + batch_size + 1` decoded
+    images are thus held in memory at any time, or `2 * prefetch + 1` with
+    `max_batch_tokens`.
+
+    With `max_batch_tokens`, the drawings are handed to the extractor `prefetch`
+    at a time, and it packs them into batches of similar visual token count.
+    Records are still yielded in input order.
+    """
+
+    def __init__(
+        self,
+        extractor: TechnicalDrawingExtractor,
+        batch_size: int = 4,
+        prefetch: int = 8,
+        num_workers: int = 4,
+        max_new_tokens: int = 512,
+        upscale: int = 2,
+        title_block: bool = False,
+        overview_max_pixels: Optional[int] = None,
+        max_batch_tokens: Optional[int] = None,
+    ) -> None:
+        """
+        :param batch_size: Drawings per `generate` call, or the most of them with
+            `max_batch_tokens`.
+        :param title_block: Send a crop of the title block instead of the whole
+            sheet, see `load_title_block_prompt`.
+        :param overview_max_pixels: With `title_block`, also send the whole sheet
+            within this pixel budget.
+        :param max_batch_tokens: Budget of padded visual tokens per `generate`
+            call, see `TechnicalDrawingExtractor.run_batch`.
+        """
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be positive, got {batch_size}")
+        if prefetch < batch_size:
+            raise ValueError(
+                f"prefetch must be at least batch_size ({batch_size}), got {prefetch}"
+            )
+
+        self.extractor = extractor
+        self.batch_size = batch_size
+        self.prefetch = prefetch
+        self.num_workers = num_workers
+        self.max_new_tokens = max_new_tokens
+        self.upscale = upscale
+        self.title_block = title_block
+        self.overview_max_pixels = overview_max_pixels
+        self.max_batch_tokens = max_batch_tokens
+
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def window(self) -> int:
+        """
+        Drawings collected before each call to the extractor.
+        """
+        return self.prefetch if self.max_batch_tokens is not None else self.batch_size
+
+    def reset_stats(self) -> None:
+        self.stage_timings = {"load": 0.0, "queue_wait": 0.0, "generate": 0.0}
+        self.num_images = 0
+        self.wall_time = 0.0
+
+    def _add_timing(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stage_timings[stage] += seconds
+
+    def load(self, image_path: str) -> list[dict]:
+        """
+        Build the prompt for a drawing with its image already decoded and resized.
+        :param image_path: Path to the image file.
+        :return: Prompt whose image entry holds the resized `PIL.Image`.
+        """
+        start_time = time.perf_counter()
+        if self.title_block:
+            prompt = load_title_block_prompt(
+                self.extractor,
+                image_path,
+                max_new_tokens=self.max_new_tokens,
+                upscale=self.upscale,
+                overview_max_pixels=self.overview_max_pixels,
+            )
+        else:
+            prompt = load_prompt(
+                self.extractor,
+                image_path,
+                max_new_tokens=self.max_new_tokens,
+                upscale=self.upscale,
+            )
+        self._add_timing("load", time.perf_counter() - start_time)
+        return prompt
+
+    def _load_timed(self, image_path: str) -> tuple[list[dict], float]:
+        start_time = time.perf_counter()
+        prompt = self.load(image_path)
+        return prompt, time.perf_counter() - start_time
+
+    def _feed(
+        self,
+        image_paths: Iterable[ImageSource],
+        pool: ThreadPoolExecutor,
+        pending: queue.Queue,
+        stop: threading.Event,
+    ) -> None:
+        for image_path in image_paths:
+            future = pool.submit(self._load_timed, image_path)
+            # Blocks while the queue is full, which caps the number of decoded images
+            while not stop.is_set():
+                try:
+                    pending.put((image_path, future), timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if stop.is_set():
+                future.cancel()
+                return
+        pending.put(None)
+
+    def _generate(
+        self, batch: list[tuple[str, list[dict], float]]
+    ) -> Iterator[dict]:
+        start_time = time.perf_counter()
+        results = self.extractor.run_batch(
+            [prompt for _, prompt, _ in batch],
+            batch_size=self.batch_size,
+            max_new_tokens=self.max_new_tokens,
+            return_raw=True,
+            max_batch_tokens=self.max_batch_tokens,
+        )
+        elapsed = time.perf_counter() - start_time
+        self._add_timing("generate", elapsed)
+        self.num_images += len(batch)
+
+        for (image_path, _, load_seconds), (response, raw_text) in zip(batch, results):
+            if isinstance(image_path, DocumentPage):
+                # Recorded as "<file>#page=<n>", so that a run can be resumed
+                image_path = str(image_path)
+            yield {
+                "image_path": image_path,
+                "response": response,
+                "raw_text": raw_text,
+                "timings": {"load": load_seconds, "generate": elapsed / len(batch)},
+            }
+
+    def run(self, image_paths: list[str]) -> Iterator[tuple[str, list, float]]:
+        """
+        Run extraction over `image_paths`.
+        :param image_paths: Paths to the drawings to process.
+        :return: Iterator of (image path, parsed response, per-image generation seconds), in input order.
+        """
+        records = self.run_records(image_paths)
+        try:
+            for record in records:
+                yield record["image_path"], record["response"], record["timings"]["generate"]
+        finally:
+            # Stops the loader threads right away when the caller stops early
+            records.close()
+
+    def run_records(self, image_paths: Iterable[ImageSource]) -> Iterator[dict]:
+        """
+        Run extraction over `image_paths`, yielding one record per drawing.
+        :param image_paths: Paths to the drawings to process, or pages from
+            `documents.iter_sources`. An iterator is consumed only as the
+            loader threads get to each drawing.
+        :return: Iterator of dicts with the image path, parsed response, raw model
+            output and per-image load and generation seconds, in input order.
+        """
+        start_time = time.perf_counter()
+        pending: queue.Queue = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+
+        with ThreadPoolExecutor(max_workers=self.num_workers) as pool:
+            feeder = threading.Thread(
+                target=self._feed,
+                args=(iter(image_paths), pool, pending, stop),
+                daemon=True,
+            )
+            feeder.start()
+
+            # The scheduler needs a window of drawings to pick batches from
+            window = self.window
+            try:
+                batch = []
+                while True:
+                    wait_start = time.perf_counter()
+                    item = pending.get()
+                    if item is None:
+                        self._add_timing("queue_wait", time.perf_counter() - wait_start)
+                        break
+
+                    image_path, future = item
+                    prompt, load_seconds = future.result()
+                    self._add_timing("queue_wait", time.perf_counter() - wait_start)
+
+                    batch.append((image_path, prompt, load_seconds))
+                    if len(batch) == window:
+                        yield from self._generate(batch)
+                        batch = []
+
+                if batch:
+                    yield from self._generate(batch)
+            finally:
+                stop.set()
+                # Drain the queue so a blocked feeder can observe the stop flag
+                while feeder.is_alive():
+                    try:
+                        item = pending.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    if isinstance(item, tuple) and isinstance(item[1], Future):
+                        item[1].cancel()
+                feeder.join()
+                self.wall_time += time.perf_counter() - start_time
+
+    def summary(self) -> dict:
+        """
+        Throughput and accumulated per-stage timings of the runs so far.
+        `load` is summed across workers, so it can exceed the wall time.
+        """
+        return {
+            "num_images": self.num_images,
+            "wall_time": self.wall_time,
+            "images_per_second": (
+                self.num_images / self.wall_time if self.wall_time > 0 else 0.0
+            ),
+            "stage_timings": dict(self.stage_timings),
+            "result_cache": (
+                self.extractor.result_cache.stats()
+                if self.extractor.result_cache is not None
+                else None
+            ),
+            "embedding_cache": (
+                self.extractor.embedding_cache.stats()
+                if self.extractor.embedding_cache is not None
+                else None
+            ),
+            "generation": self.extractor.generation_stats(),
+        }
+
+    def report(self) -> str:
+        return self.format_report(self.summary(), self.max_new_tokens)
+
+    @staticmethod
+    def format_report(summary: dict, max_new_tokens: int) -> str:
+        """
+        Human readable report of a `summary`.
+        """
+        lines = [
+            f"Images processed: {summary['num_images']}",
+            f"Wall time: {summary['wall_time']:.2f} seconds",
+            f"Throughput: {summary['images_per_second']:.2f} images/s",
+        ]
+        for stage, seconds in summary["stage_timings"].items():
+            per_image = seconds / summary["num_images"] if summary["num_images"] else 0.0
+            lines.append(
+                f"  {stage}: {seconds:.2f} seconds total, {per_image:.3f} seconds/image"
+            )
+        generation = summary["generation"]
+        if generation["drawings"]:
+            lines.append(
+                f"Generated tokens: {generation['tokens_per_drawing']:.1f}/drawing, "
+                f"{generation['saved_tokens_per_drawing']:.1f}/drawing saved of the "
+                f"{max_new_tokens} token budget, {generation['retries']} retries"
+            )
+            lines.append(
+                f"Padding efficiency: {generation['padding_efficiency']:.1%} of "
+                f"{generation['padded_visual_tokens']} padded visual tokens"
+            )
+        if summary["embedding_cache"] is not None:
+            cache_stats = summary["embedding_cache"]
+            lines.append(
+                f"Embedding cache: {cache_stats['memory_hits']} memory hits, "
+                f"{cache_stats['disk_hits']} disk hits, {cache_stats['misses']} misses"
+            )
+        if summary["result_cache"] is not None:
+            cache_stats = summary["result_cache"]
+            lines.append(
+                f"Result cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+                f"{cache_stats['evictions']} evictions, {cache_stats['bytes']} bytes"
+            )
+        return "\n".join(lines)
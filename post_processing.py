@@ -1,9 +1,51 @@
+import copy
 import json
 import re
-from typing import Dict, List
+from bisect import bisect_right
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Dict, Iterator, List, Mapping, Optional, TextIO, Tuple
+
+
+@lru_cache(maxsize=None)
+def _tolerance_table(allowed: Tuple[str, ...]) -> Tuple[Tuple[float, ...], Tuple[str, ...]]:
+    """
+    Ascending thresholds of the `±x` tolerance classes and their labels.
+    Entries that are not numeric tolerances are skipped.
+    """
+    numeric_classes = []
+    for item in allowed:
+        if item.startswith("±"):
+            try:
+                numeric_classes.append((float(item[1:]), item))
+            except ValueError:
+                continue
+    numeric_classes.sort()
+    return (
+        tuple(threshold for threshold, _ in numeric_classes),
+        tuple(label for _, label in numeric_classes),
+    )
 
 
 class OCRPostProcessor:
+    # Fields requested by the extraction prompt, in the order the model emits them
+    FIELDS = [
+        "Product name",
+        "Product code",
+        "Material code",
+        "Material type",
+        "Customer",
+        "Heat treatment",
+        "Surface treatment",
+        "Shape of object",
+        "Dimension of object",
+        "Tolerance grade",
+        "Dimensional tolerance",
+        "Polishing",
+        "Painting",
+        "Surface roughness",
+    ]
+
     EXPECTED_VALUES = {
         "Material type": [
             "stainless steel",
@@ -36,6 +78,45 @@ class OCRPostProcessor:
 
     ALLOWED_TOLERANCES = ["±0.001", "±0.01", "±0.1"]
 
+    # Output entries filled from each field, and the value the first of them holds
+    # when the field is missing. None where that value is also a valid answer
+    # ("others", "NO"), so that only the raw output tells the field is missing.
+    OUTPUT_FIELDS = {
+        "Product name": ([("ocr_product_name",)], ""),
+        "Product code": ([("ocr_product_code",), ("ocr_drawing_number",)], ""),
+        "Material code": ([("material_type", "material_code")], ""),
+        "Material type": ([("material_type", "material_type")], ""),
+        "Customer": ([("ocr_drawing_issuer",)], ""),
+        "Heat treatment": ([("heat_treatment",)], {"instruction": "NO", "content": ""}),
+        "Surface treatment": (
+            [("surface_treatment",)],
+            {"instruction": "NO", "content": ""},
+        ),
+        "Shape of object": ([("product_shape", "shape")], None),
+        "Dimension of object": ([("product_shape", "dimension")], "0x0x0"),
+        "Tolerance grade": ([("required_precision", "tolerance_grade")], ""),
+        "Dimensional tolerance": (
+            [("required_precision", "dimensional_tolerance")],
+            "NO_SELECTION",
+        ),
+        "Polishing": ([("polishing",)], None),
+        "Painting": ([("painting",)], None),
+        "Surface roughness": ([("surface_roughness",)], ""),
+    }
+
+    # Blocks of a concatenated extraction log are separated by this line
+    BLOCK_SEPARATOR = "=" * 80
+    JSON_BLOCK = re.compile(r"```json\s*(\{.*?\})\s*```", re.DOTALL)
+    IMAGE_PATH_LINE = re.compile(r"^Image path:[ \t]*(.*?)\s*$", re.MULTILINE)
+
+    # Tables of the field rules, built once. `strip_wrappers` removes the
+    # wrapper characters from the start and the end of a value, and
+    # `convert_phi_to_box` deletes brackets anywhere in it
+    OPENING_WRAPPERS = "[({\"'"
+    CLOSING_WRAPPERS = "])}\"'"
+    BRACKETS = str.maketrans("", "", "[]{}()")
+    WHITESPACE = re.compile(r"\s+")
+
     DISALLOWED_VALUES = {
         "none",
         "none of the above",
@@ -56,11 +137,25 @@ class OCRPostProcessor:
     }
 
     def __init__(self):
-        pass
+        self.compile_rules()
+
+    def compile_rules(self) -> None:
+        """
+        Build the lookup tables of the field rules from `EXPECTED_VALUES` and
+        `DISALLOWED_VALUES`. Call again after changing either on an instance.
+        """
+        self._disallowed = frozenset(self.DISALLOWED_VALUES)
+        self._expected: Dict[str, Mapping[str, str]] = {}
+        for key, values in self.EXPECTED_VALUES.items():
+            lookup = {}
+            for expected in values:
+                # The first spelling wins, like the linear scan it replaces
+                lookup.setdefault(expected.lower(), expected)
+            self._expected[key] = MappingProxyType(lookup)
 
     def strip_wrappers(self, val: str) -> str:
         try:
-            return re.sub(r"^[\[\(\{\"\']+|[\]\)\}\"\']+$", "", val.strip())
+            return val.strip().lstrip(self.OPENING_WRAPPERS).rstrip(self.CLOSING_WRAPPERS)
         except Exception:
             return ""
 
@@ -73,14 +168,12 @@ class OCRPostProcessor:
             val_lower = val.lower()
             key_lower = key.lower() if key else ""
 
-            if val_lower == key_lower or val_lower in self.DISALLOWED_VALUES:
+            if val_lower == key_lower or val_lower in self._disallowed:
                 return ""
 
-            if key in self.EXPECTED_VALUES:
-                for expected in self.EXPECTED_VALUES[key]:
-                    if val_lower == expected.lower():
-                        return expected
-                return ""
+            expected = self._expected.get(key)
+            if expected is not None:
+                return expected.get(val_lower, "")
             return val
         except Exception:
             return ""
@@ -108,7 +201,7 @@ class OCRPostProcessor:
 
             # Normalise input
             value = value.replace(",", " ")
-            parts = re.split(r"\s+", value.strip().lower())
+            parts = OCRPostProcessor.WHITESPACE.split(value.strip().lower())
 
             numeric_tolerances = []
             for part in parts:
@@ -152,29 +245,16 @@ class OCRPostProcessor:
                 except ValueError:
                     return default_value
 
-                # Normalize allowed tolerances
-                numeric_classes = []
-                for item in allowed:
-                    if item.startswith("±"):
-                        try:
-                            numeric_classes.append((float(item[1:]), item))
-                        except ValueError:
-                            continue
-
-                if not numeric_classes:
+                thresholds, labels = _tolerance_table(tuple(allowed))
+                if not thresholds:
                     return default_value
 
-                # Sort ascending
-                numeric_classes.sort()
-
-                # Reject if value is smaller than the smallest category
-                if value < numeric_classes[0][0]:
+                # Reject if value is smaller than the smallest category (or NaN)
+                if not value >= thresholds[0]:
                     return default_value
 
                 # Return the closest lower or equal threshold
-                for threshold, label in reversed(numeric_classes):
-                    if value >= threshold:
-                        return label
+                return labels[bisect_right(thresholds, value) - 1]
 
             return default_value
         except Exception:
@@ -209,7 +289,7 @@ class OCRPostProcessor:
                 return default_value
 
             value = value.replace("×", "x").replace(" ", "").strip()
-            value = re.sub(r"[\[\]{}()]", "", value)
+            value = value.translate(self.BRACKETS)
 
             if value.startswith("⌀"):
                 parts = value[1:].split("x")
@@ -357,29 +437,101 @@ class OCRPostProcessor:
                 "painting": "NO",
             }
 
+    @staticmethod
+    def _get_path(response: Dict, path: Tuple[str, ...]):
+        for key in path:
+            response = response[key]
+        return response
+
+    def _field_missing(self, entry: Dict, field: str) -> bool:
+        value = entry.get(field, "")
+        if field == "Dimension of object":
+            return self.clean_dimension(value) == "0x0x0"
+        if field == "Dimensional tolerance":
+            return self.postprocess_dimensional_tolerance_general(value) == "NO_SELECTION"
+        if field in ("Heat treatment", "Surface treatment"):
+            return self.clean_value(value) == ""
+        return self.clean_value(value, field) == ""
+
+    def missing_fields(self, response: Dict, raw_text: Optional[str] = None) -> List[str]:
+        """
+        Fields that came back empty or invalid, in prompt order.
+        :param response: Output of `convert_to_output_format`.
+        :param raw_text: Raw model output the response was parsed from. Without it,
+            fields whose missing value is also a valid answer (the shape and the
+            yes/no flags) cannot be told apart and are never returned.
+        """
+        if raw_text is not None:
+            try:
+                entry = self._parse_block(raw_text)
+            except json.JSONDecodeError:
+                entry = {}
+            return [field for field in self.FIELDS if self._field_missing(entry, field)]
+        return [
+            field
+            for field in self.FIELDS
+            if self.OUTPUT_FIELDS[field][1] is not None
+            and self._get_path(response, self.OUTPUT_FIELDS[field][0][0])
+            == self.OUTPUT_FIELDS[field][1]
+        ]
+
+    def merge_fields(
+        self,
+        response: Dict,
+        update: Dict,
+        fields: List[str],
+        update_raw_text: Optional[str] = None,
+    ) -> Dict:
+        """
+        Copy of `response` with the given fields taken from `update`, where
+        `update` found them.
+        :param response: Output of `convert_to_output_format`.
+        :param update: Output of another extraction of the same drawing.
+        :param fields: Fields to take from `update`.
+        :param update_raw_text: Raw model output `update` was parsed from.
+        """
+        merged = copy.deepcopy(response)
+        found = set(fields) - set(self.missing_fields(update, update_raw_text))
+        for field in fields:
+            if field not in found:
+                continue
+            for path in self.OUTPUT_FIELDS[field][0]:
+                target = self._get_path(merged, path[:-1])
+                target[path[-1]] = copy.deepcopy(self._get_path(update, path))
+        return merged
+
+    @staticmethod
+    def _parse_block(block: str) -> Dict:
+        """
+        Raw fields of one output block, from its ```json fence or its `Key: value` lines.
+        :raises json.JSONDecodeError: When the fenced JSON is malformed.
+        """
+        entry = {}
+
+        json_match = OCRPostProcessor.JSON_BLOCK.search(block)
+        if json_match:
+            entry = json.loads(json_match.group(1))
+        else:
+            for line in block.splitlines():
+                if ":" in line:
+                    key, value = line.split(":", 1)
+                    entry[key.strip()] = value.strip()
+        return entry
+
     def parse_model_output(self, text: str):
         outputs = []
         try:
-            blocks = text.split("=" * 80)
+            blocks = text.split(self.BLOCK_SEPARATOR)
 
             for block in blocks:
                 block = block.strip()
                 if not block:
                     continue
 
-                entry = {}
-
-                json_match = re.search(r"```json\s*(\{.*?\})\s*```", block, re.DOTALL)
-                if json_match:
-                    try:
-                        entry = json.loads(json_match.group(1))
-                    except json.JSONDecodeError:
-                        continue
-                else:
-                    for line in block.splitlines():
-                        if ":" in line:
-                            key, value = line.split(":", 1)
-                            entry[key.strip()] = value.strip()
+                try:
+                    entry = self._parse_block(block)
+                except json.JSONDecodeError:
+                    continue
 
                 formatted = self.convert_to_output_format(entry)
                 outputs.append(formatted)
@@ -387,6 +539,57 @@ class OCRPostProcessor:
             pass
         return outputs
 
+    def iter_blocks(self, file_obj: TextIO) -> Iterator[str]:
+        """
+        Split a log of output blocks separated by `BLOCK_SEPARATOR`, one block at a time.
+        :param file_obj: Text file object of the log, read line by line.
+        :return: Iterator of the stripped, non-empty blocks in file order.
+        """
+        lines: List[str] = []
+        for line in file_obj:
+            # The separator may share a line with block content, like in `str.split`
+            *closed, line = line.split(self.BLOCK_SEPARATOR)
+            for tail in closed:
+                lines.append(tail)
+                block = "".join(lines).strip()
+                lines = []
+                if block:
+                    yield block
+            lines.append(line)
+
+        block = "".join(lines).strip()
+        if block:
+            yield block
+
+    def iter_parse(self, file_obj: TextIO) -> Iterator[Dict]:
+        """
+        Parse a log of output blocks separated by `BLOCK_SEPARATOR`, one block at a time.
+        Only the current block is held in memory, so the log can be of any size.
+        :param file_obj: Text file object of the log, read line by line.
+        :return: Iterator of one record per non-empty block, in file order:
+            `{"block", "image_path", "record"}` when the block parses, or
+            `{"block", "image_path", "error"}` when it does not.
+        """
+        for block_index, block in enumerate(self.iter_blocks(file_obj)):
+            yield self._parse_record(block_index, block)
+
+    def _parse_record(self, block_index: int, block: str) -> Dict:
+        image_path_match = self.IMAGE_PATH_LINE.search(block)
+        image_path = image_path_match.group(1) if image_path_match else None
+        try:
+            entry = self._parse_block(block)
+            return {
+                "block": block_index,
+                "image_path": image_path,
+                "record": self.convert_to_output_format(entry),
+            }
+        except Exception as e:
+            return {
+                "block": block_index,
+                "image_path": image_path,
+                "error": f"{type(e).__name__}: {e}",
+            }
+
 
 if __name__ == "__main__":
     raw_output = """
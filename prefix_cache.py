@@ -0,0 +1,98 @@
+import copy
+import inspect
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+class PrefixKVCache:
+    """
+    KV cache of the text shared by every prompt, computed once per distinct prefix.
+
+    The prefix is the token run before the first `<|vision_start|>` of a prompt.
+    It is text only, so its multimodal rope positions are plain `arange` in all
+    three dimensions and its keys/values do not depend on the drawing.
+    """
+
+    def __init__(self, model: torch.nn.Module, max_prefixes: int = 4) -> None:
+        self.model = model
+        self.max_prefixes = max_prefixes
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._caches: "OrderedDict[tuple[int, ...], object]" = OrderedDict()
+
+        parameters = inspect.signature(model.forward).parameters
+        if "logits_to_keep" in parameters:
+            self._last_logits_kwargs = {"logits_to_keep": 1}
+        elif "num_logits_to_keep" in parameters:
+            self._last_logits_kwargs = {"num_logits_to_keep": 1}
+        else:
+            self._last_logits_kwargs = {}
+
+    @staticmethod
+    def text_positions(start: int, length: int, device) -> torch.Tensor:
+        positions = torch.arange(start, start + length, device=device)
+        return positions.view(1, 1, -1).expand(3, 1, -1)
+
+    def _compute(self, prefix_ids: torch.Tensor):
+        with torch.inference_mode():
+            outputs = self.model(
+                input_ids=prefix_ids,
+                position_ids=self.text_positions(0, prefix_ids.shape[1], prefix_ids.device),
+                use_cache=True,
+                **self._last_logits_kwargs,
+            )
+        return outputs.past_key_values
+
+    def get(self, prefix_ids: torch.Tensor):
+        """
+        Fresh copy of the KV cache of `prefix_ids`, safe to extend during generation.
+        :param prefix_ids: Prefix token ids of shape (1, prefix length).
+        :return: Cache object holding the keys/values of the prefix.
+        """
+        key = tuple(prefix_ids[0].tolist())
+        with self._lock:
+            cache = self._caches.get(key)
+            if cache is None:
+                self.misses += 1
+                cache = self._compute(prefix_ids)
+                self._caches[key] = cache
+                while len(self._caches) > self.max_prefixes:
+                    self._caches.popitem(last=False)
+            else:
+                self.hits += 1
+            self._caches.move_to_end(key)
+            return copy.deepcopy(cache)
+
+    def prefill(
+        self,
+        input_ids: torch.Tensor,
+        prefix_length: int,
+        position_ids: torch.Tensor,
+        **model_inputs,
+    ):
+        """
+        Prefill a single prompt, running only the tokens after its cached prefix.
+        :param input_ids: Unpadded prompt token ids of shape (1, length).
+        :param prefix_length: Number of leading tokens shared with other prompts.
+        :param position_ids: Rope positions of the whole prompt, shape (3, 1, length).
+        :param model_inputs: Extra model inputs such as `pixel_values` and `image_grid_thw`.
+        :return: Model outputs with the logits of the last position and the extended cache.
+        """
+        past_key_values = self.get(input_ids[:, :prefix_length])
+        return self.model(
+            input_ids=input_ids[:, prefix_length:],
+            attention_mask=torch.ones_like(input_ids),
+            position_ids=position_ids[..., prefix_length:],
+            past_key_values=past_key_values,
+            use_cache=True,
+            **model_inputs,
+            **self._last_logits_kwargs,
+        )
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "prefixes": len(self._caches)}
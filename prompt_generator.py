@@ -1,8 +1,88 @@
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+from image_loader import BUFFER_TYPES, ImageSource, open_image
+
+_INDENT = " " * 36
+
+
 class Prompt(object):
+    # Output line of every field, in the order the model is asked for them
+    FIELD_LINES = {
+        "Product name": "Product name: [value]",
+        "Product code": "Product code: [value]",
+        "Material code": "Material code: [value]",
+        "Material type": "Material type: [value]  # Choose from: stainless steel, iron, aluminum, cast metal, brass, copper",
+        "Customer": "Customer: [value]",
+        "Heat treatment": "Heat treatment: [value]",
+        "Surface treatment": "Surface treatment: [value]",
+        "Shape of object": "Shape of object: [value]  # Choose from: round, angle, plate, or others",
+        "Dimension of object": "Dimension of object: [value]  # Format like: 100x50x25 or ⌀30x150",
+        "Tolerance grade": "Tolerance grade: [value]  # Choose from: Fine grade, Medium grade, Coarse grade, Very coarse grade, or Not exist in the drawing",
+        "Dimensional tolerance": "Dimensional tolerance: [value]  # e.g., ±0.1, ±0.01, ±0.001, general tolerance",
+        "Polishing": "Polishing: [Yes/No]",
+        "Painting": "Painting: [Yes/No]",
+        "Surface roughness": "Surface roughness: [value]  # Choose from: Ra0.4, Ra0.8, Ra1.6, Ra3.2, Ra6.3, Ra12.5, Ra25~, Not exist in the drawing",
+    }
+
+    # Told to the model when the title block and an overview are sent separately
+    OVERVIEW_LINE = (
+        "The first image is the title block of the drawing, the second one the whole sheet at low resolution."
+    )
+
+    @staticmethod
+    def extraction_instructions(
+        fields: Optional[list[str]] = None, overview: bool = False
+    ) -> str:
+        """
+        Instructions of the extraction prompt.
+        :param fields: Only ask for these fields. All of them by default.
+        :param overview: The prompt holds a title block crop and an overview of the sheet.
+        """
+        lines = [
+            Prompt.FIELD_LINES[field]
+            for field in Prompt.FIELD_LINES
+            if fields is None or field in fields
+        ]
+        return (
+            f"""
+{_INDENT}Analyze the provided technical drawing, which may contain text in English and Japanese.
+{_INDENT + Prompt.OVERVIEW_LINE + chr(10) if overview else ""}
+{_INDENT}Your task is to accurately extract the following information from the image.
+{_INDENT}For each field, provide the extracted value exactly as written in the image, without making assumptions. If the field is not present or unclear, leave it blank.
+
+{_INDENT}Return your output in the following key-value format, using one line per field:{_INDENT}
+
+"""
+            + "\n".join(_INDENT + line for line in lines)
+            + "\n                                 "
+        )
+
     @staticmethod
     def technical_drawing_extraction_prompt(
-        image_path: str, resized_width: int = 3840, resized_height: int = 2160
+        image_path: ImageSource,
+        resized_width: int = 3840,
+        resized_height: int = 2160,
+        text_first: bool = False,
+        fields: Optional[list[str]] = None,
+        overview: Optional[Image.Image] = None,
     ):
+        """
+        Build the chat prompt asking the model to extract the drawing fields.
+        :param image_path: Path to the drawing, the already decoded `PIL.Image`, or
+            any other source `image_loader.open_image` takes. Encoded buffers and
+            arrays are wrapped in a `PIL.Image` without decoding or copying them,
+            as the processor only takes paths, URIs and images.
+        :param text_first: Put the instructions before the images, so that every prompt
+            shares the same leading tokens and their KV cache can be reused.
+        :param fields: Only ask for these fields, in prompt order. All of them by default.
+        :param overview: Low resolution image of the whole sheet, sent after
+            `image_path` when that is a crop of its title block. It is sent at its size.
+        """
+        if isinstance(image_path, BUFFER_TYPES + (np.ndarray,)):
+            image_path = open_image(image_path)
 
         prompt = [
             {
@@ -16,35 +96,27 @@ class Prompt(object):
                     },
                     {
                         "type": "text",
-                        "text": (
-                            """
-                                    Analyze the provided technical drawing, which may contain text in English and Japanese.
-
-                                    Your task is to accurately extract the following information from the image.
-                                    For each field, provide the extracted value exactly as written in the image, without making assumptions. If the field is not present or unclear, leave it blank.
-
-                                    Return your output in the following key-value format, using one line per field:                                    
-
-                                    Product name: [value]
-                                    Product code: [value]
-                                    Material code: [value]
-                                    Material type: [value]  # Choose from: stainless steel, iron, aluminum, cast metal, brass, copper
-                                    Customer: [value]
-                                    Heat treatment: [value]
-                                    Surface treatment: [value]
-                                    Shape of object: [value]  # Choose from: round, angle, plate, or others
-                                    Dimension of object: [value]  # Format like: 100x50x25 or ⌀30x150
-                                    Tolerance grade: [value]  # Choose from: Fine grade, Medium grade, Coarse grade, Very coarse grade, or Not exist in the drawing
-                                    Dimensional tolerance: [value]  # e.g., ±0.1, ±0.01, ±0.001, general tolerance
-                                    Polishing: [Yes/No]
-                                    Painting: [Yes/No]
-                                    Surface roughness: [value]  # Choose from: Ra0.4, Ra0.8, Ra1.6, Ra3.2, Ra6.3, Ra12.5, Ra25~, Not exist in the drawing
-                                 """
-                        ),
+                        "text": Prompt.extraction_instructions(fields),
                     },
                 ],
             }
         ]
+        content = prompt[0]["content"]
+        if overview is not None:
+            content.insert(
+                1,
+                {
+                    "type": "image",
+                    "image": overview,
+                    "resized_height": overview.height,
+                    "resized_width": overview.width,
+                },
+            )
+            content[-1]["text"] = Prompt.extraction_instructions(fields, overview=True)
+
+        if text_first:
+            # Images keep their order behind the instructions
+            content.insert(0, content.pop())
 
         return prompt
 
@@ -1,6 +1,29 @@
 import json
 import re
-from typing import Dict, List, Union
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, Tuple, Union
+
+# Tables of the field rules, built once at import
+OPENING_WRAPPERS = "[({\"'"
+CLOSING_WRAPPERS = "])}\"'"
+BRACKETS = str.maketrans("", "", "[]{}()")
+WHITESPACE = re.compile(r"\s+")
+JSON_BLOCK = re.compile(r"```json\s*(\{.*?\})\s*```", re.DOTALL)
+
+
+@lru_cache(maxsize=None)
+def _lowercase_set(values: Tuple[str, ...]) -> FrozenSet[str]:
+    return frozenset(value.lower() for value in values)
+
+
+@lru_cache(maxsize=None)
+def _threshold_table(tolerances: Tuple[str, ...]) -> Tuple[Tuple[float, ...], Tuple[str, ...]]:
+    """
+    Ascending thresholds of the `±x` tolerances and their labels.
+    """
+    thresholds = sorted((float(t[1:]), t) for t in tolerances)
+    return tuple(t for t, _ in thresholds), tuple(label for _, label in thresholds)
 
 
 class BasePostprocessor:
@@ -25,7 +48,7 @@ class BasePostprocessor:
 
     def strip_wrappers(self, val: str) -> str:
         try:
-            return re.sub(r"^[\[\(\{\"\']+|[\]\)\}\"\']+$", "", val.strip())
+            return val.strip().lstrip(OPENING_WRAPPERS).rstrip(CLOSING_WRAPPERS)
         except Exception:
             return ""
 
@@ -45,8 +68,7 @@ class BasePostprocessor:
 
             # If allowed values are defined, check against them (case-insensitive)
             if allowed_values:
-                allowed_set = {a.lower() for a in allowed_values}
-                if val_lower not in allowed_set:
+                if val_lower not in _lowercase_set(tuple(allowed_values)):
                     return ""
 
             return val_cleaned
@@ -98,12 +120,14 @@ class RequiredPrecisionPostprocessor(BasePostprocessor):
             return "NO_SELECTION"
         has_general_tolerance = "general tolerance" in value.lower()
         value = value.replace(",", " ")
-        parts = re.split(r"\s+", value.strip().lower())
-        numeric_tolerances = [
-            (float(p[1:]), p)
-            for p in parts
-            if p.startswith("±") and self._is_float(p[1:])
-        ]
+        parts = WHITESPACE.split(value.strip().lower())
+        numeric_tolerances = []
+        for p in parts:
+            if p.startswith("±"):
+                try:
+                    numeric_tolerances.append((float(p[1:]), p))
+                except ValueError:
+                    continue
         if numeric_tolerances:
             numeric_tolerances.sort()
             return numeric_tolerances[0][1]
@@ -116,21 +140,14 @@ class RequiredPrecisionPostprocessor(BasePostprocessor):
             return value
         try:
             num = float(value[1:])
-            thresholds = sorted((float(t[1:]), t) for t in self.ALLOWED_TOLERANCES)
-            for thresh, label in reversed(thresholds):
-                if num >= thresh:
-                    return label
+            thresholds, labels = _threshold_table(tuple(self.ALLOWED_TOLERANCES))
+            # Below the smallest threshold, or NaN, matches no class
+            if thresholds and num >= thresholds[0]:
+                return labels[bisect_right(thresholds, num) - 1]
         except:
             pass
         return "NO_SELECTION"
 
-    def _is_float(self, val):
-        try:
-            float(val)
-            return True
-        except ValueError:
-            return False
-
     def run(self, entry: Dict) -> Dict:
         grade = self.clean_value(
             val=entry.get(self.TOLERANCE_GRADE_FIELD_NAME), allowed_values=None
@@ -152,7 +169,7 @@ class ProductShapePostprocessor(BasePostprocessor):
     def convert_phi_to_box(self, value: str, default_value: str = "0x0x0") -> str:
         try:
             value = value.replace("×", "x").replace(" ", "").strip()
-            value = re.sub(r"[\[\]{}()]", "", value)
+            value = value.translate(BRACKETS)
 
             if value.startswith("⌀"):
                 parts = value[1:].split("x")
@@ -288,7 +305,7 @@ class MainPostprocessor:
 
     def parse_model_output(self, text: str) -> Dict:
         try:
-            json_match = re.search(r"```json\s*(\{.*?\})\s*```", text, re.DOTALL)
+            json_match = JSON_BLOCK.search(text)
             if json_match:
                 entry = json.loads(json_match.group(1))
             else:
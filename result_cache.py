@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+
+class ResultCache:
+    """
+    On-disk cache of parsed extraction results, backed by SQLite.
+
+    Entries are content addressed (see `make_key`) and evicted least recently
+    used first once the stored results exceed `max_bytes`.
+    """
+
+    FILE_NAME = "results.sqlite3"
+
+    def __init__(self, cache_dir: str, max_bytes: int = 1024**3) -> None:
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, self.FILE_NAME)
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(
+        image_hash: str,
+        prompt_text: str,
+        model_name: str,
+        min_pixels: int,
+        max_pixels: int,
+        max_new_tokens: int,
+        resized_size: Optional[tuple[int, int]] = None,
+        extra_images: Optional[list[tuple[str, Optional[tuple[int, int]]]]] = None,
+        fields: Optional[list[str]] = None,
+        decoding: Optional[dict] = None,
+    ) -> str:
+        """
+        Build the cache key of one extraction.
+        :param image_hash: Content hash of the drawing, see `image_loader.hash_image`.
+        :param prompt_text: Text part of the prompt.
+        :param model_name: Name or path of the model.
+        :param min_pixels: Minimum pixel count of the processor.
+        :param max_pixels: Maximum pixel count of the processor.
+        :param max_new_tokens: Generation budget.
+        :param resized_size: Optional (width, height) requested in the prompt.
+        :param extra_images: (content hash, resized size) of the other images of
+            the prompt, such as the overview sent with a title block crop.
+        :param fields: Fields the prompt asks for, None for all of them.
+        :param decoding: Settings of the backend that change its output, such as
+            constrained decoding and early stopping.
+        :return: Hex encoded sha256 digest of all the parameters.
+        """
+        payload = json.dumps(
+            [
+                image_hash,
+                prompt_text,
+                model_name,
+                min_pixels,
+                max_pixels,
+                max_new_tokens,
+                list(resized_size) if resized_size else None,
+                [
+                    [extra_hash, list(extra_size) if extra_size else None]
+                    for extra_hash, extra_size in extra_images or []
+                ],
+                fields,
+                decoding or {},
+            ],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def __contains__(self, key: str) -> bool:
+        # Membership checks do not count as hits or misses
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM results WHERE key = ?", (key,)
+            ).fetchone()
+        return row is not None
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Any) -> None:
+        serialized = json.dumps(value, ensure_ascii=False)
+        size = len(serialized.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, serialized, size, time.time()),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = self._conn.execute(
+            "SELECT key, size FROM results ORDER BY last_access ASC"
+        ).fetchall()
+        stale = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            stale.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM results WHERE key = ?", stale)
+        self.evictions += len(stale)
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM results"
+            ).fetchone()[0]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "bytes": self.total_bytes(),
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,97 @@
+import json
+import os
+
+
+class JSONLResultWriter:
+    """
+    Streaming writer of extraction results, one JSON record per drawing.
+
+    Every record is flushed as soon as it is written. Its image path and the end
+    offset of the record are then appended to a small checkpoint index next to the
+    results (`<path>.index`). Resuming a run reads only the index. Any bytes past
+    the last indexed record, for example a line half written when the process was
+    killed, are truncated away, so the results and the index always agree.
+    """
+
+    INDEX_SUFFIX = ".index"
+
+    def __init__(self, path: str, resume: bool = True, fsync: bool = False) -> None:
+        """
+        :param path: Path of the JSONL results file.
+        :param resume: Keep the records of a previous run and skip their drawings.
+            Otherwise the results and the index are started from scratch.
+        :param fsync: Also fsync after every record, to survive power loss.
+        """
+        self.path = path
+        self.index_path = path + self.INDEX_SUFFIX
+        self.fsync = fsync
+        self.processed: set[str] = set()
+
+        end_offset = 0
+        if resume and os.path.exists(self.index_path):
+            end_offset = self._read_index()
+            # Truncating a missing or shorter file would pad it with zeros
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if size < end_offset:
+                raise ValueError(
+                    f"{path} holds {size} bytes but its checkpoint index "
+                    f"({self.index_path}) records {end_offset}, refusing to resume"
+                )
+        elif resume and os.path.exists(path) and os.path.getsize(path):
+            raise ValueError(
+                f"{path} has no checkpoint index ({self.index_path}), refusing to resume"
+            )
+
+        mode = "r+b" if resume and os.path.exists(path) else "w+b"
+        self._file = open(path, mode)
+        # Drop anything written after the last checkpoint
+        self._file.truncate(end_offset)
+        self._file.seek(end_offset)
+        self._index = open(self.index_path, "a" if resume else "w", encoding="utf-8")
+
+    def _read_index(self) -> int:
+        end_offset, valid_length = 0, 0
+        with open(self.index_path, "rb") as f:
+            for line in f:
+                # A torn last line: its record is truncated away with it
+                if not line.endswith(b"\n"):
+                    break
+                entry = json.loads(line)
+                self.processed.add(entry["image_path"])
+                end_offset = entry["end"]
+                valid_length += len(line)
+        with open(self.index_path, "rb+") as f:
+            f.truncate(valid_length)
+        return end_offset
+
+    def __contains__(self, image_path: str) -> bool:
+        return image_path in self.processed
+
+    def write(self, record: dict) -> None:
+        """
+        Append the record of one drawing and checkpoint it.
+        :param record: JSON serialisable result with at least an `image_path` key.
+        """
+        self._file.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+        self._index.write(
+            json.dumps({"image_path": record["image_path"], "end": self._file.tell()})
+            + "\n"
+        )
+        self._index.flush()
+        if self.fsync:
+            os.fsync(self._index.fileno())
+        self.processed.add(record["image_path"])
+
+    def close(self) -> None:
+        self._file.close()
+        self._index.close()
+
+    def __enter__(self) -> "JSONLResultWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
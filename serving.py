@@ -0,0 +1,218 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from image_loader import ImageSource
+from model import TechnicalDrawingExtractor
+from pipeline import load_prompt
+
+
+class ExtractionService:
+    """
+    Asynchronous front end of a `TechnicalDrawingExtractor` for concurrent callers.
+
+    Requests are queued and a background scheduler groups them into micro-batches
+    of at most `max_batch_size` drawings. A batch is dispatched as soon as it is
+    full, or `max_wait_ms` after its oldest request arrived. Batches run one at a
+    time on a dedicated inference thread, so the event loop never blocks on the
+    model. At most `max_queue_size` requests are decoded or waiting in the queue;
+    further callers wait for a free slot, within their timeout, before their
+    drawing is decoded.
+
+    Usage::
+
+        async with ExtractionService(extractor) as service:
+            result = await service.extract("drawing.jpg")
+    """
+
+    def __init__(
+        self,
+        extractor: TechnicalDrawingExtractor,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10.0,
+        max_queue_size: int = 64,
+        timeout: Optional[float] = 60.0,
+        max_new_tokens: int = 512,
+        upscale: int = 2,
+    ) -> None:
+        if max_batch_size < 1:
+            raise ValueError(f"max_batch_size must be positive, got {max_batch_size}")
+        if max_queue_size < max_batch_size:
+            raise ValueError(
+                f"max_queue_size must be at least max_batch_size ({max_batch_size}), "
+                f"got {max_queue_size}"
+            )
+
+        self.extractor = extractor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue_size = max_queue_size
+        self.timeout = timeout
+        self.max_new_tokens = max_new_tokens
+        self.upscale = upscale
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._scheduler: Optional[asyncio.Task] = None
+        self._inference = None
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        self.num_requests = 0
+        self.num_batches = 0
+        self.num_timeouts = 0
+        self.batch_sizes: list[int] = []
+
+    async def start(self) -> None:
+        if self._scheduler is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._slots = asyncio.Semaphore(self.max_queue_size)
+        self._inference = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="extraction-inference"
+        )
+        self._scheduler = asyncio.create_task(self._schedule())
+
+    async def stop(self) -> None:
+        if self._scheduler is None:
+            return
+        self._scheduler.cancel()
+        try:
+            await self._scheduler
+        except asyncio.CancelledError:
+            pass
+        # Requests still queued will never run
+        while not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            self._slots.release()
+            if not future.done():
+                future.set_exception(RuntimeError("Extraction service stopped"))
+        # Waits for the running batch without blocking the event loop
+        await asyncio.to_thread(self._inference.shutdown, True)
+        self._scheduler = None
+
+    async def __aenter__(self) -> "ExtractionService":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.stop()
+
+    async def extract(self, image: ImageSource, timeout: Optional[float] = None) -> dict:
+        """
+        Extract the fields of one drawing.
+        :param image: Path to the image file, decoded `PIL.Image`, encoded image
+            bytes or `memoryview` of an upload, or uint8 `np.ndarray`.
+        :param timeout: Seconds to wait for the result, including queueing.
+            Defaults to the timeout of the service; None waits forever.
+        :return: Parsed fields in the output format of `OCRPostProcessor`.
+        """
+        if self._scheduler is None:
+            raise RuntimeError("Extraction service is not started")
+        timeout = self.timeout if timeout is None else timeout
+        self.num_requests += 1
+        try:
+            return await asyncio.wait_for(self._extract(image), timeout)
+        except asyncio.TimeoutError:
+            self.num_timeouts += 1
+            raise
+
+    async def _extract(self, image: ImageSource) -> dict:
+        loop = asyncio.get_running_loop()
+        # Waits while the queue is full, which pushes back on the callers before
+        # their drawing is decoded. The scheduler frees the slot when it takes
+        # the request off the queue
+        await self._slots.acquire()
+        try:
+            # Decoding and resizing run on the default executor, next to the inference thread
+            prompt = await loop.run_in_executor(
+                None, load_prompt, self.extractor, image, self.max_new_tokens, self.upscale
+            )
+            # Stopped while decoding: nothing takes requests off the queue any more
+            if self._scheduler is None or self._scheduler.done():
+                raise RuntimeError("Extraction service stopped")
+            future = loop.create_future()
+            self._queue.put_nowait((prompt, future, time.perf_counter()))
+        except BaseException:
+            self._slots.release()
+            raise
+        response = await future
+        if response:
+            return response[0]
+        return self.extractor.model_parser.convert_to_output_format({})
+
+    async def _next_batch(self) -> list[tuple]:
+        batch = [await self._queue.get()]
+        deadline = batch[0][2] + self.max_wait
+        try:
+            while len(batch) < self.max_batch_size:
+                # Requests that queued up during the previous batch never wait
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+        except asyncio.CancelledError:
+            # Stopped while collecting: the requests taken off the queue so far
+            # are no longer there for `stop` to fail
+            for _, future, _ in batch:
+                self._slots.release()
+                if not future.done():
+                    future.set_exception(RuntimeError("Extraction service stopped"))
+            raise
+        for _ in batch:
+            self._slots.release()
+        # Callers that timed out or were cancelled while queued are dropped
+        return [item for item in batch if not item[1].done()]
+
+    async def _schedule(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            if not batch:
+                continue
+
+            self.num_batches += 1
+            self.batch_sizes.append(len(batch))
+            try:
+                responses = await loop.run_in_executor(
+                    self._inference,
+                    self._run_batch,
+                    [prompt for prompt, _, _ in batch],
+                )
+            except asyncio.CancelledError:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(RuntimeError("Extraction service stopped"))
+                raise
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future, _), response in zip(batch, responses):
+                if not future.done():
+                    future.set_result(response)
+
+    def _run_batch(self, prompts: list[list[dict]]) -> list:
+        return self.extractor.run_batch(
+            prompts, batch_size=len(prompts), max_new_tokens=self.max_new_tokens
+        )
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.num_requests,
+            "batches": self.num_batches,
+            "timeouts": self.num_timeouts,
+            "mean_batch_size": (
+                sum(self.batch_sizes) / len(self.batch_sizes) if self.batch_sizes else 0.0
+            ),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+        }
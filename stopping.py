@@ -0,0 +1,159 @@
+import json
+import math
+import os
+import threading
+from collections import deque
+from typing import Optional
+
+import numpy as np
+import torch
+from transformers import StoppingCriteria
+
+from post_processing import OCRPostProcessor
+
+
+class FieldTracker:
+    """
+    Follows a model output line by line and tells when every field has been emitted.
+
+    Plain `Key: value` outputs are complete once the line of the last missing
+    key ends. Outputs wrapped in a JSON object or a fenced block are complete
+    once the object or the block is closed, so they still parse.
+    """
+
+    def __init__(self, fields: Optional[list[str]] = None) -> None:
+        self.remaining = set(fields if fields is not None else OCRPostProcessor.FIELDS)
+        self.done = False
+        self._line = ""
+        self._closing = None
+
+    def feed(self, text: str) -> bool:
+        """
+        Consume the next chunk of output.
+        :return: Whether the output is complete.
+        """
+        self._line += text
+        while not self.done and "\n" in self._line:
+            line, self._line = self._line.split("\n", 1)
+            self._read_line(line.strip())
+        return self.done
+
+    def _read_line(self, line: str) -> None:
+        if not line:
+            return
+        if self._closing is None:
+            # The first line tells whether the fields are wrapped
+            self._closing = "```" if line.startswith("```") else "}" if line.startswith("{") else ""
+
+        if ":" in line:
+            key = line.split(":", 1)[0].strip().lstrip("-* ").strip("\"'*")
+            self.remaining.discard(key)
+
+        if not self.remaining:
+            self.done = not self._closing or line.startswith(self._closing)
+
+
+class FieldsEmittedCriteria(StoppingCriteria):
+    """
+    Stops each row once all the fields of the extraction prompt are emitted,
+    instead of letting the model ramble up to `max_new_tokens`. A new instance
+    is needed for every `generate` call, as it tracks the output of each row.
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        fields: Optional[list[str]] = None,
+        row_fields: Optional[list[Optional[list[str]]]] = None,
+    ) -> None:
+        """
+        :param fields: Fields of every row. All of them by default.
+        :param row_fields: Fields of each row of the batch, None for a row
+            asking for `fields`.
+        """
+        self.tokenizer = tokenizer
+        self.fields = fields
+        self.row_fields = row_fields
+        self._trackers = None
+        self._seen = None
+
+    def __call__(
+        self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs
+    ) -> torch.BoolTensor:
+        if self._trackers is None:
+            # The first call already has one generated token after the prompt
+            self._trackers = [
+                FieldTracker(fields or self.fields)
+                for fields in (self.row_fields or [None] * input_ids.shape[0])
+            ]
+            self._seen = input_ids.shape[1] - 1
+
+        chunks = self.tokenizer.batch_decode(
+            input_ids[:, self._seen :], skip_special_tokens=True
+        )
+        self._seen = input_ids.shape[1]
+        done = [
+            tracker.done or tracker.feed(chunk)
+            for tracker, chunk in zip(self._trackers, chunks)
+        ]
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+class TokenBudget:
+    """
+    Generation budget learned from the lengths of past outputs of one model.
+
+    Until `min_samples` outputs are observed the full `max_new_tokens` is used.
+    Afterwards the budget is the `quantile` of the last `window` output lengths
+    times `margin`. Lengths are optionally persisted in a JSON file shared by
+    all models, keyed by model name.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        path: Optional[str] = None,
+        quantile: float = 0.99,
+        margin: float = 1.25,
+        min_samples: int = 32,
+        window: int = 1024,
+    ) -> None:
+        self.model_name = model_name
+        self.path = path
+        self.quantile = quantile
+        self.margin = margin
+        self.min_samples = min_samples
+
+        self._lock = threading.Lock()
+        self.lengths: deque = deque(maxlen=window)
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.lengths.extend(json.load(f).get(model_name, []))
+
+    def budget(self, max_new_tokens: int) -> int:
+        """
+        Number of tokens to generate per drawing, never more than `max_new_tokens`.
+        """
+        with self._lock:
+            if len(self.lengths) < self.min_samples:
+                return max_new_tokens
+            learned = np.quantile(np.fromiter(self.lengths, dtype=np.int64), self.quantile)
+        return max(1, min(max_new_tokens, math.ceil(learned * self.margin)))
+
+    def observe(self, lengths: list[int]) -> None:
+        with self._lock:
+            self.lengths.extend(lengths)
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        with self._lock:
+            budgets = {}
+            if os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    budgets = json.load(f)
+            budgets[self.model_name] = list(self.lengths)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(budgets, f)
+            os.replace(tmp_path, self.path)
@@ -0,0 +1,63 @@
+from PIL import Image
+
+from backends import StubBackend
+from model import TechnicalDrawingExtractor
+from prompt_generator import Prompt
+
+
+def _prompt(color: str = "white") -> list[dict]:
+    image = Image.new("RGB", (280, 280), color)
+    return Prompt.technical_drawing_extraction_prompt(
+        image_path=image, resized_width=280, resized_height=280
+    )
+
+
+def test_stub_replays_outputs_in_turn():
+    backend = StubBackend(outputs=["first", "second"], process_images=False)
+    prompts = [_prompt() for _ in range(3)]
+    inputs = backend.prepare(prompts)
+    outputs = backend.generate_batch(inputs, max_new_tokens=64)
+    assert outputs == ["first", "second", "first"]
+
+
+def test_stub_truncates_to_the_token_budget():
+    backend = StubBackend(outputs=["x" * 100], process_images=False)
+    inputs = backend.prepare([_prompt()])
+    outputs = backend.generate_batch(inputs, max_new_tokens=5)
+    texts, lengths = backend.decode(inputs, outputs)
+    assert texts == ["x" * 5 * StubBackend.CHARS_PER_TOKEN]
+    assert lengths == [5]
+
+
+def test_stub_processes_images():
+    backend = StubBackend()
+    metrics = {"spans": {}, "image_pixels": []}
+    backend.prepare([_prompt(), _prompt()], metrics=metrics)
+    assert metrics["image_pixels"] == [280 * 280, 280 * 280]
+    assert metrics["spans"]["load_images"] > 0
+
+
+def test_extractor_parses_stub_outputs():
+    output = "Material type: stainless steel\nPolishing: No"
+    extractor = TechnicalDrawingExtractor(
+        backend=StubBackend(outputs=[output], process_images=False)
+    )
+    results = extractor.run_batch([_prompt(), _prompt()], batch_size=1)
+    assert len(results) == 2
+    for (result,) in results:
+        assert result["material_type"]["material_type"] == "stainless steel"
+        assert result["polishing"] == "NO"
+    assert extractor.generation_stats()["drawings"] == 2
+
+
+def test_result_cache_skips_the_backend(tmp_path):
+    backend = StubBackend(process_images=False)
+    extractor = TechnicalDrawingExtractor(backend=backend, cache_dir=str(tmp_path))
+    prompts = [_prompt("white"), _prompt("black")]
+    first = extractor.run_batch(prompts)
+    assert backend._next_output == 2
+
+    second = extractor.run_batch([_prompt("black"), _prompt("white")])
+    assert backend._next_output == 2
+    assert second == first[::-1]
+    assert extractor.result_cache.stats()["hits"] == 2
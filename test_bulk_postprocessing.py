@@ -0,0 +1,68 @@
+import random
+
+from benchmarks.synthetic import make_raw_entry
+from bulk_postprocessing import ColumnarPostProcessor
+from post_processing import OCRPostProcessor
+
+# Values the rules must survive
+ODD_VALUES = [
+    "", "'", '""', "(())", "]]", "[[x", "nan", "±nan", "±inf", "±-1", "±0.1.2",
+    "±1e-3", "±0.0009", "⌀nanx3", "⌀(3)x[4]", "{3x4x5}", "'iron'", "  Ra0.8 ",
+    "YES", None, 5, 1.5, True, ["±0.1"], {"a": 1},
+]
+
+
+def _corpus(records: int, seed: int = 1) -> list:
+    rng = random.Random(seed)
+    entries = []
+    for i in range(records):
+        entry = make_raw_entry(rng)
+        if i % 2:
+            for field in entry:
+                if rng.random() < 0.3:
+                    entry[field] = rng.choice(ODD_VALUES)
+        if i % 7 == 0:
+            del entry[rng.choice(list(entry))]
+        entries.append(entry)
+    return entries
+
+
+def test_convert_many_matches_the_scalar_path():
+    scalar = OCRPostProcessor()
+    entries = _corpus(2000)
+    expected = [scalar.convert_to_output_format(entry) for entry in entries]
+    assert ColumnarPostProcessor(scalar).convert_many(entries) == expected
+
+
+def test_convert_many_falls_back_for_non_records():
+    scalar = OCRPostProcessor()
+    entries = [None, "not a record", ["Product code"], {}]
+    expected = [scalar.convert_to_output_format(entry) for entry in entries]
+    assert ColumnarPostProcessor(scalar).convert_many(entries) == expected
+
+
+def test_classify_tolerances_matches_the_scalar_rule():
+    scalar = OCRPostProcessor()
+    values = [
+        "±0.1", "±0.05", "±0.01", "±0.005", "±0.0005", "±0.6", "±0.05, ±0.01",
+        "±0.1 general tolerance", "general tolerance", "±abc", "no tolerance", "",
+        "±nan", "±inf", "±-1",
+    ]
+    expected = [scalar.postprocess_dimensional_tolerance_general(value) for value in values]
+    assert list(ColumnarPostProcessor(scalar).classify_tolerances(values)) == expected
+
+
+def test_rule_changes_are_picked_up():
+    scalar = OCRPostProcessor()
+    columnar = ColumnarPostProcessor(scalar)
+    entries = _corpus(200, seed=2)
+    columnar.convert_many(entries)
+
+    scalar.EXPECTED_VALUES = {
+        **scalar.EXPECTED_VALUES,
+        "Material type": ["iron"] + list(scalar.EXPECTED_VALUES["Material type"]),
+    }
+    scalar.compile_rules()
+    entries.append({**entries[0], "Material type": "IRON"})
+    expected = [scalar.convert_to_output_format(entry) for entry in entries]
+    assert columnar.convert_many(entries) == expected
@@ -0,0 +1,24 @@
+from PIL import Image
+
+from backends import StubBackend
+from model import TechnicalDrawingExtractor
+from prompt_generator import Prompt
+
+
+def _prompt(fields=None) -> list[dict]:
+    image = Image.new("RGB", (280, 280), "white")
+    return Prompt.technical_drawing_extraction_prompt(
+        image_path=image, resized_width=280, resized_height=280, fields=fields
+    )
+
+
+def test_token_budget_learns_from_full_extractions_only():
+    extractor = TechnicalDrawingExtractor(
+        backend=StubBackend(process_images=False), adaptive_max_new_tokens=True
+    )
+    subset = ["Material type", "Polishing"]
+    extractor.run_batch([_prompt(subset), _prompt(subset)], fields=[subset, subset])
+    assert list(extractor.token_budget.lengths) == []
+
+    extractor.run_batch([_prompt(subset), _prompt()], fields=[subset, None])
+    assert len(extractor.token_budget.lengths) == 1
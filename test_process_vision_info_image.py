@@ -1,10 +1,9 @@
-import base64
-import copy
 import math
-from io import BytesIO
 
 from PIL import Image
 
+from image_loader import DocumentPage, load_image, open_image
+
 MIN_PIXELS = 4 * 28 * 28
 MAX_PIXELS = 16384 * 28 * 28
 IMAGE_FACTOR = 28
@@ -67,28 +66,9 @@ def fetch_image(
     else:
         image = ele["image_url"]
 
-    image_obj = None
-    if isinstance(image, Image.Image):
-        image_obj = image
-    elif image.startswith("file://"):
-        image_obj = Image.open(image[7:])
-    elif image.startswith("data:image"):
-        if "base64," in image:
-            _, base64_data = image.split("base64,", 1)
-            data = base64.b64decode(base64_data)
-            with BytesIO(data) as bio:
-                image_obj = copy.deepcopy(Image.open(bio))
-    else:
-        image_obj = Image.open(image)
-
-    if image_obj is None:
-        raise ValueError(
-            f"Unrecognized image input, support local path, base64, and PIL.Image, got {image}"
-        )
-
-    image = image_obj.convert(
-        "RGB"
-    )  # fixed: previously used `Image.to_rgb`, which is not valid
+    # Read only the header first, so the decoder can target the final size.
+    # Document pages know their size already and are rendered once, at the end
+    image_obj = image if isinstance(image, DocumentPage) else open_image(image)
 
     # Resize logic
     if "resized_height" in ele and "resized_width" in ele:
@@ -98,7 +78,7 @@ def fetch_image(
             factor=size_factor,
         )
     else:
-        width, height = image.size
+        width, height = image_obj.size
         min_pixels = ele.get("min_pixels", MIN_PIXELS)
         max_pixels = ele.get("max_pixels", MAX_PIXELS)
         resized_height, resized_width = smart_resize(
@@ -108,7 +88,12 @@ def fetch_image(
             min_pixels=min_pixels,
             max_pixels=max_pixels,
         )
-    image = image.resize((resized_width, resized_height))
+    # An image opened here is not used again, so it is decoded in place and closed
+    image = load_image(
+        image_obj,
+        target_size=(resized_width, resized_height),
+        owned=image_obj is not image,
+    )
 
     return image
 
@@ -0,0 +1,83 @@
+import json
+import os
+
+import pytest
+
+from result_writer import JSONLResultWriter
+
+
+def _read(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_resume_skips_written_drawings(tmp_path):
+    path = str(tmp_path / "results.jsonl")
+    with JSONLResultWriter(path) as writer:
+        writer.write({"image_path": "a.png", "response": {"x": 1}})
+        writer.write({"image_path": "b.png", "response": {"x": 2}})
+
+    with JSONLResultWriter(path) as writer:
+        assert "a.png" in writer and "b.png" in writer
+        assert "c.png" not in writer
+        writer.write({"image_path": "c.png", "response": {"x": 3}})
+
+    assert [record["image_path"] for record in _read(path)] == ["a.png", "b.png", "c.png"]
+
+
+def test_resume_truncates_a_torn_record(tmp_path):
+    path = str(tmp_path / "results.jsonl")
+    with JSONLResultWriter(path) as writer:
+        writer.write({"image_path": "a.png"})
+    # Killed halfway through the next record, before it was indexed
+    with open(path, "ab") as f:
+        f.write(b'{"image_path": "b.p')
+
+    with JSONLResultWriter(path) as writer:
+        assert "b.png" not in writer
+        writer.write({"image_path": "b.png"})
+
+    assert [record["image_path"] for record in _read(path)] == ["a.png", "b.png"]
+
+
+def test_resume_ignores_a_torn_index_line(tmp_path):
+    path = str(tmp_path / "results.jsonl")
+    with JSONLResultWriter(path) as writer:
+        writer.write({"image_path": "a.png"})
+        writer.write({"image_path": "b.png"})
+    with open(path + JSONLResultWriter.INDEX_SUFFIX, "rb+") as f:
+        f.truncate(os.path.getsize(f.name) - 3)
+
+    with JSONLResultWriter(path) as writer:
+        assert "a.png" in writer and "b.png" not in writer
+
+    assert [record["image_path"] for record in _read(path)] == ["a.png"]
+
+
+def test_without_resume_starts_from_scratch(tmp_path):
+    path = str(tmp_path / "results.jsonl")
+    with JSONLResultWriter(path) as writer:
+        writer.write({"image_path": "a.png"})
+
+    with JSONLResultWriter(path, resume=False) as writer:
+        assert "a.png" not in writer
+
+    assert _read(path) == []
+
+
+def test_resume_refuses_results_without_an_index(tmp_path):
+    path = tmp_path / "results.jsonl"
+    path.write_text('{"image_path": "a.png"}\n', encoding="utf-8")
+    with pytest.raises(ValueError):
+        JSONLResultWriter(str(path))
+
+
+def test_resume_refuses_results_shorter_than_the_index(tmp_path):
+    path = str(tmp_path / "results.jsonl")
+    with JSONLResultWriter(path) as writer:
+        writer.write({"image_path": "a.png"})
+    os.remove(path)
+
+    with pytest.raises(ValueError):
+        JSONLResultWriter(path)
+    assert not os.path.exists(path)
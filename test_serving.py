@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+from PIL import Image
+
+from backends import StubBackend
+from model import TechnicalDrawingExtractor
+from serving import ExtractionService
+
+
+def _service(**kwargs) -> ExtractionService:
+    extractor = TechnicalDrawingExtractor(
+        backend=StubBackend(latency_ms=20.0, process_images=False)
+    )
+    return ExtractionService(extractor, **kwargs)
+
+
+def _drawing() -> Image.Image:
+    return Image.new("RGB", (320, 240), "white")
+
+
+def test_concurrent_requests_are_batched():
+    async def main():
+        async with _service(max_batch_size=8, max_wait_ms=50.0) as service:
+            results = await asyncio.gather(*(service.extract(_drawing()) for _ in range(8)))
+        return service, results
+
+    service, results = asyncio.run(main())
+    assert len(results) == 8
+    assert all(result["material_type"]["material_type"] == "stainless steel" for result in results)
+    stats = service.stats()
+    assert stats["requests"] == 8
+    assert stats["batches"] < 8
+    assert stats["queued"] == 0
+
+
+def test_stop_fails_a_partial_batch():
+    async def main():
+        service = _service(max_batch_size=4, max_wait_ms=60_000.0, max_queue_size=4)
+        await service.start()
+        requests = [
+            asyncio.create_task(service.extract(_drawing(), timeout=None)) for _ in range(2)
+        ]
+        # Both requests are taken off the queue, and the batch waits for two more
+        while not (service._queue._unfinished_tasks == 2 and service._queue.empty()):
+            await asyncio.sleep(0.01)
+
+        await asyncio.wait_for(service.stop(), 5)
+        results = await asyncio.wait_for(
+            asyncio.gather(*requests, return_exceptions=True), 5
+        )
+        return service, results
+
+    service, results = asyncio.run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert service._slots._value == 4
+
+
+def test_extract_requires_a_started_service():
+    with pytest.raises(RuntimeError):
+        asyncio.run(_service().extract(_drawing()))
@@ -0,0 +1,109 @@
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+# (left, top, right, bottom) in pixels of the full drawing
+Box = tuple[int, int, int, int]
+
+
+def _dark_mask(image: Image.Image, work_size: int) -> tuple[np.ndarray, int]:
+    """
+    Dark pixels of a grayscale thumbnail of the drawing.
+    :return: (boolean mask, reduction factor of the thumbnail)
+    """
+    factor = max(1, max(image.size) // work_size)
+    gray = image.convert("L")
+    if factor >= 2:
+        # Box averaging keeps strokes thinner than the factor as gray, not white
+        gray = gray.reduce(factor)
+    return np.asarray(gray) < 224, factor
+
+
+def _frame_edge(coverage: np.ndarray, fallback: int) -> int:
+    """
+    Last index whose line covers at least half the sheet, i.e. the outer edge of
+    the sheet frame, or `fallback` for a drawing without a frame.
+    """
+    edges = np.flatnonzero(coverage >= 0.5)
+    return int(edges[-1]) if edges.size else fallback
+
+
+def find_title_block(
+    image: Image.Image,
+    work_size: int = 1024,
+    min_size: float = 0.1,
+    max_size: float = 0.7,
+) -> Optional[Box]:
+    """
+    Locate the title block in the bottom right corner of the sheet frame, where
+    ISO 7200 and most company templates put it.
+
+    The drawing is thresholded on a thumbnail. The right and bottom edges of the
+    frame are the last columns and rows that are dark over half the sheet. The
+    top edge of the title block is the highest horizontal line that runs
+    unbroken into the right frame edge and whose left end continues as a
+    vertical line down to the bottom frame edge. Text and part outlines do not
+    form such a corner, so no connected components are needed.
+    :param image: Decoded drawing.
+    :param work_size: Longest side of the thumbnail the lines are searched in.
+    :param min_size: Smallest side of the title block, as a fraction of the sheet side.
+    :param max_size: Largest side of the title block, as a fraction of the sheet side.
+    :return: Box of the title block in pixels of `image`, or None when the sheet
+        has no such corner.
+    """
+    dark, factor = _dark_mask(image, work_size)
+    height, width = dark.shape
+    right = _frame_edge(dark.mean(axis=0), width - 1)
+    bottom = _frame_edge(dark.mean(axis=1), height - 1)
+
+    # Length of the dark run of every row that ends at the right frame edge
+    ending = dark[: bottom + 1, right::-1]
+    run = np.where(ending.all(axis=1), right + 1, np.argmax(~ending, axis=1))
+    lefts = right + 1 - run
+    candidates = np.flatnonzero(
+        (run >= min_size * width)
+        & (run <= max_size * width)
+        & (np.arange(bottom + 1) <= bottom - min_size * height)
+        & (np.arange(bottom + 1) >= bottom - max_size * height)
+    )
+
+    tolerance = max(1, work_size // 500)
+    for top in candidates:
+        left = lefts[top]
+        edge = dark[top : bottom + 1, max(0, left - tolerance) : left + tolerance + 1]
+        if edge.any(axis=1).mean() >= 0.95:
+            return (
+                int(left * factor),
+                int(top * factor),
+                min(image.width, int((right + 1) * factor)),
+                min(image.height, int((bottom + 1) * factor)),
+            )
+    return None
+
+
+def crop_title_block(
+    image: Image.Image, box: Optional[Box] = None, margin: float = 0.01
+) -> tuple[Image.Image, Box]:
+    """
+    Crop the title block out of a drawing, with a small margin around its frame.
+    :param image: Decoded drawing.
+    :param box: Box returned by `find_title_block`, searched for when None.
+    :param margin: Margin added on every side, as a fraction of the longest sheet side.
+    :return: (cropped image, cropped box). The whole drawing when no title block
+        is found.
+    """
+    if box is None:
+        box = find_title_block(image)
+    if box is None:
+        return image, (0, 0, image.width, image.height)
+
+    pad = int(max(image.size) * margin)
+    left, top, right, bottom = box
+    box = (
+        max(0, left - pad),
+        max(0, top - pad),
+        min(image.width, right + pad),
+        min(image.height, bottom + pad),
+    )
+    return image.crop(box), box
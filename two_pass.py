@@ -0,0 +1,175 @@
+from typing import Optional
+
+from image_loader import ImageSource
+from model import TechnicalDrawingExtractor
+from pipeline import load_prompt, target_size
+
+# Side of a vision patch; 2x2 patches are merged into one visual token
+PATCH_SIZE = 14
+
+
+class TwoPassExtractor:
+    """
+    Resolution-adaptive extraction: thumbnail first, zoom on demand.
+
+    Every drawing is first read with a small pixel budget, which is enough for
+    the large print of the title block. Only the fields that come back empty or
+    invalid after post-processing are asked again, at the extractor's full
+    `max_pixels`, with a prompt listing just those fields. Their answers are
+    merged into the first result.
+
+    A drawing served from the result cache has no raw output, so its shape and
+    yes/no flags are taken from the first pass as they are.
+    """
+
+    def __init__(
+        self,
+        extractor: TechnicalDrawingExtractor,
+        low_max_pixels: Optional[int] = None,
+        batch_size: int = 4,
+        max_new_tokens: int = 512,
+        upscale: int = 2,
+    ) -> None:
+        """
+        :param extractor: Extractor running both passes.
+        :param low_max_pixels: Pixel budget of the first pass. Defaults to the
+            extractor's `min_pixels`; below it the processor would upscale again.
+        :param batch_size: Drawings per `generate` call, in both passes.
+        :param max_new_tokens: Maximum number of tokens generated per drawing and pass.
+        :param upscale: Factor applied to the image size before `smart_resize`.
+        """
+        low_max_pixels = low_max_pixels or extractor.min_pixels
+        if not extractor.min_pixels <= low_max_pixels <= extractor.max_pixels:
+            raise ValueError(
+                f"low_max_pixels must be between min_pixels ({extractor.min_pixels}) "
+                f"and max_pixels ({extractor.max_pixels}), got {low_max_pixels}"
+            )
+
+        self.extractor = extractor
+        self.low_max_pixels = low_max_pixels
+        self.batch_size = batch_size
+        self.max_new_tokens = max_new_tokens
+        self.upscale = upscale
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        self.totals = {
+            "drawings": 0,
+            "second_pass_drawings": 0,
+            "second_pass_fields": 0,
+            "visual_patches": 0,
+            "single_pass_visual_patches": 0,
+            "generated_tokens": 0,
+        }
+
+    @staticmethod
+    def _patches(size: tuple[int, int]) -> int:
+        width, height = size
+        return (width // PATCH_SIZE) * (height // PATCH_SIZE)
+
+    def _run_pass(
+        self,
+        prompts: list[list[dict]],
+        fields: Optional[list[Optional[list[str]]]] = None,
+    ) -> list[tuple[list, Optional[str]]]:
+        tokens_before = self.extractor.generation_totals["generated_tokens"]
+        responses = self.extractor.run_batch(
+            prompts,
+            batch_size=self.batch_size,
+            max_new_tokens=self.max_new_tokens,
+            return_raw=True,
+            fields=fields,
+        )
+        self.totals["generated_tokens"] += (
+            self.extractor.generation_totals["generated_tokens"] - tokens_before
+        )
+        for prompt in prompts:
+            image_element = self.extractor.image_elements(prompt)[0]
+            self.totals["visual_patches"] += self._patches(
+                (image_element["resized_width"], image_element["resized_height"])
+            )
+        return responses
+
+    def run(self, images: list[ImageSource]) -> list[list[dict]]:
+        """
+        Run two-pass extraction over `images`.
+        :param images: Paths to the drawings or decoded `PIL.Image`s.
+        :return: Parsed results, in the same order as `images`, each a list
+            holding the merged output of the drawing like `run_batch` returns.
+        """
+        parser = self.extractor.model_parser
+        thumbnails = self._run_pass(
+            [
+                load_prompt(
+                    self.extractor,
+                    image,
+                    max_new_tokens=self.max_new_tokens,
+                    upscale=self.upscale,
+                    max_pixels=self.low_max_pixels,
+                )
+                for image in images
+            ]
+        )
+        # An output that did not parse has every field missing
+        responses = [
+            response[0] if response else parser.convert_to_output_format({})
+            for response, _ in thumbnails
+        ]
+        missing = [
+            parser.missing_fields(response, raw_text)
+            for response, (_, raw_text) in zip(responses, thumbnails)
+        ]
+        second_pass = [index for index, fields in enumerate(missing) if fields]
+        zoomed = self._run_pass(
+            [
+                load_prompt(
+                    self.extractor,
+                    images[index],
+                    max_new_tokens=self.max_new_tokens,
+                    upscale=self.upscale,
+                    fields=missing[index],
+                )
+                for index in second_pass
+            ],
+            # Decoding is held to, and stops after, the fields asked again
+            fields=[missing[index] for index in second_pass],
+        )
+        for index, (response, raw_text) in zip(second_pass, zoomed):
+            if response:
+                responses[index] = parser.merge_fields(
+                    responses[index], response[0], missing[index], raw_text
+                )
+
+        self.totals["drawings"] += len(images)
+        self.totals["second_pass_drawings"] += len(second_pass)
+        self.totals["second_pass_fields"] += sum(len(fields) for fields in missing)
+        self.totals["single_pass_visual_patches"] += sum(
+            self._patches(target_size(self.extractor, image, self.upscale))
+            for image in images
+        )
+        return [[response] for response in responses]
+
+    def stats(self) -> dict:
+        """
+        Visual patches and generated tokens per drawing, against reading every
+        drawing once at full resolution. Each visual token covers 4 patches.
+        """
+        totals = dict(self.totals)
+        drawings = totals["drawings"] or 1
+        saved_patches = totals["single_pass_visual_patches"] - totals["visual_patches"]
+        totals["second_pass_fraction"] = totals["second_pass_drawings"] / drawings
+        totals["visual_patches_per_drawing"] = totals["visual_patches"] / drawings
+        totals["saved_visual_patches_per_drawing"] = saved_patches / drawings
+        totals["saved_visual_tokens_per_drawing"] = saved_patches / 4 / drawings
+        totals["generated_tokens_per_drawing"] = totals["generated_tokens"] / drawings
+        return totals
+
+    def report(self) -> str:
+        stats = self.stats()
+        return (
+            f"Two-pass: {stats['second_pass_drawings']}/{stats['drawings']} drawings "
+            f"zoomed in ({stats['second_pass_fraction']:.0%}), "
+            f"{stats['saved_visual_patches_per_drawing']:.0f} visual patches "
+            f"({stats['saved_visual_tokens_per_drawing']:.0f} tokens) saved per drawing, "
+            f"{stats['generated_tokens_per_drawing']:.0f} generated tokens per drawing"
+        )